@@ -8,8 +8,10 @@ from datetime import datetime
 # Импортируем модули из нашего приложения
 from server.database import engine, get_db, Base, init_db
 from server.models import models
-from server.routes import auth, csv_files, dashboards
+from server.routes import auth, changes, csv_files, dashboards, file_versions, metrics, uploads
 from server.config import settings
+from server.middleware.admission import AdmissionMiddleware
+from server.middleware.read_your_writes import ReadYourWritesMiddleware
 from server.auth.password import verify_password
 from server.auth.jwt import create_access_token
 
@@ -23,6 +25,12 @@ app = FastAPI(
     version="0.1.0"
 )
 
+# После записи пользователь ненадолго читает из основной базы, а не из реплик
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Контроль допуска для тяжелых запросов (добавляется раньше CORS, чтобы ответы 503 тоже получали CORS заголовки)
+app.add_middleware(AdmissionMiddleware)
+
 # Настраиваем CORS
 app.add_middleware(
     CORSMiddleware,
@@ -35,7 +43,11 @@ app.add_middleware(
 # Подключаем маршруты
 app.include_router(auth.router)
 app.include_router(csv_files.router)
+app.include_router(file_versions.router)
 app.include_router(dashboards.router)
+app.include_router(uploads.router)
+app.include_router(changes.router)
+app.include_router(metrics.router)
 
 # Базовый маршрут для проверки работы API
 @app.get("/")
@@ -114,6 +126,17 @@ async def login_json(data: dict):
 # Инициализация базы данных при запуске
 @app.on_event("startup")
 async def startup_event():
+    # Пересылка уведомлений об изменениях между воркерами
+    import asyncio
+    from server.services.change_hub import change_hub
+    change_hub.start(asyncio.get_running_loop())
+    # Измерение задержки цикла событий для /api/metrics
+    from server.services.file_io import loop_lag
+    loop_lag.start()
+    # Фоновое освобождение места после удалений
+    from server.services.reclaimer import reclaimer
+    reclaimer.start()
+    
     try:
         # Инициализируем базу данных
         init_db()
@@ -124,6 +147,26 @@ async def startup_event():
         run_migrations()
         print("Миграции выполнены успешно")
         
+        # Удаляем блобы, на которые не осталось ссылок
+        from server.storage.blobs import collect_garbage
+        gc_db = next(get_db())
+        try:
+            removed = collect_garbage(gc_db)
+            if removed:
+                print(f"Удалено неиспользуемых блобов: {removed}")
+            # Удаляем фрагменты версий, на которые не ссылается ни одна версия
+            from server.services.version_history import collect_garbage as collect_version_garbage
+            removed = collect_version_garbage(gc_db)
+            if removed:
+                print(f"Удалено неиспользуемых фрагментов версий: {removed}")
+            # Удаляем брошенные сессии возобновляемой загрузки
+            from server.services.resumable_upload import collect_expired_sessions
+            expired = collect_expired_sessions(gc_db)
+            if expired:
+                print(f"Удалено просроченных сессий загрузки: {expired}")
+        finally:
+            gc_db.close()
+        
         # Создаем тестового пользователя admin, если его нет
         db = next(get_db())
         user_count = db.query(models.User).count()
@@ -143,12 +186,16 @@ async def startup_event():
         print(f"Ошибка при инициализации базы данных: {e}")
         print("Сервер запущен без подключения к БД")
 
-# Запуск сервера
+@app.on_event("shutdown")
+async def shutdown_event():
+    from server.services.change_hub import change_hub
+    from server.services.file_io import loop_lag
+    from server.services.reclaimer import reclaimer
+    change_hub.stop()
+    loop_lag.stop()
+    reclaimer.stop()
+
+# Запуск сервера (для разработки с автоперезагрузкой: SERVER_RELOAD=true)
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "app:app",
-        host="0.0.0.0",
-        port=int(os.getenv("PORT", 3001)),
-        reload=True
-    ) 
\ No newline at end of file
+    from server.serve import main
+    main()
@@ -0,0 +1,65 @@
+"""Сравнение результатов бенчмарка с базовыми (baseline)
+
+Пример запуска:
+    python -m benchmarks.compare baseline.json results.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as report_file:
+        return json.load(report_file)
+
+def _key(result):
+    return (result["scenario"], result.get("rows"), result["concurrency"])
+
+def _change(old, new):
+    """Относительное изменение в процентах"""
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+def compare_reports(baseline, current, threshold=10.0):
+    """Печатает сравнение и возвращает список регрессий сверх порога (в процентах)"""
+    baseline_results = {_key(result): result for result in baseline.get("results", [])}
+    regressions = []
+
+    for result in current.get("results", []):
+        key = _key(result)
+        old = baseline_results.get(key)
+        if old is None:
+            print(f"{key}: no baseline")
+            continue
+
+        throughput_change = _change(old["throughput_rps"], result["throughput_rps"])
+        p95_change = _change(old["latency_ms"]["p95"], result["latency_ms"]["p95"])
+        p99_change = _change(old["latency_ms"]["p99"], result["latency_ms"]["p99"])
+
+        regressed = throughput_change < -threshold or p95_change > threshold
+        if regressed:
+            regressions.append(key)
+
+        scenario, rows, concurrency = key
+        print(
+            f"{'REGRESSION' if regressed else 'ok':<10} {scenario:<10} rows={rows or '-':<9} c={concurrency:<4} "
+            f"rps {throughput_change:+.1f}%  p95 {p95_change:+.1f}%  p99 {p99_change:+.1f}%"
+        )
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарка")
+    parser.add_argument("baseline", help="JSON с базовыми результатами")
+    parser.add_argument("current", help="JSON с текущими результатами")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Допустимое ухудшение в процентах")
+    args = parser.parse_args()
+
+    regressions = compare_reports(load_report(args.baseline), load_report(args.current), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold}%")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Генератор синтетических CSV файлов, похожих на реальные выгрузки пользователей"""
+import argparse
+import csv
+import os
+import random
+from datetime import date, timedelta
+
+# Заголовки повторяют структуру реальных выгрузок (см. uploads/1/1.csv)
+# и дополнены числовыми столбцами для агрегаций
+HEADERS = [
+    "Порядковый номер",
+    "Дата постановки",
+    "Ответственный",
+    "Наименование задачи",
+    "Срок выполнения задачи",
+    "Статус",
+    "Трудозатраты",
+    "Стоимость",
+]
+
+RESPONSIBLES = ["СИГМА", "ОМЕГА", "Иванов И.И.", "Петров П.П.", "Сидорова А.В.", "ГИП", "Смирнов С.С."]
+STATUSES = ["Выполненные", "В работе", "Просроченные", "Отложенные", "Новые"]
+VERBS = ["Устранить", "Предложить", "Переподключить", "Переделать", "Согласовать", "Проверить", "Обновить"]
+OBJECTS = [
+    "пересечения с ЖБ балками",
+    "вариант трассировки в зоне коридора",
+    "решетки на верхнее подключение",
+    "компоновку в зоне столовой",
+    "спецификацию оборудования",
+    "узлы прохода через перекрытия",
+    "схему вентиляции, этаж 3",
+]
+
+START_DATE = date(2024, 1, 1)
+
+def generate_rows(rows: int, seed: int = 42):
+    """Генерирует строки данных детерминированно для заданного seed"""
+    rnd = random.Random(seed)
+    for index in range(1, rows + 1):
+        created = START_DATE + timedelta(days=rnd.randint(0, 730))
+        deadline = created + timedelta(days=rnd.randint(0, 60))
+        yield [
+            f"{index:02d}",
+            created.strftime("%d.%m.%Y"),
+            rnd.choice(RESPONSIBLES),
+            f"{rnd.choice(VERBS)} {rnd.choice(OBJECTS)}",
+            deadline.strftime("%d.%m.%Y"),
+            rnd.choice(STATUSES),
+            str(rnd.randint(1, 80)),
+            f"{rnd.uniform(100, 250000):.2f}",
+        ]
+
+def write_csv(path: str, rows: int, seed: int = 42) -> int:
+    """Записывает CSV файл потоково и возвращает его размер в байтах"""
+    with open(path, "w", newline="", encoding="utf-8") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(HEADERS)
+        batch = []
+        for row in generate_rows(rows, seed):
+            batch.append(row)
+            if len(batch) >= 10000:
+                csv_writer.writerows(batch)
+                batch.clear()
+        csv_writer.writerows(batch)
+    return os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетического CSV файла")
+    parser.add_argument("output", help="Путь к создаваемому файлу")
+    parser.add_argument("--rows", type=int, default=1000, help="Количество строк (от 1K до 10M)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed генератора для воспроизводимости")
+    args = parser.parse_args()
+
+    size = write_csv(args.output, args.rows, args.seed)
+    print(f"Создан файл {args.output}: {args.rows} строк, {size} байт")
+
+if __name__ == "__main__":
+    main()
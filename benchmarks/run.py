@@ -0,0 +1,301 @@
+"""Нагрузочный бенчмарк API: приложение FastAPI запускается в том же процессе
+
+Пример запуска:
+    python -m benchmarks.run --rows 1000,100000 --concurrency 1,8,32 --output results.json
+    python -m benchmarks.run --baseline baseline.json --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ["upload", "content", "list", "login", "dashboard"]
+
+# Сценарии, результаты которых зависят от размера файла
+SIZED_SCENARIOS = {"upload", "content"}
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+def percentile(sorted_values, p):
+    """Возвращает перцентиль по отсортированному списку (линейная интерполяция)"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+def summarize(latencies, errors, wall_time):
+    """Собирает статистику по задержкам одного прогона"""
+    ordered = sorted(latencies)
+    total = len(ordered) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "wall_time_s": round(wall_time, 4),
+        "throughput_rps": round(len(ordered) / wall_time, 2) if wall_time > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+
+async def run_load(make_request, total, concurrency):
+    """Выполняет total запросов с ограничением параллельности concurrency"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(index)
+                ok = response.status_code < 400
+            except Exception as e:
+                print(f"Request failed: {str(e)}")
+                ok = False
+            elapsed = time.perf_counter() - started
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+class BenchmarkContext:
+    """Состояние бенчмарка: клиент, токен и подготовленные файлы"""
+
+    def __init__(self, client, token, workdir):
+        self.client = client
+        self.token = token
+        self.workdir = workdir
+        self.datasets = {}  # rows -> путь к синтетическому CSV
+        self.uploaded = {}  # rows -> id загруженного файла
+        self.dashboard_id = None
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def dataset(self, rows, seed):
+        """Создает (или переиспользует) синтетический CSV нужного размера"""
+        if rows not in self.datasets:
+            from benchmarks.generate_csv import write_csv
+            path = os.path.join(self.workdir, f"synthetic_{rows}.csv")
+            size = write_csv(path, rows, seed)
+            print(f"Generated {path}: {rows} rows, {size} bytes")
+            self.datasets[rows] = path
+        return self.datasets[rows]
+
+    async def upload(self, rows):
+        path = self.datasets[rows]
+        with open(path, "rb") as source:
+            return await self.client.post(
+                "/api/csv-files/upload",
+                headers=self.headers,
+                files={"file": (os.path.basename(path), source, "text/csv")},
+            )
+
+    async def ensure_uploaded(self, rows):
+        if rows not in self.uploaded:
+            response = await self.upload(rows)
+            response.raise_for_status()
+            self.uploaded[rows] = response.json()["id"]
+        return self.uploaded[rows]
+
+    async def ensure_dashboard(self):
+        if self.dashboard_id is None:
+            response = await self.client.post(
+                "/api/dashboards/",
+                headers=self.headers,
+                json={
+                    "name": "Benchmark",
+                    "description": "Дашборд для нагрузочного теста",
+                    "layout": [
+                        {"i": f"widget-{i}", "type": "bar", "x": 0, "y": i, "w": 4, "h": 3,
+                         "title": f"Виджет {i}", "dataSource": "synthetic.csv", "dataColumn": "Статус"}
+                        for i in range(8)
+                    ],
+                    "is_public": False,
+                },
+            )
+            response.raise_for_status()
+            self.dashboard_id = response.json()["id"]
+        return self.dashboard_id
+
+async def build_request(context, scenario, rows):
+    """Возвращает функцию, выполняющую один запрос сценария"""
+    client = context.client
+
+    if scenario == "upload":
+        return lambda _: context.upload(rows)
+
+    if scenario == "content":
+        file_id = await context.ensure_uploaded(rows)
+        return lambda _: client.get(f"/api/csv-files/content/{file_id}", headers=context.headers)
+
+    if scenario == "list":
+        return lambda _: client.get("/api/csv-files/", headers=context.headers)
+
+    if scenario == "login":
+        return lambda _: client.post(
+            "/api/auth/login",
+            data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD},
+        )
+
+    if scenario == "dashboard":
+        dashboard_id = await context.ensure_dashboard()
+
+        def request(index):
+            # Чередуем получение конкретного дашборда и списка дашбордов
+            if index % 2:
+                return client.get("/api/dashboards/", headers=context.headers)
+            return client.get(f"/api/dashboards/{dashboard_id}", headers=context.headers)
+        return request
+
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+def prepare_application(database_url, workdir):
+    """Импортирует приложение с нужной БД и создает пользователя для бенчмарка"""
+    # Настройки читаются при импорте, поэтому переменная окружения задается заранее
+    os.environ["DATABASE_URL"] = database_url
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    from app import app
+    from server.database import SessionLocal, init_db
+    from server.models import models
+    from server.auth.password import get_password_hash
+
+    # Файлы загружаются в uploads/ относительно рабочей директории
+    os.chdir(workdir)
+    init_db()
+
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == BENCH_USERNAME).first()
+        if not user:
+            db.add(models.User(
+                username=BENCH_USERNAME,
+                email="bench@example.com",
+                password=get_password_hash(BENCH_PASSWORD),
+                role="user",
+            ))
+            db.commit()
+    finally:
+        db.close()
+
+    return app
+
+async def run_benchmarks(args, workdir):
+    import httpx
+
+    app = prepare_application(args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}", workdir)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post(
+            "/api/auth/login",
+            data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD},
+        )
+        response.raise_for_status()
+        context = BenchmarkContext(client, response.json()["access_token"], workdir)
+
+        results = []
+        for scenario in args.scenarios:
+            sizes = args.rows if scenario in SIZED_SCENARIOS else [None]
+            for rows in sizes:
+                if rows is not None:
+                    context.dataset(rows, args.seed)
+                make_request = await build_request(context, scenario, rows)
+
+                # Прогрев: первый запрос не учитывается в статистике
+                await make_request(0)
+
+                for concurrency in args.concurrency:
+                    stats = await run_load(make_request, args.requests, concurrency)
+                    stats.update({"scenario": scenario, "rows": rows, "concurrency": concurrency})
+                    results.append(stats)
+                    print(
+                        f"{scenario:<10} rows={rows or '-':<9} c={concurrency:<4} "
+                        f"{stats['throughput_rps']:>9.1f} rps  "
+                        f"p50={stats['latency_ms']['p50']:.1f}ms "
+                        f"p95={stats['latency_ms']['p95']:.1f}ms "
+                        f"p99={stats['latency_ms']['p99']:.1f}ms "
+                        f"errors={stats['errors']}"
+                    )
+        return results
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк CSV Data Processor API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Сценарии через запятую ({', '.join(SCENARIOS)})")
+    parser.add_argument("--rows", type=parse_int_list, default=[1000, 100000],
+                        help="Размеры синтетических файлов в строках, через запятую")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 8, 32],
+                        help="Уровни параллельности, через запятую")
+    parser.add_argument("--requests", type=int, default=100, help="Количество запросов на каждый прогон")
+    parser.add_argument("--seed", type=int, default=42, help="Seed генератора данных")
+    parser.add_argument("--database-url", default=None,
+                        help="URL базы данных (по умолчанию временная SQLite)")
+    parser.add_argument("--workdir", default=None, help="Рабочая директория (по умолчанию временная)")
+    parser.add_argument("--output", default="bench_results.json", help="Файл для JSON результатов")
+    parser.add_argument("--baseline", default=None, help="JSON с базовыми результатами для сравнения")
+    args = parser.parse_args()
+
+    args.scenarios = [item.strip() for item in args.scenarios.split(",") if item.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="naviserv-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    started_at = datetime.utcnow()
+    results = asyncio.run(run_benchmarks(args, workdir))
+
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": "postgresql" if args.database_url and "postgresql" in args.database_url else "sqlite",
+            "requests_per_run": args.requests,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+    print(f"Results written to {output_path}")
+
+    if baseline_path:
+        from benchmarks.compare import compare_reports, load_report
+        regressions = compare_reports(load_report(baseline_path), report)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
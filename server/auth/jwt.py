@@ -5,7 +5,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from server.models import models
-from server.database import get_db
+from server.database import get_read_db
 from server.config.settings import settings
 from pydantic import BaseModel
 
@@ -39,8 +39,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Получает текущего пользователя по токену"""
+def get_user_from_token(token: str, db: Session) -> models.User:
+    """Получает пользователя по токену (также для SSE и WebSocket, где токен передается в параметре)"""
     # Обработка ошибок аутентификации
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,6 +75,13 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         
     return user
 
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    """Получает текущего пользователя по токену"""
+    user = get_user_from_token(token, db)
+    # Завершаем транзакцию чтения: соединение возвращается в пул, не дожидаясь конца запроса
+    db.commit()
+    return user
+
 def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     """Проверяет, что пользователь активен"""
     if not current_user.is_active:
@@ -18,6 +18,14 @@ class Settings(BaseSettings):
     # Строка подключения к базе данных
     DATABASE_URL: str = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     
+    # Реплики для чтения: строки подключения через запятую (пусто - все запросы в основную базу),
+    # интервал проверки доступности реплики (сек) и сколько секунд после записи пользователь читает
+    # из основной базы (отметки о записи хранятся в каталоге, общем для воркеров)
+    DATABASE_REPLICA_URLS: str = os.getenv("DATABASE_REPLICA_URLS", "")
+    DATABASE_REPLICA_CHECK_INTERVAL: float = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "5"))
+    DATABASE_STICKY_SECONDS: float = float(os.getenv("DATABASE_STICKY_SECONDS", "5"))
+    DATABASE_STICKY_DIR: str = os.getenv("DATABASE_STICKY_DIR", "")
+    
     # Настройки JWT
     JWT_SECRET: str = os.getenv("JWT_SECRET", "your-secret-key-for-jwt-tokens")
     JWT_ALGORITHM: str = "HS256"
@@ -25,7 +33,118 @@ class Settings(BaseSettings):
     
     # Настройки сервера
     API_PREFIX: str = "/api"
+    # Каталог для загруженных файлов и производных данных
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
+    # Неиспользуемые блобы удаляются не раньше, чем через это время после последней записи (сек)
+    BLOB_GC_GRACE_SECONDS: int = int(os.getenv("BLOB_GC_GRACE_SECONDS", "600"))
+    # Формат хранения загрузок: plain - как есть, blocks - независимо сжатые блоки с индексом
+    STORAGE_FORMAT: str = os.getenv("STORAGE_FORMAT", "plain")
+    STORAGE_CODEC: str = os.getenv("STORAGE_CODEC", "gzip")  # gzip или zstd (нужен пакет zstandard)
+    STORAGE_BLOCK_SIZE: int = int(os.getenv("STORAGE_BLOCK_SIZE", str(1024 * 1024)))
+    # Параллельный разбор CSV: процессы пула (0 - по количеству ядер), размер диапазона
+    # и минимальный размер файла (байты), начиная с которого используется пул
+    SCAN_WORKERS: int = int(os.getenv("SCAN_WORKERS", "0"))
+    SCAN_RANGE_SIZE: int = int(os.getenv("SCAN_RANGE_SIZE", str(32 * 1024 ** 2)))
+    SCAN_PARALLEL_MIN_SIZE: int = int(os.getenv("SCAN_PARALLEL_MIN_SIZE", str(64 * 1024 ** 2)))
+    # SQL запросы к файлам: размер кеша загруженных таблиц на воркер (байты), время выполнения (сек),
+    # максимум строк результата, кеш страниц запроса (байты), размер кеша подготовленных запросов
+    # и максимальный размер файла, который можно загрузить в таблицу (байты)
+    QUERY_CACHE_MAX_BYTES: int = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+    QUERY_TIMEOUT: float = float(os.getenv("QUERY_TIMEOUT", "10"))
+    QUERY_MAX_ROWS: int = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+    QUERY_MEMORY_LIMIT: int = int(os.getenv("QUERY_MEMORY_LIMIT", str(64 * 1024 ** 2)))
+    QUERY_STATEMENT_CACHE: int = int(os.getenv("QUERY_STATEMENT_CACHE", "128"))
+    QUERY_MAX_FILE_SIZE: int = int(os.getenv("QUERY_MAX_FILE_SIZE", str(256 * 1024 ** 2)))
+    # Соединение файлов (hash join): память под хеш-таблицу (байты), сверх которой строки уходят во временные
+    # разделы, каталог разделов (пусто - системный временный каталог) и глубина повторного разбиения разделов
+    JOIN_MEMORY_LIMIT: int = int(os.getenv("JOIN_MEMORY_LIMIT", str(128 * 1024 ** 2)))
+    JOIN_SPILL_DIR: str = os.getenv("JOIN_SPILL_DIR", "")
+    JOIN_MAX_DEPTH: int = int(os.getenv("JOIN_MAX_DEPTH", "3"))
+    # Временные ряды: число точек после прореживания по умолчанию и максимальное
+    TIMESERIES_DEFAULT_POINTS: int = int(os.getenv("TIMESERIES_DEFAULT_POINTS", "500"))
+    TIMESERIES_MAX_POINTS: int = int(os.getenv("TIMESERIES_MAX_POINTS", "5000"))
+    # Максимум категорий в данных виджета, вычисляемых на сервере
+    WIDGET_MAX_GROUPS: int = int(os.getenv("WIDGET_MAX_GROUPS", "100"))
+    # Кеш результатов (содержимое, временные ряды, данные виджетов): размер в памяти воркера и
+    # максимальный размер одной записи (байты), каталог и размер дискового уровня (0 - без диска)
+    RESULT_CACHE_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(128 * 1024 ** 2)))
+    RESULT_CACHE_MAX_ENTRY_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(16 * 1024 ** 2)))
+    RESULT_CACHE_DIR: str = os.getenv("RESULT_CACHE_DIR", "")
+    RESULT_CACHE_DISK_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1024 ** 3)))
+    # Возобновляемые загрузки: максимальный размер файла, фрагмента (байты) и время жизни сессии без активности (сек)
+    UPLOAD_MAX_SIZE: int = int(os.getenv("UPLOAD_MAX_SIZE", str(20 * 1024 ** 3)))
+    UPLOAD_CHUNK_MAX_SIZE: int = int(os.getenv("UPLOAD_CHUNK_MAX_SIZE", str(64 * 1024 ** 2)))
+    UPLOAD_SESSION_TTL: int = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))
+    # История версий файлов: сколько прежних версий хранить на файл (0 - история отключена) и сколько дней
+    # (0 - без ограничения), размеры фрагментов с границами по содержимому (байты), ограничения сравнения
+    # версий: строк в ответе и объем изменившихся фрагментов (байты), сверх которого строки не сравниваются
+    VERSION_HISTORY_MAX_VERSIONS: int = int(os.getenv("VERSION_HISTORY_MAX_VERSIONS", "20"))
+    VERSION_HISTORY_MAX_AGE_DAYS: int = int(os.getenv("VERSION_HISTORY_MAX_AGE_DAYS", "0"))
+    VERSION_CHUNK_MIN_SIZE: int = int(os.getenv("VERSION_CHUNK_MIN_SIZE", str(256 * 1024)))
+    VERSION_CHUNK_AVG_SIZE: int = int(os.getenv("VERSION_CHUNK_AVG_SIZE", str(1024 * 1024)))
+    VERSION_CHUNK_MAX_SIZE: int = int(os.getenv("VERSION_CHUNK_MAX_SIZE", str(4 * 1024 ** 2)))
+    VERSION_DIFF_MAX_ROWS: int = int(os.getenv("VERSION_DIFF_MAX_ROWS", "1000"))
+    VERSION_DIFF_MAX_BYTES: int = int(os.getenv("VERSION_DIFF_MAX_BYTES", str(64 * 1024 ** 2)))
+    # Загрузка файлов в других форматах (XLSX, CSV не в UTF-8 или не с запятой): размер образца для определения
+    # кодировки и разделителя (байты) и кодировка файлов, которые не являются корректным UTF-8
+    INGEST_SNIFF_BYTES: int = int(os.getenv("INGEST_SNIFF_BYTES", str(64 * 1024)))
+    INGEST_FALLBACK_ENCODING: str = os.getenv("INGEST_FALLBACK_ENCODING", "windows-1251")
+    # Массовый импорт (ZIP или несколько файлов): максимум файлов в запросе и суммарный размер содержимого (байты)
+    BULK_IMPORT_MAX_FILES: int = int(os.getenv("BULK_IMPORT_MAX_FILES", "1000"))
+    BULK_IMPORT_MAX_BYTES: int = int(os.getenv("BULK_IMPORT_MAX_BYTES", str(20 * 1024 ** 3)))
+    # Пакетные запросы (batch-get, batch-delete): максимум id в запросе
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+    # Фоновое освобождение места после удалений: интервал повторных попыток для блобов, которые еще читают (сек)
+    RECLAIM_INTERVAL_SECONDS: float = float(os.getenv("RECLAIM_INTERVAL_SECONDS", "30"))
+    # Уведомления об изменениях (SSE/WebSocket): очередь событий на соединение, интервал keep-alive (сек),
+    # максимум тем на соединение, пересылка между воркерами через unix сокеты (каталог, размер датаграммы)
+    # и ограничения дельты строк в событии (изменившихся строк и размер файла в байтах)
+    CHANGES_QUEUE_SIZE: int = int(os.getenv("CHANGES_QUEUE_SIZE", "64"))
+    CHANGES_KEEPALIVE: float = float(os.getenv("CHANGES_KEEPALIVE", "20"))
+    CHANGES_MAX_TOPICS: int = int(os.getenv("CHANGES_MAX_TOPICS", "100"))
+    CHANGES_RELAY_ENABLED: bool = os.getenv("CHANGES_RELAY_ENABLED", "true").lower() == "true"
+    CHANGES_SOCKET_DIR: str = os.getenv("CHANGES_SOCKET_DIR", "")
+    CHANGES_RELAY_MAX_BYTES: int = int(os.getenv("CHANGES_RELAY_MAX_BYTES", str(64 * 1024)))
+    CHANGES_DELTA_MAX_ROWS: int = int(os.getenv("CHANGES_DELTA_MAX_ROWS", "500"))
+    CHANGES_DELTA_MAX_FILE_SIZE: int = int(os.getenv("CHANGES_DELTA_MAX_FILE_SIZE", str(8 * 1024 ** 2)))
+    # Файловый ввод-вывод асинхронных обработчиков: потоки выделенного пула, размер части записи (байты)
+    # и число строк таблицы за один вызов; интервал измерения задержки цикла событий (сек, 0 - не измерять)
+    FILE_IO_WORKERS: int = int(os.getenv("FILE_IO_WORKERS", "4"))
+    FILE_IO_CHUNK_BYTES: int = int(os.getenv("FILE_IO_CHUNK_BYTES", str(4 * 1024 ** 2)))
+    FILE_IO_WRITE_BATCH: int = int(os.getenv("FILE_IO_WRITE_BATCH", "5000"))
+    LOOP_LAG_INTERVAL: float = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+    # Префикс internal location nginx для отдачи исходных файлов через X-Accel-Redirect (пусто - отключено)
+    RAW_ACCEL_REDIRECT_PREFIX: str = os.getenv("RAW_ACCEL_REDIRECT_PREFIX", "")
+    HOST: str = os.getenv("HOST", "0.0.0.0")
+    PORT: int = int(os.getenv("PORT", "3001"))
+    # Режим разработки: один процесс с автоперезагрузкой
+    SERVER_RELOAD: bool = os.getenv("SERVER_RELOAD", "false").lower() == "true"
+
+    # Настройки production сервера (gunicorn + uvicorn воркеры)
+    WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", "0"))  # 0 - по количеству ядер
+    WEB_BACKLOG: int = int(os.getenv("WEB_BACKLOG", "2048"))
+    WEB_KEEPALIVE: int = int(os.getenv("WEB_KEEPALIVE", "5"))  # секунды
+    WEB_TIMEOUT: int = int(os.getenv("WEB_TIMEOUT", "300"))  # секунды без ответа до перезапуска воркера
+    # Перезапуск воркера после N запросов ограничивает рост памяти (0 - отключено)
+    WEB_MAX_REQUESTS: int = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+    WEB_MAX_REQUESTS_JITTER: int = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000"))
+    # Время на завершение текущих запросов (загрузок) после SIGTERM
+    WEB_GRACEFUL_TIMEOUT: int = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "120"))
     
+    # Контроль допуска для тяжелых запросов (скачивание и загрузка файлов)
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    # Вес запроса - размер файла в таких единицах (по умолчанию 1 МБ)
+    ADMISSION_UNIT_BYTES: int = int(os.getenv("ADMISSION_UNIT_BYTES", str(1024 * 1024)))
+    # Суммарный вес одновременно выполняемых запросов класса на воркер
+    ADMISSION_DOWNLOAD_CAPACITY: int = int(os.getenv("ADMISSION_DOWNLOAD_CAPACITY", "256"))
+    ADMISSION_UPLOAD_CAPACITY: int = int(os.getenv("ADMISSION_UPLOAD_CAPACITY", "256"))
+    # Вес предпросмотра данных виджета (файлы-источники известны только из тела запроса, поэтому вес постоянный)
+    ADMISSION_WIDGET_PREVIEW_WEIGHT: int = int(os.getenv("ADMISSION_WIDGET_PREVIEW_WEIGHT", "32"))
+    # Ограничения очереди ожидания: длина, время ожидания (сек) и Retry-After (сек)
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    ADMISSION_RETRY_AFTER: int = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,4 +1,11 @@
-from sqlalchemy import create_engine
+import itertools
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from fastapi import Request
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from server.config.settings import settings
@@ -6,8 +13,145 @@ from server.config.settings import settings
 # Создаем движок SQLAlchemy для PostgreSQL
 engine = create_engine(settings.DATABASE_URL)
 
+class _Replica:
+    """Реплика для чтения и ее состояние по последней проверке"""
+
+    def __init__(self, url: str):
+        self.url = url
+        # pre_ping: разорванное соединение из пула заменяется до выполнения запроса
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.healthy = True
+        self.checked_at = 0.0
+        self.failures = 0
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # Потеря соединения во время запроса: реплика исключается до следующей проверки
+        if context.is_disconnect:
+            self.healthy = False
+            self.checked_at = time.monotonic()
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            if not self.healthy:
+                print(f"Read replica is back: {self.engine.url.render_as_string(hide_password=True)}")
+            self.healthy = True
+        except Exception as e:
+            if self.healthy:
+                print(f"Read replica is unavailable: {self.engine.url.render_as_string(hide_password=True)}: {str(e)}")
+            self.healthy = False
+            self.failures += 1
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+class ReplicaRouter:
+    """Выбор базы для чтения: реплики по кругу, при недоступности всех - основная база
+
+    Реплика проверяется (SELECT 1) не чаще раза в DATABASE_REPLICA_CHECK_INTERVAL
+    секунд; недоступная исключается до следующей успешной проверки. После записи
+    пользователь DATABASE_STICKY_SECONDS секунд читает из основной базы, чтобы
+    видеть свои изменения, пока реплики догоняют. Отметка о записи хранится
+    в памяти воркера и файлом в DATABASE_STICKY_DIR, чтобы ее видели остальные воркеры.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [_Replica(url) for url in urls]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._written: Dict[int, float] = {}
+        self.primary_reads = 0
+        self.replica_reads = 0
+
+    def _sticky_path(self, user_id: int) -> str:
+        return os.path.join(settings.DATABASE_STICKY_DIR or os.path.join(settings.UPLOAD_DIR, "sticky"), str(user_id))
+
+    def mark_write(self, user_id: int):
+        """Отмечает запись пользователя (чтения ненадолго направляются в основную базу)"""
+        if not self.replicas:
+            return
+        now = time.time()
+        self._written[user_id] = now
+        path = self._sticky_path(user_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a"):
+                os.utime(path, (now, now))
+        except OSError as e:
+            print(f"Error marking write for user {user_id}: {str(e)}")
+
+    def is_sticky(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        window = settings.DATABASE_STICKY_SECONDS
+        now = time.time()
+        written = self._written.get(user_id)
+        if written is not None and now - written < window:
+            return True
+        try:
+            return now - os.path.getmtime(self._sticky_path(user_id)) < window
+        except OSError:
+            return False
+
+    def read_engine(self, user_id: Optional[int] = None):
+        """Движок для чтения: реплика по кругу или основная база"""
+        if not self.replicas or self.is_sticky(user_id):
+            self.primary_reads += 1
+            return engine
+
+        interval = settings.DATABASE_REPLICA_CHECK_INTERVAL
+        start = next(self._counter)
+        for number in range(len(self.replicas)):
+            replica = self.replicas[(start + number) % len(self.replicas)]
+            if time.monotonic() - replica.checked_at >= interval:
+                # Проверку выполняет один запрос, остальные используют прежний результат
+                if self._lock.acquire(blocking=False):
+                    try:
+                        replica.check()
+                    finally:
+                        self._lock.release()
+            if replica.healthy:
+                self.replica_reads += 1
+                return replica.engine
+
+        self.primary_reads += 1
+        return engine
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "url": replica.engine.url.render_as_string(hide_password=True),
+                    "healthy": replica.healthy,
+                    "failures": replica.failures,
+                }
+                for replica in self.replicas
+            ],
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+    def dispose(self, close: bool = True):
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+replica_router = ReplicaRouter([url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()])
+
+# После fork (воркеры gunicorn) нельзя использовать соединения родительского процесса:
+# сбрасываем пул, не закрывая чужие соединения, и воркер открывает свои
+def _reset_engine_after_fork():
+    engine.dispose(close=False)
+    replica_router.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
 # Создаем фабрику сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии только для чтения (движок выбирается при создании); объекты не сбрасываются после commit,
+# поэтому соединение можно вернуть в пул сразу после запроса
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
 
 # Базовый класс для моделей SQLAlchemy
 Base = declarative_base()
@@ -20,6 +164,27 @@ def get_db():
     finally:
         db.close()
 
+def user_id_from_authorization(authorization: str) -> Optional[int]:
+    """user_id из Bearer токена без обращения к БД (проверка подписи обязательна)"""
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("user_id")
+
+def open_read_session(user_id: Optional[int] = None):
+    return ReadSessionLocal(bind=replica_router.read_engine(user_id))
+
+# Сессия для эндпоинтов, которые только читают: реплика, если она настроена
+def get_read_db(request: Request):
+    db = open_read_session(user_id_from_authorization(request.headers.get("authorization", "")))
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Функция для инициализации базы данных
 def init_db():
     # Импортируем модели, чтобы они были доступны для создания таблиц
@@ -0,0 +1 @@
+# Этот файл необходим для корректной работы пакета middleware
@@ -0,0 +1,307 @@
+"""Контроль допуска (admission control) для тяжелых эндпоинтов
+
+Тяжелые запросы (скачивание содержимого, загрузка файлов) делятся на классы,
+у каждого класса свой взвешенный семафор. Вес запроса зависит от ожидаемой
+стоимости: размера файла (CsvFile.size) или Content-Length загрузки.
+Ожидающие запросы обслуживаются по очереди между пользователями (fair queuing),
+очередь ограничена; при перегрузке сразу возвращается 503 с Retry-After.
+Остальные эндпоинты (вход, метаданные) через контроль не проходят.
+"""
+import asyncio
+import math
+import re
+from collections import OrderedDict, deque
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from server.config.settings import settings
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь переполнена или истекло время ожидания"""
+
+class _Waiter:
+    __slots__ = ("weight", "future")
+
+    def __init__(self, weight, future):
+        self.weight = weight
+        self.future = future
+
+class AdmissionController:
+    """Взвешенный семафор с ограниченной очередью и справедливым обслуживанием пользователей"""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.available = self.capacity
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        # user_id -> очередь ожидающих; порядок ключей задает круговой обход пользователей
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._waiting = 0
+
+    def weight_for(self, size: Optional[int]) -> int:
+        """Вес запроса по ожидаемому объему данных"""
+        if not size:
+            return 1
+        return min(self.capacity, max(1, math.ceil(size / settings.ADMISSION_UNIT_BYTES)))
+
+    async def acquire(self, user_key: str, weight: int) -> int:
+        """Ожидает допуска и возвращает занятый вес"""
+        weight = min(max(1, weight), self.capacity)
+
+        if not self._waiting and self.available >= weight:
+            self._grant(weight)
+            return weight
+
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(f"{self.name}: queue is full")
+
+        waiter = _Waiter(weight, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(user_key, deque()).append(waiter)
+        self._waiting += 1
+
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout)
+        except BaseException:
+            # Клиент отключился во время ожидания
+            if waiter.future.done():
+                self.release(weight)
+            else:
+                waiter.future.cancel()
+                self._remove(user_key, waiter)
+            raise
+
+        if not waiter.future.done():
+            waiter.future.cancel()
+            self._remove(user_key, waiter)
+            self.rejected += 1
+            raise AdmissionRejected(f"{self.name}: queue timeout")
+        return weight
+
+    def release(self, weight: int):
+        self.available += weight
+        self.in_flight -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "available": self.available,
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "rejected": self.rejected,
+        }
+
+    def _grant(self, weight: int):
+        self.available -= weight
+        self.in_flight += 1
+
+    def _remove(self, user_key: str, waiter: _Waiter):
+        waiters = self._queues.get(user_key)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._waiting -= 1
+        if not waiters:
+            del self._queues[user_key]
+        # Ушедший из головы очереди запрос мог блокировать следующих
+        self._dispatch()
+
+    def _dispatch(self):
+        """Выдает допуск ожидающим, по одному запросу на пользователя за круг"""
+        while self._queues:
+            user_key, waiters = next(iter(self._queues.items()))
+            waiter = waiters[0]
+            if waiter.weight > self.available:
+                break
+            waiters.popleft()
+            self._waiting -= 1
+            if waiters:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+            self._grant(waiter.weight)
+            waiter.future.set_result(True)
+
+class RouteClass:
+    """Правило отнесения запроса к классу тяжелых запросов"""
+
+    def __init__(self, controller: AdmissionController, method: str, pattern: str, weigh_by: str,
+                 weight: int = 1):
+        self.controller = controller
+        self.method = method
+        self.pattern = re.compile(pattern)
+        # "file" - по размеру файла из БД, "body" - по Content-Length запроса,
+        # "widget" - по размеру файлов-источников виджета дашборда, "fixed" - постоянный вес weight
+        self.weigh_by = weigh_by
+        self.weight = weight
+
+download_controller = AdmissionController(
+    "download",
+    settings.ADMISSION_DOWNLOAD_CAPACITY,
+    settings.ADMISSION_MAX_QUEUE,
+    settings.ADMISSION_QUEUE_TIMEOUT,
+)
+upload_controller = AdmissionController(
+    "upload",
+    settings.ADMISSION_UPLOAD_CAPACITY,
+    settings.ADMISSION_MAX_QUEUE,
+    settings.ADMISSION_QUEUE_TIMEOUT,
+)
+
+CSV_FILES_PREFIX = f"{settings.API_PREFIX}/csv-files"
+
+ROUTE_CLASSES = [
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/content/(?P<file_id>\d+)$", "file"),
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)/export$", "file"),
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)/raw$", "file"),
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)/stats$", "file"),
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)/timeseries$", "file"),
+    RouteClass(download_controller, "GET", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)/versions/(?:\d+|diff)$", "file"),
+    RouteClass(download_controller, "POST", rf"^{CSV_FILES_PREFIX}/query$", "body"),
+    RouteClass(download_controller, "GET",
+               rf"^{settings.API_PREFIX}/dashboards/(?P<dashboard_id>\d+)/widgets/(?P<widget_id>[^/]+)/data$", "widget"),
+    RouteClass(download_controller, "POST", rf"^{settings.API_PREFIX}/dashboards/widget-data$", "fixed",
+               settings.ADMISSION_WIDGET_PREVIEW_WEIGHT),
+    RouteClass(upload_controller, "POST", rf"^{CSV_FILES_PREFIX}/upload$", "body"),
+    RouteClass(upload_controller, "POST", rf"^{CSV_FILES_PREFIX}/save$", "body"),
+    RouteClass(upload_controller, "POST", rf"^{CSV_FILES_PREFIX}/bulk$", "body"),
+    RouteClass(upload_controller, "PUT", rf"^{CSV_FILES_PREFIX}/(?P<file_id>\d+)$", "body"),
+    RouteClass(upload_controller, "PATCH", rf"^{settings.API_PREFIX}/uploads/[0-9a-f]+$", "body"),
+]
+
+def _match_route(method: str, path: str):
+    for route_class in ROUTE_CLASSES:
+        if route_class.method == method:
+            match = route_class.pattern.match(path)
+            if match:
+                return route_class, match
+    return None, None
+
+def _user_id_from_headers(headers: dict) -> Optional[int]:
+    """Извлекает user_id из Bearer токена без обращения к БД (проверка подписи обязательна)"""
+    from server.database import user_id_from_authorization
+
+    return user_id_from_authorization(headers.get("authorization", ""))
+
+def _get_file_size(file_id: int, user_id: int) -> Optional[int]:
+    from server.database import open_read_session
+    from server.models import models
+
+    db = open_read_session(user_id)
+    try:
+        return db.query(models.CsvFile.size).filter(
+            models.CsvFile.id == file_id,
+            models.CsvFile.user_id == user_id
+        ).scalar()
+    finally:
+        db.close()
+
+def _get_widget_sources_size(dashboard_id: int, widget_id: str, user_id: int) -> Optional[int]:
+    """Суммарный размер файлов, по которым строится виджет (файлы владельца дашборда)"""
+    from urllib.parse import unquote
+    from server.database import open_read_session
+    from server.models import models
+    from server.services.widget_data import widget_sources
+
+    db = open_read_session(user_id)
+    try:
+        dashboard = db.query(models.Dashboard).filter(
+            models.Dashboard.id == dashboard_id,
+            (models.Dashboard.user_id == user_id) | (models.Dashboard.is_public == True)
+        ).first()
+        if dashboard is None:
+            return None
+        widget_id = unquote(widget_id)
+        widget = next(
+            (item for item in dashboard.layout or [] if isinstance(item, dict) and str(item.get("i")) == widget_id),
+            None
+        )
+        if widget is None:
+            return None
+        total = 0
+        for name in widget_sources(widget):
+            total += db.query(models.CsvFile.size).filter(
+                models.CsvFile.name == name,
+                models.CsvFile.user_id == dashboard.user_id
+            ).order_by(models.CsvFile.id.desc()).limit(1).scalar() or 0
+        return total
+    finally:
+        db.close()
+
+class AdmissionMiddleware:
+    """ASGI middleware: допуск до начала чтения тела запроса, освобождение после отправки ответа"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        route_class, match = _match_route(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        user_id = _user_id_from_headers(headers)
+        if user_id is None:
+            # Без валидного токена запрос все равно будет отклонен маршрутом (401)
+            await self.app(scope, receive, send)
+            return
+
+        size = None
+        if route_class.weigh_by == "body":
+            content_length = headers.get("content-length")
+            size = int(content_length) if content_length and content_length.isdigit() else None
+        elif route_class.weigh_by == "widget":
+            size = await run_in_threadpool(
+                _get_widget_sources_size, int(match.group("dashboard_id")), match.group("widget_id"), user_id
+            )
+        elif "file_id" in match.groupdict():
+            size = await run_in_threadpool(_get_file_size, int(match.group("file_id")), user_id)
+
+        controller = route_class.controller
+        weight = route_class.weight if route_class.weigh_by == "fixed" else controller.weight_for(size)
+        try:
+            weight = await controller.acquire(str(user_id), weight)
+        except AdmissionRejected as e:
+            print(f"Admission rejected: {str(e)}")
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                controller.release(weight)
+
+        async def send_wrapper(message):
+            await send(message)
+            # Потоковые ответы удерживают допуск до отправки последнего фрагмента
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
+
+def admission_stats() -> dict:
+    """Текущее состояние всех классов тяжелых запросов"""
+    return {
+        download_controller.name: download_controller.stats(),
+        upload_controller.name: upload_controller.stats(),
+    }
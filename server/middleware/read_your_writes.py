@@ -0,0 +1,48 @@
+"""Чтение своих записей при работе с репликами
+
+После успешного изменяющего запроса (POST, PUT, PATCH, DELETE) пользователь
+на DATABASE_STICKY_SECONDS секунд читает из основной базы: реплики могут
+еще не получить его изменения. Отметка ставится до отправки ответа, поэтому
+следующий запрос клиента уже ее видит.
+"""
+from server.config.settings import settings
+from server.database import replica_router, user_id_from_authorization
+
+UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# POST эндпоинты, которые только читают данные
+READ_ONLY_PATHS = {
+    f"{settings.API_PREFIX}/csv-files/query",
+    f"{settings.API_PREFIX}/csv-files/batch-get",
+    f"{settings.API_PREFIX}/dashboards/widget-data",
+    f"{settings.API_PREFIX}/dashboards/batch-get",
+}
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware: отмечает запись пользователя для ReplicaRouter"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not replica_router.replicas
+                or scope["method"] not in UNSAFE_METHODS or scope["path"] in READ_ONLY_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = ""
+        for key, value in scope["headers"]:
+            if key == b"authorization":
+                authorization = value.decode("latin-1")
+                break
+        user_id = user_id_from_authorization(authorization)
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                replica_router.mark_write(user_id)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
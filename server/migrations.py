@@ -6,6 +6,7 @@ import json
 from sqlalchemy.sql import text
 
 from server.config.settings import settings
+from server.storage.files import open_text
 
 # Подключение к базе данных
 engine = create_engine(settings.DATABASE_URL)
@@ -47,7 +48,7 @@ def run_migrations():
                 
                 try:
                     data = []
-                    with open(file_path, 'r', encoding='utf-8') as csvfile:
+                    with open_text(file_path) as csvfile:
                         # Пропускаем первую строку (заголовки)
                         next(csvfile)
                         # Читаем остальное содержимое
@@ -78,7 +79,86 @@ def run_migrations():
     except Exception as e:
         print(f"Note: Could not make 'path' column nullable: {str(e)}")
     
+    # Добавляем колонку content_hash для хранилища блобов
+    try:
+        session.execute(text("SELECT content_hash FROM csv_files LIMIT 1"))
+    except Exception:
+        session.rollback()
+        print("Adding 'content_hash' column to csv_files table...")
+        if "postgresql" in settings.DATABASE_URL:
+            session.execute(text("ALTER TABLE csv_files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+        else:
+            session.execute(text("ALTER TABLE csv_files ADD COLUMN content_hash VARCHAR(64)"))
+        session.execute(text("CREATE INDEX IF NOT EXISTS ix_csv_files_content_hash ON csv_files (content_hash)"))
+        session.commit()
+    
+    # Размер файла может превышать 2 ГБ (возобновляемые загрузки)
+    if "postgresql" in settings.DATABASE_URL:
+        try:
+            data_type = session.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'csv_files' AND column_name = 'size'"
+            )).scalar()
+            if data_type == "integer":
+                print("Changing 'size' column type to BIGINT...")
+                session.execute(text("ALTER TABLE csv_files ALTER COLUMN size TYPE BIGINT"))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Note: Could not change 'size' column type: {str(e)}")
+    
+    # Номер поколения содержимого файла
+    try:
+        session.execute(text("SELECT version FROM csv_files LIMIT 1"))
+    except Exception:
+        session.rollback()
+        print("Adding 'version' column to csv_files table...")
+        session.execute(text("ALTER TABLE csv_files ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+        session.commit()
+    
+    backfill_content_hashes()
+    
     print("Migrations complete.")
 
+def backfill_content_hashes():
+    """Переносит файлы, сохраненные до появления хранилища блобов, в uploads/blobs"""
+    from server.storage import blobs
+    from server.storage.generations import remove_unless_leased
+    from server.services.parallel_scan import count_records
+    
+    result = session.execute(text(
+        "SELECT DISTINCT path FROM csv_files WHERE content_hash IS NULL AND path IS NOT NULL"
+    ))
+    paths = [row[0] for row in result.fetchall()]
+    
+    for file_path in paths:
+        if not os.path.exists(file_path) or blobs.is_blob_path(file_path):
+            continue
+        
+        try:
+            with open(file_path, 'rb') as source:
+                blob = blobs.store_stream(source)
+            
+            # Заголовки, число строк и смещения записей для переиспользования при чтении
+            if blobs.load_artifact(blob.content_hash) is None:
+                meta, record_offsets = count_records(blob.path)
+                if record_offsets:
+                    blobs.save_artifact(blob.content_hash, record_offsets, "offsets.json")
+                blobs.save_artifact(blob.content_hash, meta)
+            
+            # Несколько записей могли ссылаться на один и тот же файл
+            session.execute(
+                text("UPDATE csv_files SET content_hash = :hash, path = :new_path, version = version + 1 WHERE path = :old_path"),
+                {"hash": blob.content_hash, "new_path": blob.path, "old_path": file_path}
+            )
+            session.commit()
+            # Старый файл могут еще читать: тогда он остается на месте до следующего запуска
+            if not remove_unless_leased(file_path, lambda: os.remove(file_path)):
+                print(f"File {file_path} is still being read, leaving it in place")
+            print(f"Moved {file_path} to blob storage ({blob.content_hash})")
+        except Exception as file_error:
+            session.rollback()
+            print(f"Error moving file {file_path} to blob storage: {str(file_error)}")
+
 if __name__ == "__main__":
     run_migrations() 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, ARRAY, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey, ARRAY, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from enum import Enum
@@ -25,6 +25,7 @@ class User(Base):
     # Отношения (связи с другими моделями)
     csv_files = relationship("CsvFile", back_populates="user")
     dashboards = relationship("Dashboard", back_populates="user")
+    upload_sessions = relationship("UploadSession", back_populates="user")
 
 class CsvFile(Base):
     """Модель CSV файла"""
@@ -34,11 +35,15 @@ class CsvFile(Base):
     name = Column(String(255), nullable=False)
     original_name = Column(String(255), nullable=False)
     path = Column(String(500), nullable=True)  # Сделаем путь опциональным
-    size = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 содержимого (блоб в uploads/blobs)
+    size = Column(BigInteger, nullable=False)  # Файлы больше 2 ГБ не помещаются в INTEGER
     mime_type = Column(String(100), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    column_headers = Column(ARRAY(String), nullable=False, default=list)
+    # В SQLite (локальные стенды, бенчмарки) массив хранится как JSON
+    column_headers = Column(ARRAY(String).with_variant(JSON, "sqlite"), nullable=False, default=list)
     row_count = Column(Integer, nullable=False, default=0)
+    # Номер поколения содержимого: растет при каждом обновлении, UPDATE проверяет прежнее значение
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     data = Column(JSON, nullable=True)  # Добавляем JSON-поле для хранения данных CSV
     processed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
@@ -47,6 +52,28 @@ class CsvFile(Base):
     # Отношения
     user = relationship("User", back_populates="csv_files")
 
+    # Параллельное обновление того же поколения завершается StaleDataError, а не перезаписью
+    __mapper_args__ = {"version_id_col": version}
+
+class CsvFileVersion(Base):
+    """Прежняя версия CSV файла
+
+    Содержимое хранится фрагментами в uploads/chunks (см. server/storage/chunks.py),
+    общими для всех версий; строка хранит только список фрагментов.
+    """
+    __tablename__ = "csv_file_versions"
+    __table_args__ = (UniqueConstraint("file_id", "version"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("csv_files.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)  # Значение CsvFile.version, которое было у этого содержимого
+    content_hash = Column(String(64), nullable=True)
+    size = Column(BigInteger, nullable=False)
+    column_headers = Column(ARRAY(String).with_variant(JSON, "sqlite"), nullable=False, default=list)
+    row_count = Column(Integer, nullable=False, default=0)
+    chunks = Column(JSON, nullable=False)  # [[sha256, длина, число записей], ...]
+    created_at = Column(DateTime, server_default=func.now())
+
 class Dashboard(Base):
     """Модель дашборда"""
     __tablename__ = "dashboards"
@@ -62,4 +89,22 @@ class Dashboard(Base):
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     # Отношения
-    user = relationship("User", back_populates="dashboards") 
\ No newline at end of file
+    user = relationship("User", back_populates="dashboards") 
+
+class UploadSession(Base):
+    """Модель сессии возобновляемой загрузки
+
+    Полученные фрагменты отмечаются файлами в каталоге сессии, а не в БД,
+    чтобы параллельные запросы с фрагментами не конкурировали за строку.
+    """
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)  # Случайный идентификатор (uuid4 hex)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    mime_type = Column(String(100), nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    # Отношения
+    user = relationship("User", back_populates="upload_sessions")
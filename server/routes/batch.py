@@ -0,0 +1,21 @@
+"""Общие схемы и проверки пакетных запросов по списку id (batch-get, batch-delete)"""
+from typing import List
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from server.config.settings import settings
+
+class BatchIdsRequest(BaseModel):
+    ids: List[int]
+
+class BatchDeleteResponse(BaseModel):
+    deleted: List[int]
+    not_found: List[int]
+
+def batch_ids(request: BatchIdsRequest) -> List[int]:
+    """id запроса без повторов (в исходном порядке)"""
+    if len(request.ids) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many ids: {len(request.ids)} (limit {settings.BATCH_MAX_ITEMS})"
+        )
+    return list(dict.fromkeys(request.ids))
@@ -0,0 +1,182 @@
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+import asyncio
+import json
+from server.models import models
+from server.database import open_read_session
+from server.auth.jwt import get_user_from_token
+from server.config.settings import settings
+from server.services.change_hub import change_hub, dashboard_topic, file_topic
+
+router = APIRouter(
+    prefix=f"{settings.API_PREFIX}/changes",
+    tags=["changes"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+def _parse_ids(raw: Optional[str], name: str) -> List[int]:
+    """Список id из параметра вида "1,2,3" """
+    if not raw:
+        return []
+    try:
+        return [int(value) for value in raw.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"'{name}' must be a comma-separated list of ids"
+        )
+
+def _bearer_token(headers, token: Optional[str]) -> str:
+    # EventSource и WebSocket в браузере не умеют задавать заголовки, поэтому токен можно передать параметром
+    authorization = headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    if token:
+        return token
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _authorize_topics(token: str, file_ids: List[int], dashboard_ids: List[int]):
+    """Проверяет токен и доступ к файлам и дашбордам; возвращает темы подписки
+
+    Сессия БД открывается только на время проверки: подписка может жить часами.
+    """
+    if len(file_ids) + len(dashboard_ids) > settings.CHANGES_MAX_TOPICS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many subscriptions (maximum {settings.CHANGES_MAX_TOPICS})"
+        )
+
+    db = open_read_session()
+    try:
+        user = get_user_from_token(token, db)
+        if not user.is_active:
+            raise HTTPException(status_code=400, detail="Inactive user")
+
+        if file_ids:
+            found = {row[0] for row in db.query(models.CsvFile.id).filter(
+                models.CsvFile.id.in_(file_ids),
+                models.CsvFile.user_id == user.id
+            ).all()}
+            missing = set(file_ids) - found
+            if missing:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"CSV file {min(missing)} not found"
+                )
+
+        if dashboard_ids:
+            found = {row[0] for row in db.query(models.Dashboard.id).filter(
+                models.Dashboard.id.in_(dashboard_ids),
+                (models.Dashboard.user_id == user.id) | (models.Dashboard.is_public == True)
+            ).all()}
+            missing = set(dashboard_ids) - found
+            if missing:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Dashboard {min(missing)} not found"
+                )
+
+        topics = [file_topic(file_id) for file_id in file_ids] + [dashboard_topic(dashboard_id) for dashboard_id in dashboard_ids]
+        return topics
+    finally:
+        db.close()
+
+@router.get("/stream")
+async def stream_changes(
+    request: Request,
+    files: Optional[str] = None,
+    dashboards: Optional[str] = None,
+    token: Optional[str] = None
+):
+    """Поток событий (Server-Sent Events) об изменениях файлов и дашбордов: ?files=1,2&dashboards=3"""
+    topics = await run_in_threadpool(
+        _authorize_topics, _bearer_token(request.headers, token),
+        _parse_ids(files, "files"), _parse_ids(dashboards, "dashboards")
+    )
+    subscriber = change_hub.subscribe(topics)
+
+    async def events():
+        try:
+            yield f"retry: 3000\n: subscribed {len(topics)}\n\n"
+            while True:
+                batch = await subscriber.next_events(settings.CHANGES_KEEPALIVE)
+                if not batch:
+                    # Комментарий не дает прокси закрыть простаивающее соединение
+                    yield ": ping\n\n"
+                    continue
+                yield "".join(f"data: {data}\n\n" for data in batch)
+        finally:
+            change_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def changes_websocket(
+    websocket: WebSocket,
+    files: Optional[str] = None,
+    dashboards: Optional[str] = None,
+    token: Optional[str] = None
+):
+    """События об изменениях по WebSocket; подписку можно расширить сообщением
+    {"subscribe": {"files": [1, 2], "dashboards": [3]}}"""
+    try:
+        access_token = _bearer_token(websocket.headers, token)
+        topics = await run_in_threadpool(
+            _authorize_topics, access_token, _parse_ids(files, "files"), _parse_ids(dashboards, "dashboards")
+        )
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    subscriber = change_hub.subscribe(topics)
+
+    async def send_events():
+        while True:
+            for data in await subscriber.next_events(settings.CHANGES_KEEPALIVE):
+                await websocket.send_text(data)
+
+    async def receive_commands():
+        while True:
+            text = await websocket.receive_text()
+            try:
+                request = json.loads(text).get("subscribe") or {}
+                file_ids = [int(value) for value in request.get("files", [])]
+                dashboard_ids = [int(value) for value in request.get("dashboards", [])]
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send_text(json.dumps({"type": "error", "detail": "Invalid subscribe message"}))
+                continue
+            try:
+                if len(subscriber.topics) + len(file_ids) + len(dashboard_ids) > settings.CHANGES_MAX_TOPICS:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Too many subscriptions (maximum {settings.CHANGES_MAX_TOPICS})"
+                    )
+                new_topics = await run_in_threadpool(_authorize_topics, access_token, file_ids, dashboard_ids)
+            except HTTPException as e:
+                await websocket.send_text(json.dumps({"type": "error", "detail": e.detail}, ensure_ascii=False))
+                continue
+            change_hub.add_topics(subscriber, new_topics)
+            await websocket.send_text(json.dumps({"type": "subscribed", "topics": sorted(subscriber.topics)}))
+
+    tasks = {asyncio.ensure_future(send_events()), asyncio.ensure_future(receive_commands())}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exception = task.exception()
+            if exception is not None and not isinstance(exception, WebSocketDisconnect):
+                print(f"Changes websocket error: {str(exception)}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        change_hub.unsubscribe(subscriber)
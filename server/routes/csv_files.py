@@ -1,17 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Body
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import format_datetime
 import os
-import shutil
-import csv
-import json
-import io
+from itertools import islice
+from urllib.parse import quote
 from pydantic import BaseModel
 from server.models import models
-from server.database import get_db
+from server.database import get_db, get_read_db
 from server.auth.jwt import get_current_active_user
+from server.routes.batch import BatchDeleteResponse, BatchIdsRequest, batch_ids
 from server.config.settings import settings
+from server.storage import blobs
+from server.storage.blocks import is_block_file
+from server.storage.files import stored_size
+from server.storage.generations import (
+    GenerationGone, ReadLease, acquire_current, leased_rows, read_current
+)
+from server.services.csv_rows import (
+    RowFilterError, compile_filters, compile_projection, iter_csv_rows, parse_filters, select_rows
+)
+from server.services.parallel_scan import column_stats, count_records
+from server.services.sql_query import QueryError, referenced_file_ids, run_query, table_cache, validate_table_name
+from server.services.spreadsheet_ingest import (
+    CONTENT_CSV, CONTENT_JSON, CONTENT_NDJSON, IngestError, ingest_request
+)
+from server.services.timeseries import TimeSeriesError, build_timeseries
+from server.services.widget_data import widget_sources
+from server.services.file_io import file_io
+from server.services.source_formats import canonical_name, detect_format, is_supported, store_source
+from server.services.bulk_import import BulkImportError, collect_entries, release_new_blobs, store_entries
+from server.services.result_cache import file_version, result_cache
+from server.services.version_history import archive_generation, delete_history
+from server.services.reclaimer import reclaimer, remove_legacy_file
+from server.services.change_hub import change_hub, compute_row_delta, dashboard_topic, file_topic
+from server.services.raw_download import RangeFileResponse, RangeNotSatisfiable, parse_range_header
+from server.services.export import (
+    EXPORT_FORMATS, MEDIA_TYPES, ExportError, check_parquet_available, iter_export,
+    normalize_delimiter, normalize_encoding
+)
+
+# Сколько раз обновление повторяет переключение строки, если параллельный запрос обновил файл раньше
+UPDATE_ATTEMPTS = 3
 
 router = APIRouter(
     prefix=f"{settings.API_PREFIX}/csv-files",
@@ -28,17 +62,36 @@ class CsvFileResponse(BaseModel):
     mime_type: str
     column_headers: List[str]
     row_count: int
+    version: int
     processed_at: Optional[datetime] = None
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+# Результат массового импорта по каждому файлу
+class BulkImportItem(BaseModel):
+    name: str
+    status: str  # imported или error
+    detail: Optional[str] = None
+    file: Optional[CsvFileResponse] = None
+
+class BulkImportResponse(BaseModel):
+    imported: int
+    failed: int
+    files: List[BulkImportItem]
+
+# Ответ batch-get (общие схемы пакетных запросов - server/routes/batch.py)
+class CsvFileBatchResponse(BaseModel):
+    files: List[CsvFileResponse]
+    not_found: List[int]
+
 # Схема для сохранения содержимого таблицы
 class SpreadsheetDataRequest(BaseModel):
     data: List[List[Any]]
     headers: List[str]
-    name: Optional[str] = None  # Необязательное имя файла
+    name: Optional[str] = None  # Необязательное имя файла (при обновлении файла не используется)
+    columns: Optional[List[List[Any]]] = None  # Данные по столбцам вместо data
 
     class Config:
         json_schema_extra = {
@@ -50,10 +103,69 @@ class SpreadsheetDataRequest(BaseModel):
         }
         arbitrary_types_allowed = True
 
-# Схема для обновления существующего файла
-class UpdateCsvFileRequest(BaseModel):
-    data: List[List[Any]]
-    headers: List[str]
+# Схема SQL запроса к файлам пользователя
+class CsvQueryRequest(BaseModel):
+    sql: str
+    # Имя таблицы в запросе -> id файла; кроме того, доступны таблицы вида file_<id>
+    tables: Dict[str, int] = {}
+    max_rows: Optional[int] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "sql": "SELECT Статус, count(*) AS n FROM tasks GROUP BY Статус ORDER BY n DESC",
+                "tables": {"tasks": 1}
+            }
+        }
+
+def _parse_if_match(value: Optional[str]) -> Optional[int]:
+    """Версия файла из If-Match ("3", W/"3" или 3); "*" и отсутствие заголовка - без проверки"""
+    if value is None or value.strip() == "*":
+        return None
+    version = value.strip()
+    if version.startswith("W/"):
+        version = version[2:]
+    version = version.strip('"')
+    if not version.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="If-Match must contain a file version"
+        )
+    return int(version)
+
+def _row_delta(old_path: str, new_path: str) -> Optional[dict]:
+    """Дельта строк под арендой прежнего поколения (его может освобождать параллельное обновление)"""
+    with ReadLease(old_path):
+        return compute_row_delta(old_path, new_path, settings.CHANGES_DELTA_MAX_ROWS)
+
+def _file_change_topics(db: Session, file: models.CsvFile,
+                        dashboards: Optional[List[models.Dashboard]] = None) -> List[str]:
+    """Темы уведомлений: сам файл и дашборды владельца, виджеты которых строятся по нему
+
+    dashboards - уже загруженные дашборды владельца (пакетное удаление читает их один раз).
+    """
+    topics = [file_topic(file.id)]
+    if dashboards is None:
+        dashboards = db.query(models.Dashboard).filter(models.Dashboard.user_id == file.user_id).all()
+    for dashboard in dashboards:
+        if any(isinstance(widget, dict) and file.name in widget_sources(widget) for widget in dashboard.layout or []):
+            topics.append(dashboard_topic(dashboard.id))
+    return topics
+
+def _file_change_event(file: models.CsvFile, event_type: str, delta: Optional[dict] = None) -> dict:
+    event = {
+        "type": event_type,
+        "file_id": file.id,
+        "name": file.name,
+        # Версия файла - хеш содержимого, generation - номер поколения (CsvFile.version)
+        "version": file.content_hash,
+        "generation": file.version,
+        "row_count": file.row_count,
+        "column_headers": file.column_headers,
+    }
+    if delta is not None:
+        event["delta"] = delta
+    return event
 
 @router.post("/upload", response_model=CsvFileResponse)
 async def upload_csv_file(
@@ -61,52 +173,64 @@ async def upload_csv_file(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    """Загрузка CSV файла"""
+    """Загрузка CSV или XLSX файла (CSV в любой кодировке и с любым разделителем приводится к UTF-8 с запятой)"""
     # Проверяем тип файла
-    if not file.filename.endswith('.csv'):
+    if not is_supported(file.filename):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Only CSV files are allowed"
+            detail="Only CSV and XLSX files are allowed"
         )
 
-    # Создаем директорию для файлов, если она не существует
-    upload_dir = os.path.join("uploads", str(current_user.id))
-    os.makedirs(upload_dir, exist_ok=True)
-
     # Создаем уникальное имя файла
-    file_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-    file_path = os.path.join(upload_dir, file_name)
-
-    # Сохраняем файл на диске
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Получаем информацию о файле
-    column_headers = []
-    row_count = 0
+    file_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{canonical_name(file.filename)}"
 
+    # Сохраняем содержимое в хранилище блобов (хеш считается во время записи, другие форматы перекодируются)
     try:
-        with open(file_path, 'r', encoding='utf-8') as csv_file:
-            csv_reader = csv.reader(csv_file)
-            column_headers = next(csv_reader, [])  # Получаем заголовки столбцов
-            row_count = sum(1 for _ in csv_reader)  # Считаем количество строк
+        source_format = await file_io.run(detect_format, file.file, file.filename)
+        blob, meta = await store_source(file.file, source_format)
+    except IngestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
     except Exception as e:
-        os.remove(file_path)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing CSV file: {str(e)}"
+            detail=f"Error saving CSV file: {str(e)}"
         )
 
+    if meta is not None:
+        # Перекодированный файл: заголовки и число строк посчитаны при записи
+        await file_io.run(blobs.save_artifact, blob.content_hash, meta)
+    else:
+        # Для уже загружавшегося содержимого заголовки и число строк берем из сохраненных данных
+        meta = await file_io.run(blobs.load_artifact, blob.content_hash)
+    if meta is None:
+        try:
+            # Заголовки и число строк; большие файлы разбираются параллельно на всех ядрах
+            meta, record_offsets = await file_io.run(count_records, blob.path)
+        except Exception as e:
+            if blob.is_new:
+                await file_io.run(blobs.release, db, blob.content_hash, respect_grace=False)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error processing CSV file: {str(e)}"
+            )
+        if record_offsets:
+            await file_io.run(blobs.save_artifact, blob.content_hash, record_offsets, "offsets.json")
+        await file_io.run(blobs.save_artifact, blob.content_hash, meta)
+
     # Создаем запись о файле в базе данных
     csv_file_db = models.CsvFile(
         name=file_name,
         original_name=file.filename,
-        path=file_path,
-        size=os.path.getsize(file_path),
-        mime_type=file.content_type or "text/csv",
+        path=blob.path,
+        content_hash=blob.content_hash,
+        size=blob.size,
+        mime_type=(file.content_type or "text/csv") if source_format.is_canonical else "text/csv",
         user_id=current_user.id,
-        column_headers=column_headers,
-        row_count=row_count,
+        column_headers=meta["column_headers"],
+        row_count=meta["row_count"],
         processed_at=datetime.utcnow()
     )
 
@@ -117,62 +241,127 @@ async def upload_csv_file(
 
     return csv_file_db
 
-@router.post("/save", response_model=CsvFileResponse)
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_import_csv_files(
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Массовый импорт: ZIP архивы и CSV файлы одним запросом, одна транзакция на все файлы"""
+    try:
+        entries = await collect_entries(files)
+    except BulkImportError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    
+    # Записи архивов копируются в блобы и разбираются параллельно
+    await store_entries(entries)
+    
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    imported = []
+    for entry in entries:
+        if entry.error is not None:
+            continue
+        entry.row = models.CsvFile(
+            name=f"{timestamp}_{entry.stored_name}",
+            original_name=entry.original_name,
+            path=entry.blob.path,
+            content_hash=entry.blob.content_hash,
+            size=entry.blob.size,
+            mime_type=entry.mime_type,
+            user_id=current_user.id,
+            column_headers=entry.meta["column_headers"],
+            row_count=entry.meta["row_count"],
+            processed_at=datetime.utcnow()
+        )
+        imported.append(entry)
+    
+    # Все строки сохраняются одной транзакцией
+    try:
+        db.add_all([entry.row for entry in imported])
+        db.commit()
+    except Exception as e:
+        print(f"Error saving bulk import: {str(e)}")
+        db.rollback()
+        await release_new_blobs(db, entries)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error saving imported files: {str(e)}"
+        )
+    # Блобы записей, которые не удалось разобрать
+    await release_new_blobs(db, [entry for entry in entries if entry.error is not None])
+    
+    manifest = []
+    for entry in entries:
+        if entry.error is not None:
+            manifest.append(BulkImportItem(name=entry.name, status="error", detail=entry.error))
+            continue
+        db.refresh(entry.row)
+        manifest.append(BulkImportItem(name=entry.name, status="imported", file=CsvFileResponse.model_validate(entry.row)))
+        change_hub.publish(_file_change_topics(db, entry.row), _file_change_event(entry.row, "file.created"))
+    print(f"Bulk import: {len(imported)} imported, {len(entries) - len(imported)} failed")
+    
+    return BulkImportResponse(imported=len(imported), failed=len(entries) - len(imported), files=manifest)
+
+# Тело запроса для /save и PUT /{file_id} разбирается без Pydantic (см. server/services/spreadsheet_ingest.py),
+# схемы выше описывают JSON формат в документации OpenAPI
+SPREADSHEET_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            CONTENT_JSON: {"schema": SpreadsheetDataRequest.model_json_schema()},
+            CONTENT_NDJSON: {"schema": {"type": "string", "format": "binary"}},
+            CONTENT_CSV: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+@router.post("/save", response_model=CsvFileResponse, openapi_extra=SPREADSHEET_REQUEST_BODY)
 async def save_spreadsheet_data(
-    request: SpreadsheetDataRequest = Body(...),
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Сохранение данных электронной таблицы в новый файл"""
     print("POST /save endpoint hit with data")
+    try:
+        # Строки пишутся в CSV блоб сразу при разборе тела, пустые строки пропускаются
+        result = await ingest_request(request)
+    except IngestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"Error saving spreadsheet data: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error saving spreadsheet data: {str(e)}"
+        )
+    
     try:
         # Создаем имя файла
-        file_name = request.name if request.name else f"spreadsheet_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        file_name = result.name if result.name else f"spreadsheet_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
         # Проверка и добавление расширения .csv если отсутствует
         if not file_name.lower().endswith('.csv'):
             file_name += '.csv'
         
-        # Определяем количество строк и оценочный размер данных
-        # Подсчитываем только непустые строки
-        filtered_data = [row for row in request.data if any(cell is not None and cell != '' for cell in row)]
-        row_count = len(filtered_data)
-        
-        # Оценка размера данных (приблизительно)
-        size_estimate = 0
-        for row in filtered_data:
-            for cell in row:
-                if cell is not None:
-                    size_estimate += len(str(cell)) + 1  # +1 для разделителя
-        
-        # Добавляем размер заголовков
-        for header in request.headers:
-            size_estimate += len(header) + 1
-        
-        # Создаем директорию для файлов, если она не существует
-        upload_dir = os.path.join("uploads", str(current_user.id))
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Создаем путь к файлу
-        file_path = os.path.join(upload_dir, file_name)
-        
-        # Сохраняем данные в CSV файл
-        with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            # Записываем заголовки
-            csv_writer.writerow(request.headers)
-            # Записываем данные
-            csv_writer.writerows(filtered_data)
+        blob = result.blob
+        await file_io.run(blobs.save_artifact, blob.content_hash, {"column_headers": result.headers, "row_count": result.row_count})
         
         # Создаем запись о файле в базе данных (не используя атрибут data)
         csv_file_db = models.CsvFile(
             name=file_name,
             original_name=file_name,
-            path=file_path,
-            size=os.path.getsize(file_path),
+            path=blob.path,
+            content_hash=blob.content_hash,
+            size=blob.size,
             mime_type="text/csv",
             user_id=current_user.id,
-            column_headers=request.headers,
-            row_count=row_count,
+            column_headers=result.headers,
+            row_count=result.row_count,
             processed_at=datetime.utcnow()
         )
         
@@ -182,23 +371,29 @@ async def save_spreadsheet_data(
         db.refresh(csv_file_db)
         print(f"File saved successfully with ID: {csv_file_db.id}")
         
+        change_hub.publish(_file_change_topics(db, csv_file_db), _file_change_event(csv_file_db, "file.created"))
+        
         return csv_file_db
     
     except Exception as e:
         print(f"Error saving spreadsheet data: {str(e)}")
+        if result.blob.is_new:
+            await file_io.run(blobs.release, db, result.blob.content_hash, respect_grace=False)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error saving spreadsheet data: {str(e)}"
         )
 
-@router.put("/{file_id}", response_model=CsvFileResponse)
+@router.put("/{file_id}", response_model=CsvFileResponse, openapi_extra=SPREADSHEET_REQUEST_BODY)
 async def update_csv_file(
     file_id: int,
-    request: UpdateCsvFileRequest,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    """Обновление существующего CSV файла"""
+    """Обновление существующего CSV файла (заголовок If-Match - ожидаемая версия)"""
+    expected_version = _parse_if_match(request.headers.get("if-match"))
+    
     # Находим файл в базе данных
     file = db.query(models.CsvFile).filter(
         models.CsvFile.id == file_id,
@@ -212,43 +407,107 @@ async def update_csv_file(
         )
     
     try:
-        # Отфильтруем только непустые строки для сохранения
-        filtered_data = [row for row in request.data if any(cell is not None and cell != '' for cell in row)]
+        # Новое содержимое сохраняется отдельным блобом, старый файл не перезаписывается
+        result = await ingest_request(request)
+    except IngestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"Error updating CSV file: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error updating CSV file: {str(e)}"
+        )
+    
+    try:
+        blob = result.blob
+        await file_io.run(blobs.save_artifact, blob.content_hash, {"column_headers": result.headers, "row_count": result.row_count})
         
-        # Если у файла нет пути или он не существует, создадим новый путь
-        if not file.path or not os.path.exists(file.path):
-            # Создаем директорию для файлов, если она не существует
-            upload_dir = os.path.join("uploads", str(current_user.id))
-            os.makedirs(upload_dir, exist_ok=True)
+        # Строка переключается на новое поколение условным UPDATE (version_id_col): если параллельный
+        # запрос успел обновить файл раньше, строка перечитывается и переключение повторяется
+        for _ in range(UPDATE_ATTEMPTS):
+            if expected_version is not None and file.version != expected_version:
+                raise HTTPException(
+                    status_code=status.HTTP_412_PRECONDITION_FAILED,
+                    detail=f"CSV file version is {file.version}, expected {expected_version}"
+                )
+            
+            old_hash = file.content_hash
+            old_path = file.path
+            old_headers = file.column_headers
+            old_size = file.size or 0
+            old_version = file.version
+            old_row_count = file.row_count
+            old_processed_at = file.processed_at
             
-            # Если нет имени файла, создаем его
-            file_name = file.name if file.name else f"spreadsheet_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
-            # Проверка и добавление расширения .csv если отсутствует
-            if not file_name.lower().endswith('.csv'):
-                file_name += '.csv'
-                
-            file.path = os.path.join(upload_dir, file_name)
+            # Обновляем информацию о файле
+            file.path = blob.path
+            file.content_hash = blob.content_hash
+            file.column_headers = result.headers
+            file.row_count = result.row_count
+            file.size = blob.size
+            file.processed_at = datetime.utcnow()
+            
+            try:
+                db.commit()
+                break
+            except StaleDataError:
+                db.rollback()
+                try:
+                    db.refresh(file)
+                except InvalidRequestError:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="CSV file not found"
+                    )
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="CSV file is being updated concurrently, please retry"
+            )
+        db.refresh(file)
         
-        # Сохраняем данные в CSV файл
-        with open(file.path, 'w', newline='', encoding='utf-8') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            # Записываем заголовки
-            csv_writer.writerow(request.headers)
-            # Записываем данные
-            csv_writer.writerows(filtered_data)
+        # Подписчики получают изменившиеся строки, если их немного (иначе только новую версию)
+        delta = None
+        if old_hash == blob.content_hash:
+            delta = {"row_count": file.row_count, "rows": []}
+        elif (old_path and old_headers == result.headers
+              and max(old_size, blob.size) <= settings.CHANGES_DELTA_MAX_FILE_SIZE
+              and await file_io.run(os.path.exists, old_path)):
+            try:
+                delta = await file_io.run(_row_delta, old_path, blob.path)
+            except GenerationGone:
+                pass
+            except Exception as e:
+                print(f"Error computing row delta: {str(e)}")
+        result_cache.invalidate_file(file.id)
+        change_hub.publish(_file_change_topics(db, file), _file_change_event(file, "file.updated", delta))
         
-        # Обновляем информацию о файле
-        file.column_headers = request.headers
-        file.row_count = len(filtered_data)
-        file.size = os.path.getsize(file.path)
-        file.processed_at = datetime.utcnow()
+        # Прежнее содержимое сохраняется в истории версий (общие с другими версиями фрагменты - один раз)
+        if old_path and old_hash != blob.content_hash:
+            try:
+                await archive_generation(db, file.id, old_version, old_path, old_hash, old_headers,
+                                         old_row_count, old_size, old_processed_at)
+            except Exception as e:
+                db.rollback()
+                print(f"Error archiving version {old_version} of CSV file {file.id}: {str(e)}")
         
-        # Сохраняем изменения в базе данных
-        db.commit()
-        db.refresh(file)
+        # Удаляем прежнее содержимое, если на него больше никто не ссылается
+        if old_hash:
+            if old_hash != blob.content_hash:
+                await file_io.run(blobs.release, db, old_hash)
+        else:
+            await file_io.run(remove_legacy_file, db, old_path)
         
         return file
-        
+    
+    except HTTPException:
+        db.rollback()
+        if result.blob.is_new:
+            await file_io.run(blobs.release, db, result.blob.content_hash, respect_grace=False)
+        raise
     except Exception as e:
         print(f"Error updating CSV file: {str(e)}")
         raise HTTPException(
@@ -256,13 +515,83 @@ async def update_csv_file(
             detail=f"Error updating CSV file: {str(e)}"
         )
 
+@router.post("/query")
+def query_csv_files(
+    request: CsvQueryRequest,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """SQL запрос (только SELECT) к CSV файлам пользователя"""
+    try:
+        for name in request.tables:
+            validate_table_name(name)
+    except QueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    table_files = dict(request.tables)
+    for file_id in referenced_file_ids(request.sql):
+        table_files.setdefault(f"file_{file_id}", file_id)
+    if not table_files:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Query does not reference any file (use file_<id> or the 'tables' mapping)"
+        )
+    
+    # Доступны только файлы текущего пользователя
+    files = db.query(models.CsvFile).filter(
+        models.CsvFile.id.in_(set(table_files.values())),
+        models.CsvFile.user_id == current_user.id
+    ).all()
+    files_by_id = {file.id: file for file in files}
+    for name, file_id in table_files.items():
+        file = files_by_id.get(file_id)
+        if not file or not file.path or not os.path.exists(file.path):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"CSV file {file_id} not found"
+            )
+        if file.size > settings.QUERY_MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"CSV file {file_id} is too large for queries"
+            )
+    
+    tables = {}
+    try:
+        for name, file_id in table_files.items():
+            file = files_by_id[file_id]
+            # Версия файла - хеш содержимого (для старых файлов - путь и время изменения);
+            # таблица загружается под арендой поколения
+            tables[name] = read_current(db, [file], lambda: table_cache.acquire(
+                file.content_hash or f"{file.path}:{os.path.getmtime(file.path)}", file.path, file.column_headers or []
+            ))
+        return run_query(request.sql, tables, request.max_rows)
+    except QueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except GenerationGone:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    finally:
+        for table in tables.values():
+            table_cache.release(table)
+
 @router.get("/content/{file_id}")
 def get_csv_file_content(
     file_id: int,
-    db: Session = Depends(get_db),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    """Получение содержимого CSV файла"""
+    """Получение содержимого CSV файла (offset и limit задают окно строк)"""
     file = db.query(models.CsvFile).filter(
         models.CsvFile.id == file_id,
         models.CsvFile.user_id == current_user.id
@@ -276,21 +605,24 @@ def get_csv_file_content(
     
     try:
         # Если есть путь к файлу, попробуем прочитать файл
-        if file.path and os.path.exists(file.path):
-            data = []
-            try:
-                with open(file.path, 'r', encoding='utf-8') as csvfile:
-                    csv_reader = csv.reader(csvfile)
-                    # Пропускаем заголовки, они уже есть в file.column_headers
-                    next(csv_reader, None)
-                    # Читаем данные
-                    for row in csv_reader:
-                        data.append(row)
-                
+        if file.path:
+            def read_window():
+                # Заголовки пропускаются, они уже есть в file.column_headers
+                rows = iter_csv_rows(file.path, offset=offset)
+                data = list(islice(rows, limit) if limit is not None else rows)
                 return {
                     "headers": file.column_headers,
                     "data": data
                 }
+            
+            try:
+                # Чтение идет под арендой поколения: параллельное обновление не удалит его до конца чтения
+                content = read_current(db, [file], lambda: result_cache.get_or_compute(
+                    [file_version(file)], {"kind": "content", "offset": offset, "limit": limit}, read_window
+                ))
+                return Response(content=content, media_type="application/json", headers={"ETag": f'"{file.version}"'})
+            except GenerationGone:
+                print(f"CSV file {file.id} content not found")
             except Exception as e:
                 print(f"Error reading CSV file from disk: {str(e)}")
         
@@ -307,9 +639,273 @@ def get_csv_file_content(
             detail=f"Error retrieving CSV content: {str(e)}"
         )
 
+@router.get("/{file_id}/export")
+def export_csv_file(
+    file_id: int,
+    export_format: str = Query("csv", alias="format"),
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    columns: Optional[List[str]] = Query(None),
+    filters: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Потоковый экспорт CSV файла в CSV (разделитель и кодировка на выбор), XLSX или Parquet"""
+    file = db.query(models.CsvFile).filter(
+        models.CsvFile.id == file_id,
+        models.CsvFile.user_id == current_user.id
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file not found"
+        )
+    
+    # Аренда поколения держится до конца передачи: параллельное обновление не удалит файл во время экспорта
+    try:
+        lease = acquire_current(db, file) if file.path else None
+    except GenerationGone:
+        lease = None
+    if lease is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    
+    # Проверяем параметры до начала передачи, чтобы вернуть понятную ошибку
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ExportError(f"Unsupported export format: {export_format}")
+        if export_format == "parquet":
+            check_parquet_available()
+        delimiter = normalize_delimiter(delimiter)
+        encoding = normalize_encoding(encoding)
+        
+        headers = list(file.column_headers or [])
+        predicate = compile_filters(headers, parse_filters(filters))
+        projection = compile_projection(headers, columns)
+    except (ExportError, RowFilterError) as e:
+        lease.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    if projection is not None:
+        headers = [headers[index] for index in projection]
+    
+    base_name = os.path.splitext(file.original_name or file.name)[0]
+    rows = select_rows(leased_rows(lease, iter_csv_rows(file.path)), predicate, projection)
+    
+    # Content-Type задается явно, иначе для text/csv добавится charset=utf-8
+    content_type = MEDIA_TYPES[export_format]
+    if export_format == "csv":
+        content_type = f"{content_type}; charset={encoding}"
+    
+    # Длина ответа заранее неизвестна, поэтому передача идет chunked
+    return StreamingResponse(
+        iter_export(export_format, headers, rows, delimiter, encoding, sheet_name=base_name),
+        headers={
+            "Content-Type": content_type,
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(base_name + '.' + export_format)}"
+        }
+    )
+
+@router.get("/{file_id}/stats")
+def get_csv_file_stats(
+    file_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Статистика по столбцам всего файла (непустые и числовые значения, сумма, среднее, минимум, максимум)"""
+    file = db.query(models.CsvFile).filter(
+        models.CsvFile.id == file_id,
+        models.CsvFile.user_id == current_user.id
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file not found"
+        )
+    
+    if not file.path or not os.path.exists(file.path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    
+    # Статистика зависит только от содержимого и сохраняется рядом с блобом
+    stats = blobs.load_artifact(file.content_hash, "stats.json") if file.content_hash else None
+    if stats is None:
+        try:
+            stats = read_current(db, [file], lambda: column_stats(file.path))
+        except GenerationGone:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="CSV file content not found"
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error reading CSV file: {str(e)}"
+            )
+        if file.content_hash:
+            blobs.save_artifact(file.content_hash, stats, "stats.json")
+    
+    return {"file_id": file.id, **stats}
+
+@router.get("/{file_id}/timeseries")
+def get_csv_file_timeseries(
+    file_id: int,
+    date_column: str,
+    value_column: Optional[str] = None,
+    bucket: str = "day",
+    aggregate: str = "sum",
+    points: int = Query(settings.TIMESERIES_DEFAULT_POINTS, ge=3),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Временной ряд: группировка по дням, неделям или месяцам и прореживание LTTB до points точек"""
+    file = db.query(models.CsvFile).filter(
+        models.CsvFile.id == file_id,
+        models.CsvFile.user_id == current_user.id
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file not found"
+        )
+    
+    if not file.path or not os.path.exists(file.path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    
+    points = min(points, settings.TIMESERIES_MAX_POINTS)
+    spec = {
+        "kind": "timeseries", "date_column": date_column, "value_column": value_column,
+        "bucket": bucket, "aggregate": aggregate, "points": points,
+    }
+    try:
+        content = read_current(db, [file], lambda: result_cache.get_or_compute([file_version(file)], spec, lambda: {
+            "file_id": file.id,
+            **build_timeseries(
+                file.path, file.content_hash, file.column_headers or [], date_column, value_column,
+                bucket, aggregate, points
+            ),
+        }))
+    except TimeSeriesError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except GenerationGone:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error reading CSV file: {str(e)}"
+        )
+    
+    return Response(content=content, media_type="application/json")
+
+@router.api_route("/{file_id}/raw", methods=["GET", "HEAD"])
+def download_raw_csv_file(
+    file_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Скачивание исходного файла с поддержкой Range (докачка и загрузка частями)"""
+    file = db.query(models.CsvFile).filter(
+        models.CsvFile.id == file_id,
+        models.CsvFile.user_id == current_user.id
+    ).first()
+    
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file not found"
+        )
+    
+    # Аренда поколения держится до конца отправки: параллельное обновление или удаление не освободит его раньше
+    try:
+        if not file.path:
+            raise GenerationGone(file_id)
+        lease = acquire_current(db, file)
+    except GenerationGone:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    
+    try:
+        size = stored_size(file.path)
+        if file.content_hash:
+            etag = f'"{file.content_hash}"'
+        else:
+            etag = f'"{size}-{int(os.path.getmtime(file.path))}"'
+    except BaseException:
+        lease.close()
+        raise
+    
+    headers = {
+        "ETag": etag,
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file.original_name or file.name)}",
+    }
+    modified_at = file.updated_at or file.processed_at
+    if modified_at:
+        headers["Last-Modified"] = format_datetime(modified_at.replace(tzinfo=timezone.utc), usegmt=True)
+    
+    if request.headers.get("if-none-match") == etag:
+        lease.close()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    # If-Range: диапазон учитывается, только если файл не изменился с прошлой загрузки
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None
+    
+    try:
+        ranges = parse_range_header(range_header, size)
+    except RangeNotSatisfiable:
+        lease.close()
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"}
+        )
+    
+    media_type = file.mime_type or "text/csv"
+    
+    # За nginx файл отдает сам nginx (sendfile, Range обрабатывается им же)
+    if settings.RAW_ACCEL_REDIRECT_PREFIX and not is_block_file(file.path):
+        lease.close()
+        relative_path = os.path.relpath(file.path, settings.UPLOAD_DIR).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = f"{settings.RAW_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(relative_path)}"
+        headers["Content-Type"] = media_type
+        return Response(headers=headers)
+    
+    return RangeFileResponse(
+        file.path,
+        size,
+        ranges,
+        media_type,
+        headers,
+        send_body=request.method != "HEAD",
+        lease=lease
+    )
+
 @router.get("/", response_model=List[CsvFileResponse])
 def get_user_csv_files(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_user),
     skip: int = 0,
     limit: int = 100
@@ -321,10 +917,74 @@ def get_user_csv_files(
     
     return files
 
+@router.post("/batch-get", response_model=CsvFileBatchResponse)
+def batch_get_csv_files(
+    request: BatchIdsRequest,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Информация о нескольких CSV файлах одним запросом"""
+    ids = batch_ids(request)
+    files = {}
+    if ids:
+        files = {file.id: file for file in db.query(models.CsvFile).filter(
+            models.CsvFile.id.in_(ids),
+            models.CsvFile.user_id == current_user.id
+        )}
+    
+    return {
+        "files": [files[file_id] for file_id in ids if file_id in files],
+        "not_found": [file_id for file_id in ids if file_id not in files],
+    }
+
+@router.post("/batch-delete", response_model=BatchDeleteResponse)
+def batch_delete_csv_files(
+    request: BatchIdsRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Удаление нескольких CSV файлов одной транзакцией (место на диске освобождается в фоне)"""
+    ids = batch_ids(request)
+    files = []
+    if ids:
+        files = db.query(models.CsvFile).filter(
+            models.CsvFile.id.in_(ids),
+            models.CsvFile.user_id == current_user.id
+        ).all()
+    if not files:
+        return {"deleted": [], "not_found": ids}
+    
+    deleted_ids = [file.id for file in files]
+    dashboards = db.query(models.Dashboard).filter(models.Dashboard.user_id == current_user.id).all()
+    notifications = [
+        (_file_change_topics(db, file, dashboards), _file_change_event(file, "file.deleted"))
+        for file in files
+    ]
+    content_hashes = [file.content_hash for file in files]
+    legacy_paths = [file.path for file in files if not file.content_hash]
+    
+    # Строки и история версий удаляются одной транзакцией
+    had_history = delete_history(db, deleted_ids) > 0
+    db.query(models.CsvFile).filter(
+        models.CsvFile.id.in_(deleted_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+    for file_id in deleted_ids:
+        result_cache.invalidate_file(file_id)
+    for topics, event in notifications:
+        change_hub.publish(topics, event)
+    reclaimer.schedule(content_hashes, legacy_paths, chunks=had_history)
+    
+    deleted = set(deleted_ids)
+    return {
+        "deleted": [file_id for file_id in ids if file_id in deleted],
+        "not_found": [file_id for file_id in ids if file_id not in deleted],
+    }
+
 @router.get("/{file_id}", response_model=CsvFileResponse)
 def get_csv_file(
     file_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Получение информации о конкретном CSV файле"""
@@ -359,15 +1019,19 @@ def delete_csv_file(
             detail="CSV file not found"
         )
     
-    # Если есть физический файл, удаляем его
-    if file.path and os.path.exists(file.path):
-        try:
-            os.remove(file.path)
-        except Exception as e:
-            print(f"Warning: Could not remove file {file.path}: {str(e)}")
+    content_hash = file.content_hash
+    file_path = file.path
+    topics = _file_change_topics(db, file)
+    event = _file_change_event(file, "file.deleted")
     
-    # Удаляем запись из базы данных
+    # Удаляем запись из базы данных вместе с историей версий
+    had_history = delete_history(db, [file_id]) > 0
     db.delete(file)
     db.commit()
+    result_cache.invalidate_file(file_id)
+    change_hub.publish(topics, event)
+    
+    # Физический файл удаляется в фоне, только если на него не ссылаются другие записи
+    reclaimer.schedule([content_hash], [] if content_hash else [file_path], chunks=had_history)
     
     return None 
\ No newline at end of file
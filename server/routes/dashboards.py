@@ -1,12 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
+import os
 from pydantic import BaseModel
 from server.models import models
-from server.database import get_db
+from server.database import get_db, get_read_db
 from server.auth.jwt import get_current_active_user
+from server.routes.batch import BatchDeleteResponse, BatchIdsRequest, batch_ids
 from server.config.settings import settings
+from server.services.change_hub import change_hub, dashboard_topic
+from server.storage.generations import GenerationGone, read_current
+from server.services.result_cache import file_version, result_cache
+from server.services.widget_data import WidgetDataError, compute_widget_data, widget_sources
 
 router = APIRouter(
     prefix=f"{settings.API_PREFIX}/dashboards",
@@ -36,6 +43,61 @@ class DashboardResponse(DashboardBase):
     class Config:
         from_attributes = True
 
+# Ответ batch-get (общие схемы пакетных запросов - server/routes/batch.py)
+class DashboardBatchResponse(BaseModel):
+    dashboards: List[DashboardResponse]
+    not_found: List[int]
+
+class WidgetDataRequest(BaseModel):
+    # Определение виджета в формате Dashboard.layout
+    widget: dict
+
+# Положение виджета в сетке не влияет на его данные и не входит в ключ кеша
+LAYOUT_KEYS = {"i", "x", "y", "w", "h", "minW", "minH", "maxW", "maxH", "moved", "static"}
+
+def _widget_data(db: Session, widget: dict, user_id: int) -> Response:
+    """Вычисляет данные виджета по файлам пользователя (dataSource - имя файла)"""
+    files = {}
+    for name in widget_sources(widget):
+        file = db.query(models.CsvFile).filter(
+            models.CsvFile.name == name,
+            models.CsvFile.user_id == user_id
+        ).order_by(models.CsvFile.id.desc()).first()
+        if not file or not file.path or not os.path.exists(file.path):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"CSV file '{name}' not found"
+            )
+        files[name] = file
+
+    spec = {
+        "kind": "widget",
+        "widget": {key: value for key, value in widget.items() if key not in LAYOUT_KEYS},
+        "sources": list(files),
+    }
+    try:
+        # Файлы читаются под арендами их поколений (см. server/storage/generations.py)
+        content = read_current(db, list(files.values()), lambda: result_cache.get_or_compute(
+            [file_version(file) for file in files.values()], spec, lambda: compute_widget_data(widget, files)
+        ))
+        return Response(content=content, media_type="application/json")
+    except WidgetDataError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except GenerationGone:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file content not found"
+        )
+    except Exception as e:
+        print(f"Error computing widget data: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error computing widget data: {str(e)}"
+        )
+
 @router.post("/", response_model=DashboardResponse)
 def create_dashboard(
     dashboard: DashboardCreate,
@@ -56,7 +118,7 @@ def create_dashboard(
 
 @router.get("/", response_model=List[DashboardResponse])
 def get_dashboards(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_user),
     skip: int = 0,
     limit: int = 100
@@ -70,7 +132,7 @@ def get_dashboards(
 
 @router.get("/public", response_model=List[DashboardResponse])
 def get_public_dashboards(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     skip: int = 0,
     limit: int = 100
 ):
@@ -81,10 +143,57 @@ def get_public_dashboards(
     
     return dashboards
 
+@router.post("/batch-get", response_model=DashboardBatchResponse)
+def batch_get_dashboards(
+    request: BatchIdsRequest,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Несколько дашбордов одним запросом (свои и публичные)"""
+    ids = batch_ids(request)
+    dashboards = {}
+    if ids:
+        dashboards = {dashboard.id: dashboard for dashboard in db.query(models.Dashboard).filter(
+            models.Dashboard.id.in_(ids),
+            (models.Dashboard.user_id == current_user.id) | (models.Dashboard.is_public == True)
+        )}
+    
+    return {
+        "dashboards": [dashboards[dashboard_id] for dashboard_id in ids if dashboard_id in dashboards],
+        "not_found": [dashboard_id for dashboard_id in ids if dashboard_id not in dashboards],
+    }
+
+@router.post("/batch-delete", response_model=BatchDeleteResponse)
+def batch_delete_dashboards(
+    request: BatchIdsRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Удаление нескольких дашбордов одной транзакцией"""
+    ids = batch_ids(request)
+    deleted = set()
+    if ids:
+        deleted = {dashboard_id for (dashboard_id,) in db.query(models.Dashboard.id).filter(
+            models.Dashboard.id.in_(ids),
+            models.Dashboard.user_id == current_user.id
+        )}
+    if deleted:
+        db.query(models.Dashboard).filter(
+            models.Dashboard.id.in_(deleted)
+        ).delete(synchronize_session=False)
+        db.commit()
+        for dashboard_id in deleted:
+            change_hub.publish([dashboard_topic(dashboard_id)], {"type": "dashboard.deleted", "dashboard_id": dashboard_id})
+    
+    return {
+        "deleted": [dashboard_id for dashboard_id in ids if dashboard_id in deleted],
+        "not_found": [dashboard_id for dashboard_id in ids if dashboard_id not in deleted],
+    }
+
 @router.get("/{dashboard_id}", response_model=DashboardResponse)
 def get_dashboard(
     dashboard_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """Получение конкретного дашборда"""
@@ -109,6 +218,47 @@ def get_dashboard(
     
     return dashboard
 
+@router.post("/widget-data")
+def get_widget_data_preview(
+    request: WidgetDataRequest,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Данные графика для еще не сохраненного виджета (по файлам текущего пользователя)"""
+    return _widget_data(db, request.widget, current_user.id)
+
+@router.get("/{dashboard_id}/widgets/{widget_id}/data")
+def get_widget_data(
+    dashboard_id: int,
+    widget_id: str,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Данные графика виджета дашборда, в том числе по соединению двух файлов"""
+    dashboard = db.query(models.Dashboard).filter(
+        models.Dashboard.id == dashboard_id,
+        (models.Dashboard.user_id == current_user.id) | (models.Dashboard.is_public == True)
+    ).first()
+    
+    if not dashboard:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dashboard not found"
+        )
+    
+    widget = next(
+        (item for item in dashboard.layout or [] if isinstance(item, dict) and str(item.get("i")) == widget_id),
+        None
+    )
+    if widget is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Widget not found"
+        )
+    
+    # Виджет строится по файлам владельца дашборда (публичный дашборд показывает его данные)
+    return _widget_data(db, widget, dashboard.user_id)
+
 @router.put("/{dashboard_id}", response_model=DashboardResponse)
 def update_dashboard(
     dashboard_id: int,
@@ -138,6 +288,16 @@ def update_dashboard(
     db.commit()
     db.refresh(db_dashboard)
     
+    # Подписчики получают новую раскладку целиком (она небольшая)
+    change_hub.publish([dashboard_topic(db_dashboard.id)], {
+        "type": "dashboard.updated",
+        "dashboard_id": db_dashboard.id,
+        "version": db_dashboard.last_edited.isoformat(),
+        "name": db_dashboard.name,
+        "is_public": db_dashboard.is_public,
+        "delta": {"layout": db_dashboard.layout},
+    })
+    
     return db_dashboard
 
 @router.delete("/{dashboard_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -160,5 +320,6 @@ def delete_dashboard(
     
     db.delete(db_dashboard)
     db.commit()
+    change_hub.publish([dashboard_topic(dashboard_id)], {"type": "dashboard.deleted", "dashboard_id": dashboard_id})
     
     return None 
\ No newline at end of file
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session
+from typing import Optional
+from server.models import models
+from server.database import get_read_db
+from server.auth.jwt import get_current_active_user
+from server.config.settings import settings
+from server.storage.generations import GenerationGone, read_current
+from server.services.version_history import (
+    VersionNotFound, diff_versions, get_version, list_versions, read_rows
+)
+
+router = APIRouter(
+    prefix=f"{settings.API_PREFIX}/csv-files",
+    tags=["csv-file-versions"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+def _get_file(db: Session, file_id: int, user: models.User) -> models.CsvFile:
+    file = db.query(models.CsvFile).filter(
+        models.CsvFile.id == file_id,
+        models.CsvFile.user_id == user.id
+    ).first()
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file not found"
+        )
+    return file
+
+def _read(db: Session, file: models.CsvFile, func):
+    """func() под арендой текущего поколения файла; удаленные версии и фрагменты - 404"""
+    try:
+        return read_current(db, [file], func)
+    except (VersionNotFound, GenerationGone, FileNotFoundError):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="CSV file version not found"
+        )
+
+@router.get("/{file_id}/versions")
+def get_csv_file_versions(
+    file_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Версии файла от новых к старым (первая - текущая)"""
+    file = _get_file(db, file_id, current_user)
+    return list_versions(db, file)
+
+@router.get("/{file_id}/versions/diff")
+def diff_csv_file_versions(
+    file_id: int,
+    from_version: Optional[int] = Query(None, alias="from"),
+    to_version: Optional[int] = Query(None, alias="to"),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Изменившиеся строки между версиями (по умолчанию - предыдущая и текущая)"""
+    file = _get_file(db, file_id, current_user)
+    if to_version is None:
+        to_version = file.version
+    if from_version is None:
+        from_version = to_version - 1
+
+    def compare():
+        return diff_versions(get_version(db, file, from_version), get_version(db, file, to_version))
+
+    return _read(db, file, compare)
+
+@router.get("/{file_id}/versions/{version}")
+def get_csv_file_version(
+    file_id: int,
+    version: int,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Содержимое версии файла (offset и limit задают окно строк)"""
+    file = _get_file(db, file_id, current_user)
+
+    def read_window():
+        source = get_version(db, file, version)
+        return {
+            "version": source.version,
+            "current": source.is_current,
+            "headers": source.headers,
+            "row_count": source.row_count,
+            "data": read_rows(source, offset, limit),
+        }
+
+    return _read(db, file, read_window)
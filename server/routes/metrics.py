@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from server.models import models
+from server.auth.jwt import get_current_active_user
+from server.config.settings import settings
+from server.database import replica_router
+from server.storage.blobs import deferred_count
+from server.services.reclaimer import reclaimer
+from server.storage.generations import active_leases
+from server.middleware.admission import admission_stats
+from server.services.change_hub import change_hub
+from server.services.file_io import file_io, loop_lag
+from server.services.result_cache import result_cache
+from server.services.sql_query import table_cache
+
+router = APIRouter(
+    prefix=f"{settings.API_PREFIX}/metrics",
+    tags=["metrics"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+@router.get("/")
+async def get_metrics(current_user: models.User = Depends(get_current_active_user)):
+    """Состояние пулов, очередей и кешей текущего воркера (только для администратора)"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
+    return {
+        "file_io": file_io.stats(),
+        "event_loop_lag": loop_lag.stats(),
+        "admission": admission_stats(),
+        "result_cache": result_cache.stats(),
+        "query_tables": table_cache.stats(),
+        "changes": change_hub.stats(),
+        "database": replica_router.stats(),
+        "generations": {"active_leases": active_leases(), "deferred_reclaims": deferred_count()},
+        "reclaimer": reclaimer.stats(),
+    }
@@ -0,0 +1,290 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import datetime
+import uuid
+from pydantic import BaseModel
+from server.models import models
+from server.database import get_db
+from server.auth.jwt import get_current_active_user
+from server.config.settings import settings
+from server.storage import blobs
+from server.routes.csv_files import CsvFileResponse
+from server.services import resumable_upload
+from server.services.resumable_upload import UploadConflict, UploadError
+from server.services.file_io import file_io
+from server.services.source_formats import canonical_name, is_supported, store_source
+from server.services.spreadsheet_ingest import IngestError
+
+router = APIRouter(
+    prefix=f"{settings.API_PREFIX}/uploads",
+    tags=["uploads"],
+    responses={401: {"description": "Unauthorized"}},
+)
+
+# Схемы данных для API
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    mime_type: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    filename: str
+    size: int
+    # Длина непрерывно полученного начала файла (как Upload-Offset в tus)
+    offset: int
+    # Всего получено байт и полученные диапазоны [начало, конец)
+    received: int
+    ranges: List[List[int]]
+    max_chunk_size: int
+    created_at: Optional[datetime] = None
+
+def _session_response(upload_session: models.UploadSession) -> UploadSessionResponse:
+    ranges = resumable_upload.received_ranges(upload_session.id)
+    return UploadSessionResponse(
+        id=upload_session.id,
+        filename=upload_session.filename,
+        size=upload_session.total_size,
+        offset=resumable_upload.contiguous_offset(ranges),
+        received=resumable_upload.received_bytes(ranges),
+        ranges=[[start, end] for start, end in ranges],
+        max_chunk_size=settings.UPLOAD_CHUNK_MAX_SIZE,
+        created_at=upload_session.created_at,
+    )
+
+def _get_session(db: Session, session_id: str, user: models.User) -> models.UploadSession:
+    upload_session = db.query(models.UploadSession).filter(
+        models.UploadSession.id == session_id,
+        models.UploadSession.user_id == user.id
+    ).first()
+
+    if upload_session and resumable_upload.is_expired(session_id):
+        # Просроченная сессия не продолжается, даже если сборщик еще не дошел до нее
+        db.delete(upload_session)
+        db.commit()
+        resumable_upload.discard_session_files(session_id)
+        upload_session = None
+
+    if not upload_session or not resumable_upload.session_exists(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload session not found or expired"
+        )
+
+    return upload_session
+
+@router.post("/", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+def create_upload_session(
+    request: UploadSessionCreate,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Создание сессии возобновляемой загрузки"""
+    if not is_supported(request.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only CSV and XLSX files are allowed"
+        )
+
+    if request.size < 0 or request.size > settings.UPLOAD_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Upload size must be between 0 and {settings.UPLOAD_MAX_SIZE} bytes"
+        )
+
+    session_id = uuid.uuid4().hex
+    try:
+        resumable_upload.create_session_files(session_id, request.size)
+    except OSError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error creating upload session: {str(e)}"
+        )
+
+    upload_session = models.UploadSession(
+        id=session_id,
+        user_id=current_user.id,
+        filename=request.filename,
+        mime_type=request.mime_type or "text/csv",
+        total_size=request.size
+    )
+    db.add(upload_session)
+    db.commit()
+    db.refresh(upload_session)
+
+    response.headers["Location"] = f"{router.prefix}/{session_id}"
+    return _session_response(upload_session)
+
+@router.patch("/{session_id}", response_model=UploadSessionResponse)
+async def upload_chunk(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Прием фрагмента: тело запроса - байты файла, начиная со смещения из заголовка Upload-Offset"""
+    # Запросы к БД, файлы сессии и удаление просроченной сессии - вне цикла событий
+    upload_session = await file_io.run(_get_session, db, session_id, current_user)
+
+    offset_header = request.headers.get("upload-offset", "")
+    if not offset_header.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload-Offset header is required"
+        )
+
+    length_header = request.headers.get("content-length", "")
+    try:
+        await resumable_upload.write_chunk(
+            session_id, int(offset_header), upload_session.total_size, request.stream(),
+            int(length_header) if length_header.isdigit() else None
+        )
+    except UploadConflict as e:
+        # Полученные байты не перезаписываются (как в tus): клиент продолжает с Upload-Offset
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except UploadError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload session not found or expired"
+        )
+
+    # Хеш и разбор CSV продвигаются по мере появления непрерывного начала файла (XLSX перекодируется при завершении)
+    if not upload_session.filename.lower().endswith(".xlsx"):
+        await file_io.run(resumable_upload.advance_scan, session_id)
+
+    return await file_io.run(_session_response, upload_session)
+
+@router.head("/{session_id}")
+def get_upload_offset(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Прогресс загрузки в заголовках (Upload-Offset, Upload-Length)"""
+    upload_session = _get_session(db, session_id, current_user)
+    ranges = resumable_upload.received_ranges(session_id)
+    return Response(headers={
+        "Upload-Offset": str(resumable_upload.contiguous_offset(ranges)),
+        "Upload-Length": str(upload_session.total_size),
+        "Cache-Control": "no-store",
+    })
+
+@router.get("/{session_id}", response_model=UploadSessionResponse)
+def get_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Прогресс загрузки с полученными диапазонами"""
+    upload_session = _get_session(db, session_id, current_user)
+    return _session_response(upload_session)
+
+@router.post("/{session_id}/complete", response_model=CsvFileResponse)
+async def complete_upload(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Завершение загрузки: файл переносится в хранилище блобов и регистрируется как CSV файл
+
+    CSV в UTF-8 с запятой переносится как есть, остальные форматы (XLSX, другие
+    кодировки и разделители) перекодируются, как при обычной загрузке.
+    """
+    upload_session = await file_io.run(_get_session, db, session_id, current_user)
+    total_size = upload_session.total_size
+
+    ranges = await file_io.run(resumable_upload.received_ranges, session_id)
+    if resumable_upload.contiguous_offset(ranges) < total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload is incomplete: received {resumable_upload.received_bytes(ranges)} of {total_size} bytes"
+        )
+
+    claimed = False
+    try:
+        source_format = await file_io.run(resumable_upload.detect_session_format, session_id, upload_session.filename)
+        if source_format.is_canonical:
+            content_hash, meta = await file_io.run(resumable_upload.finish_scan, session_id, total_size)
+            blob = await file_io.run(
+                blobs.adopt_file, resumable_upload.data_path(session_id), content_hash, total_size
+            )
+            # Для уже загружавшегося содержимого сохраненные данные не перезаписываем
+            if await file_io.run(blobs.load_artifact, blob.content_hash) is None:
+                await file_io.run(blobs.save_artifact, blob.content_hash, meta)
+        else:
+            # Файл забирается до перекодирования: параллельное завершение получит 409
+            path = await file_io.run(resumable_upload.claim_data, session_id)
+            claimed = True
+            source = await file_io.run(open, path, "rb")
+            try:
+                blob, meta = await store_source(source, source_format)
+            finally:
+                await file_io.run(source.close)
+            await file_io.run(blobs.save_artifact, blob.content_hash, meta)
+    except FileNotFoundError:
+        # Параллельный запрос уже завершил эту загрузку
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload is already being completed"
+        )
+    except IngestError as e:
+        if claimed:
+            await file_io.run(resumable_upload.unclaim_data, session_id)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except Exception as e:
+        if claimed:
+            await file_io.run(resumable_upload.unclaim_data, session_id)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing CSV file: {str(e)}"
+        )
+
+    csv_file_db = models.CsvFile(
+        name=f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{canonical_name(upload_session.filename)}",
+        original_name=upload_session.filename,
+        path=blob.path,
+        content_hash=blob.content_hash,
+        size=blob.size,
+        mime_type=upload_session.mime_type if source_format.is_canonical else "text/csv",
+        user_id=current_user.id,
+        column_headers=meta["column_headers"],
+        row_count=meta["row_count"],
+        processed_at=datetime.utcnow()
+    )
+    db.add(csv_file_db)
+    db.delete(upload_session)
+    db.commit()
+    db.refresh(csv_file_db)
+
+    await file_io.run(resumable_upload.discard_session_files, session_id)
+
+    return csv_file_db
+
+@router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+def abort_upload(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Отмена загрузки"""
+    upload_session = _get_session(db, session_id, current_user)
+    db.delete(upload_session)
+    db.commit()
+
+    resumable_upload.discard_session_files(session_id)
+
+    return None
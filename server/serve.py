@@ -0,0 +1,102 @@
+"""Точка входа для запуска API в production режиме
+
+Несколько процессов-воркеров gunicorn с uvicorn (uvloop + httptools) внутри,
+перезапуск воркеров после заданного количества запросов и плавное завершение
+по SIGTERM: новые соединения не принимаются, текущие запросы (в том числе
+загрузки файлов) дорабатывают в течение WEB_GRACEFUL_TIMEOUT секунд.
+
+Запуск: python -m server.serve
+"""
+import os
+from server.config.settings import settings
+
+def get_workers_count():
+    """Количество воркеров: из настроек или по числу доступных ядер"""
+    if settings.WEB_WORKERS > 0:
+        return settings.WEB_WORKERS
+    if hasattr(os, "sched_getaffinity"):
+        # Учитываем ограничения контейнера по ядрам
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+def get_gunicorn_options():
+    """Настройки gunicorn, собранные из settings"""
+    return {
+        "bind": f"{settings.HOST}:{settings.PORT}",
+        "workers": get_workers_count(),
+        "worker_class": "server.serve.ProductionUvicornWorker",
+        "backlog": settings.WEB_BACKLOG,
+        "keepalive": settings.WEB_KEEPALIVE,
+        "timeout": settings.WEB_TIMEOUT,
+        "graceful_timeout": settings.WEB_GRACEFUL_TIMEOUT,
+        "max_requests": settings.WEB_MAX_REQUESTS,
+        "max_requests_jitter": settings.WEB_MAX_REQUESTS_JITTER,
+        # Приложение импортируется в каждом воркере уже после fork,
+        # поэтому пулы соединений и кеши у каждого воркера свои
+        "preload_app": False,
+        "accesslog": "-",
+        "errorlog": "-",
+    }
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # gunicorn недоступен (например, на Windows)
+    BaseApplication = None
+    UvicornWorker = None
+
+if UvicornWorker is not None:
+    class ProductionUvicornWorker(UvicornWorker):
+        """Воркер uvicorn с uvloop/httptools и плавным завершением"""
+        CONFIG_KWARGS = {
+            "loop": "uvloop",
+            "http": "httptools",
+            "lifespan": "on",
+            "timeout_graceful_shutdown": settings.WEB_GRACEFUL_TIMEOUT,
+        }
+
+    class ProductionApplication(BaseApplication):
+        """Программный запуск gunicorn без отдельного конфигурационного файла"""
+
+        def __init__(self, app_uri, options=None):
+            self.app_uri = app_uri
+            self.options = options or {}
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key.lower(), value)
+
+        def load(self):
+            from gunicorn.util import import_app
+            return import_app(self.app_uri)
+
+def run_uvicorn(reload=False):
+    """Запуск через uvicorn без gunicorn (разработка или платформа без fork)"""
+    import uvicorn
+    uvicorn.run(
+        "app:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        reload=reload,
+        workers=None if reload else get_workers_count(),
+        backlog=settings.WEB_BACKLOG,
+        timeout_keep_alive=settings.WEB_KEEPALIVE,
+        timeout_graceful_shutdown=settings.WEB_GRACEFUL_TIMEOUT,
+    )
+
+def main():
+    if settings.SERVER_RELOAD:
+        run_uvicorn(reload=True)
+        return
+
+    if BaseApplication is None:
+        print("gunicorn не установлен, запускаем uvicorn без перезапуска воркеров")
+        run_uvicorn()
+        return
+
+    ProductionApplication("app:app", get_gunicorn_options()).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Массовый импорт: ZIP архив или несколько CSV (XLSX) файлов одним запросом
+
+Записи архива не распаковываются заранее: каждая читается потоком прямо
+из ZIP в свой блоб (хеш считается во время записи, как при обычной
+загрузке). Записи обрабатываются параллельно - до file_io.workers
+одновременно: копирование идет в пуле file_io, а подсчет строк небольших
+файлов - в пуле процессов parallel_scan (большие файлы и так разбираются
+на всех ядрах). Строки CsvFile всех успешно сохраненных файлов
+добавляются одной транзакцией в обработчике, результат по каждому файлу
+возвращается в манифесте.
+"""
+import asyncio
+import os
+import zipfile
+from typing import Callable, List, Optional
+from server.config.settings import settings
+from server.storage import blobs
+from server.storage.blobs import StoredBlob
+from server.services.file_io import file_io
+from server.services.parallel_scan import count_records, submit_count
+from server.services.source_formats import canonical_name, detect_format, is_supported, store_source
+from server.services.spreadsheet_ingest import IngestError
+
+class BulkImportError(Exception):
+    """Запрос не может быть импортирован целиком (превышены ограничения)"""
+
+class BulkEntry:
+    """Файл для импорта: имя в запросе или архиве и функция, открывающая его содержимое"""
+
+    def __init__(self, name: str, open_source: Optional[Callable] = None, size: Optional[int] = None,
+                 mime_type: str = "text/csv", error: Optional[str] = None):
+        self.name = name
+        self.open_source = open_source
+        self.size = size
+        self.mime_type = mime_type
+        # Запись пропускается с этой причиной (не CSV, зашифрована и т.п.)
+        self.error = error
+        self.blob: Optional[StoredBlob] = None
+        self.meta: Optional[dict] = None
+        self.row = None  # CsvFile, добавляемый в транзакцию импорта
+
+    @property
+    def original_name(self) -> str:
+        return os.path.basename(self.name)
+
+    @property
+    def stored_name(self) -> str:
+        return canonical_name(self.original_name)
+
+def _is_hidden(name: str) -> bool:
+    # Служебные записи архиваторов (__MACOSX/, ._файл, .DS_Store)
+    return any(part.startswith((".", "__MACOSX")) for part in name.split("/"))
+
+def _zip_entries(archive_name: str, source) -> List[BulkEntry]:
+    """Записи ZIP архива (читается только центральный каталог); вызывается в пуле file_io"""
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        return [BulkEntry(archive_name, error="Not a valid ZIP archive")]
+
+    entries = []
+    for info in archive.infolist():
+        if info.is_dir() or _is_hidden(info.filename):
+            continue
+        name = f"{archive_name}/{info.filename}"
+        if not is_supported(info.filename):
+            entries.append(BulkEntry(name, error="Only CSV and XLSX files are allowed"))
+        elif info.flag_bits & 0x1:
+            entries.append(BulkEntry(name, error="Encrypted entries are not supported"))
+        else:
+            # ZipFile допускает одновременное чтение разных записей из нескольких потоков
+            entries.append(BulkEntry(name, lambda info=info: archive.open(info), info.file_size))
+    return entries
+
+async def collect_entries(uploads) -> List[BulkEntry]:
+    """Файлы запроса: CSV и XLSX файлы как есть, ZIP архивы - по записям"""
+    entries: List[BulkEntry] = []
+    for upload in uploads:
+        filename = upload.filename or "upload"
+        lower = filename.lower()
+        if lower.endswith(".zip"):
+            entries.extend(await file_io.run(_zip_entries, filename, upload.file))
+        elif is_supported(lower):
+            entries.append(BulkEntry(filename, lambda upload=upload: upload.file, None, upload.content_type or "text/csv"))
+        else:
+            entries.append(BulkEntry(filename, error="Only CSV, XLSX and ZIP files are allowed"))
+
+    pending = [entry for entry in entries if entry.error is None]
+    if len(pending) > settings.BULK_IMPORT_MAX_FILES:
+        raise BulkImportError(f"Too many files: {len(pending)} (limit {settings.BULK_IMPORT_MAX_FILES})")
+    declared = sum(entry.size or 0 for entry in pending)
+    if declared > settings.BULK_IMPORT_MAX_BYTES:
+        raise BulkImportError(f"Archive content is too large: {declared} bytes (limit {settings.BULK_IMPORT_MAX_BYTES})")
+    return entries
+
+async def _count(blob: StoredBlob) -> dict:
+    """Заголовки и число строк блоба; производные данные сохраняются рядом с ним"""
+    meta = await file_io.run(blobs.load_artifact, blob.content_hash)
+    if meta is not None:
+        return meta
+    if blob.size < settings.SCAN_PARALLEL_MIN_SIZE:
+        meta, record_offsets = await asyncio.wrap_future(submit_count(blob.path))
+    else:
+        meta, record_offsets = await file_io.run(count_records, blob.path)
+    if record_offsets:
+        await file_io.run(blobs.save_artifact, blob.content_hash, record_offsets, "offsets.json")
+    await file_io.run(blobs.save_artifact, blob.content_hash, meta)
+    return meta
+
+async def _store_entry(entry: BulkEntry, limit: asyncio.Semaphore):
+    async with limit:
+        try:
+            source = await file_io.run(entry.open_source)
+            try:
+                source_format = await file_io.run(detect_format, source, entry.name)
+                entry.blob, entry.meta = await store_source(source, source_format)
+            finally:
+                await file_io.run(source.close)
+            if entry.meta is None:
+                entry.meta = await _count(entry.blob)
+            else:
+                await file_io.run(blobs.save_artifact, entry.blob.content_hash, entry.meta)
+                entry.mime_type = "text/csv"
+        except IngestError as e:
+            entry.error = str(e)
+        except Exception as e:
+            print(f"Error importing {entry.name}: {str(e)}")
+            entry.error = f"Error processing CSV file: {str(e)}"
+
+async def store_entries(entries: List[BulkEntry]):
+    """Сохраняет и разбирает записи параллельно; ошибки записываются в entry.error"""
+    limit = asyncio.Semaphore(file_io.workers)
+    await asyncio.gather(*(_store_entry(entry, limit) for entry in entries if entry.error is None))
+
+async def release_new_blobs(db, entries: List[BulkEntry]):
+    """Удаляет блобы, созданные импортом, если строки CsvFile так и не сохранились"""
+    for entry in entries:
+        if entry.blob is not None and entry.blob.is_new:
+            await file_io.run(blobs.release, db, entry.blob.content_hash, respect_grace=False)
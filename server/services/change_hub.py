@@ -0,0 +1,244 @@
+"""Уведомления об изменениях файлов и дашбордов (SSE и WebSocket)
+
+Хаб живет в памяти воркера: подписчик - это открытое SSE или WebSocket
+соединение с набором тем ("file:<id>", "dashboard:<id>"). Событие
+сериализуется в JSON один раз и раздается всем подписчикам темы.
+У каждого соединения своя ограниченная очередь (CHANGES_QUEUE_SIZE): если
+клиент не успевает читать, очередь очищается и клиент получает событие
+resync - ему нужно перечитать данные целиком. Простаивающее соединение
+держит только очередь и ожидающую корутину, без потоков и соединений с БД.
+
+Воркеры одного сервера пересылают друг другу события через unix datagram
+сокеты в каталоге CHANGES_SOCKET_DIR, без внешнего брокера. Сокеты
+завершившихся воркеров удаляются при первой неудачной отправке.
+"""
+import asyncio
+import glob
+import json
+import os
+import socket
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+from server.config.settings import settings
+from server.services.csv_rows import iter_csv_rows
+
+# Событие для клиента, пропустившего события из-за переполнения очереди
+RESYNC_EVENT = json.dumps({"type": "resync"})
+
+class Subscriber:
+    """Очередь событий одного соединения"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, topics: Iterable[str], queue_size: int):
+        self.loop = loop
+        self.topics: Set[str] = set(topics)
+        self.queue_size = max(1, queue_size)
+        self.overflowed = False
+        self._events: deque = deque()
+        self._wakeup = asyncio.Event()
+
+    def push(self, data: str):
+        """Добавляет событие (вызывается в цикле событий соединения)"""
+        if len(self._events) >= self.queue_size:
+            self._events.clear()
+            self.overflowed = True
+        else:
+            self._events.append(data)
+        self._wakeup.set()
+
+    async def next_events(self, timeout: float) -> List[str]:
+        """Накопившиеся события (JSON строки); пустой список, если за timeout ничего не пришло"""
+        if not self._events and not self.overflowed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._wakeup.clear()
+        if self.overflowed:
+            self.overflowed = False
+            self._events.clear()
+            return [RESYNC_EVENT]
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+class _Relay:
+    """Пересылка событий другим воркерам через unix datagram сокеты"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self.socket: Optional[socket.socket] = None
+        self.dropped = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop, on_message):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        self.socket.setblocking(False)
+
+        def on_readable():
+            while True:
+                try:
+                    payload = self.socket.recv(settings.CHANGES_RELAY_MAX_BYTES)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    return
+                try:
+                    message = json.loads(payload)
+                    on_message(message["topics"], message["event"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+        loop.add_reader(self.socket.fileno(), on_readable)
+
+    def stop(self, loop: asyncio.AbstractEventLoop):
+        if self.socket is None:
+            return
+        loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def send(self, payload: bytes):
+        if self.socket is None:
+            return
+        for path in glob.glob(os.path.join(self.directory, "*.sock")):
+            if path == self.path:
+                continue
+            try:
+                self.socket.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Воркер завершился, а сокет остался
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            except (BlockingIOError, OSError):
+                # Очередь получателя заполнена: его клиенты перечитают данные при следующем событии
+                self.dropped += 1
+
+class ChangeHub:
+    """Подписки на темы и раздача событий в пределах воркера"""
+
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._relay: Optional[_Relay] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Включает пересылку событий между воркерами (вызывается при запуске приложения)"""
+        self._loop = loop
+        if settings.CHANGES_RELAY_ENABLED and hasattr(socket, "AF_UNIX"):
+            relay = _Relay(settings.CHANGES_SOCKET_DIR or os.path.join(settings.UPLOAD_DIR, "hub"))
+            try:
+                relay.start(loop, self._deliver)
+                self._relay = relay
+            except OSError as e:
+                print(f"Change relay is disabled: {str(e)}")
+
+    def stop(self):
+        if self._relay is not None and self._loop is not None:
+            self._relay.stop(self._loop)
+        self._relay = None
+
+    def subscribe(self, topics: Iterable[str]) -> Subscriber:
+        """Подписка текущего соединения (вызывается в цикле событий)"""
+        subscriber = Subscriber(asyncio.get_running_loop(), topics, settings.CHANGES_QUEUE_SIZE)
+        with self._lock:
+            for topic in subscriber.topics:
+                self._topics.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def add_topics(self, subscriber: Subscriber, topics: Iterable[str]):
+        with self._lock:
+            for topic in topics:
+                subscriber.topics.add(topic)
+                self._topics.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            for topic in subscriber.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    def publish(self, topics: List[str], event: dict):
+        """Отправляет событие подписчикам тем; можно вызывать из любого потока"""
+        self.published += 1
+        data = json.dumps(event, ensure_ascii=False, default=str)
+        self._deliver(topics, data)
+
+        if self._relay is not None:
+            payload = json.dumps({"topics": topics, "event": data}, ensure_ascii=False).encode("utf-8")
+            if len(payload) > settings.CHANGES_RELAY_MAX_BYTES and "delta" in event:
+                # Дельта не помещается в датаграмму: другие воркеры получат событие без нее
+                light = json.dumps({key: value for key, value in event.items() if key != "delta"}, ensure_ascii=False, default=str)
+                payload = json.dumps({"topics": topics, "event": light}, ensure_ascii=False).encode("utf-8")
+            if len(payload) <= settings.CHANGES_RELAY_MAX_BYTES:
+                self._relay.send(payload)
+
+    def _deliver(self, topics: List[str], data: str):
+        with self._lock:
+            subscribers = set()
+            for topic in topics:
+                subscribers.update(self._topics.get(topic, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, data)
+            except RuntimeError:
+                # Цикл событий уже закрыт (завершение воркера)
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = set()
+            for topic_subscribers in self._topics.values():
+                subscribers.update(topic_subscribers)
+            return {
+                "topics": len(self._topics),
+                "subscribers": len(subscribers),
+                "published": self.published,
+                "relay_dropped": self._relay.dropped if self._relay is not None else 0,
+            }
+
+change_hub = ChangeHub()
+
+def file_topic(file_id: int) -> str:
+    return f"file:{file_id}"
+
+def dashboard_topic(dashboard_id: int) -> str:
+    return f"dashboard:{dashboard_id}"
+
+def compute_row_delta(old_path: str, new_path: str, max_rows: int) -> Optional[dict]:
+    """Изменившиеся строки между версиями файла с одинаковыми заголовками
+
+    Возвращает {"row_count": ..., "rows": [[номер строки, [значения]], ...]}
+    (строки с номерами от row_count и дальше удалены) или None, если
+    изменилось больше max_rows строк.
+    """
+    old_rows = iter_csv_rows(old_path)
+    new_rows = iter_csv_rows(new_path)
+    changed = []
+    row_count = 0
+    try:
+        for row in new_rows:
+            if next(old_rows, None) != row:
+                changed.append([row_count, row])
+                if len(changed) > max_rows:
+                    return None
+            row_count += 1
+    finally:
+        old_rows.close()
+        new_rows.close()
+    return {"row_count": row_count, "rows": changed}
@@ -0,0 +1,126 @@
+"""Чтение строк CSV файлов с проекцией столбцов и фильтрами"""
+import csv
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from server.storage.files import open_text, open_text_at_record
+
+# Поддерживаемые операторы фильтров
+FILTER_OPERATORS = {"eq", "ne", "contains", "startswith", "gt", "gte", "lt", "lte", "in"}
+
+class RowFilterError(ValueError):
+    """Некорректное описание фильтра или проекции"""
+
+def iter_csv_rows(path: str, skip_header: bool = True, offset: int = 0) -> Iterator[List[str]]:
+    """Построчно читает CSV файл, не загружая его в память целиком
+
+    offset - номер первой строки данных; для блочно-сжатых файлов чтение
+    начинается с блока, содержащего эту строку.
+    """
+    first_record = offset + 1 if skip_header else offset
+    if first_record:
+        csvfile, skip = open_text_at_record(path, first_record)
+    else:
+        csvfile, skip = open_text(path), 0
+
+    with csvfile:
+        csv_reader = csv.reader(csvfile)
+        for _ in range(skip):
+            if next(csv_reader, None) is None:
+                return
+        for row in csv_reader:
+            yield row
+
+def parse_filters(raw_filters: Optional[str]) -> List[Dict[str, Any]]:
+    """Разбирает фильтры из JSON строки вида [{"column": ..., "op": ..., "value": ...}]"""
+    if not raw_filters:
+        return []
+    try:
+        filters = json.loads(raw_filters)
+    except ValueError:
+        raise RowFilterError("filters must be a JSON array")
+    if isinstance(filters, dict):
+        filters = [filters]
+    if not isinstance(filters, list):
+        raise RowFilterError("filters must be a JSON array")
+    return filters
+
+def _to_number(value):
+    try:
+        return float(str(value).replace(",", ".").replace(" ", ""))
+    except (TypeError, ValueError):
+        return None
+
+def _compare(op: str, cell: str, value) -> bool:
+    """Сравнение значения ячейки: числовое, если обе стороны числа, иначе строковое"""
+    if op == "eq":
+        return cell == str(value)
+    if op == "ne":
+        return cell != str(value)
+    if op == "contains":
+        return str(value).lower() in cell.lower()
+    if op == "startswith":
+        return cell.lower().startswith(str(value).lower())
+    if op == "in":
+        return cell in value
+
+    left, right = _to_number(cell), _to_number(value)
+    if left is None or right is None:
+        left, right = cell, str(value)
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    if op == "lt":
+        return left < right
+    return left <= right
+
+def compile_filters(headers: List[str], filters: List[Dict[str, Any]]) -> Optional[Callable[[List[str]], bool]]:
+    """Строит предикат для строк; все условия объединяются через AND"""
+    conditions = []
+    for item in filters:
+        if not isinstance(item, dict):
+            raise RowFilterError("each filter must be an object")
+        column = item.get("column")
+        op = item.get("op", "eq")
+        if column not in headers:
+            raise RowFilterError(f"Unknown column in filter: {column}")
+        if op not in FILTER_OPERATORS:
+            raise RowFilterError(f"Unsupported filter operator: {op}")
+        value = item.get("value")
+        if op == "in":
+            if not isinstance(value, list):
+                raise RowFilterError("'in' filter requires a list value")
+            value = {str(element) for element in value}
+        conditions.append((headers.index(column), op, value))
+
+    if not conditions:
+        return None
+
+    def predicate(row: List[str]) -> bool:
+        for index, op, value in conditions:
+            cell = row[index] if index < len(row) else ""
+            if not _compare(op, cell, value):
+                return False
+        return True
+
+    return predicate
+
+def compile_projection(headers: List[str], columns: Optional[List[str]]) -> Optional[List[int]]:
+    """Возвращает индексы выбранных столбцов (None - все столбцы)"""
+    if not columns:
+        return None
+    indexes = []
+    for column in columns:
+        if column not in headers:
+            raise RowFilterError(f"Unknown column: {column}")
+        indexes.append(headers.index(column))
+    return indexes
+
+def select_rows(rows: Iterator[List[str]], predicate=None, projection=None) -> Iterator[List[str]]:
+    """Применяет фильтр и проекцию к потоку строк"""
+    for row in rows:
+        if predicate is not None and not predicate(row):
+            continue
+        if projection is not None:
+            row = [row[index] if index < len(row) else "" for index in projection]
+        yield row
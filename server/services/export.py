@@ -0,0 +1,253 @@
+"""Потоковый экспорт CSV файлов в CSV (с выбором диалекта и кодировки), XLSX и Parquet
+
+Каждый экспорт - генератор фрагментов байтов: строки читаются с диска по одной,
+а готовые фрагменты отдаются клиенту сразу, поэтому расход памяти не зависит
+от размера файла.
+"""
+import codecs
+import csv
+import io
+import re
+import zipfile
+from typing import Iterator, List
+from xml.sax.saxutils import escape
+
+EXPORT_FORMATS = {"csv", "xlsx", "parquet"}
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Размер фрагмента, после которого буфер отправляется клиенту
+CHUNK_SIZE = 64 * 1024
+
+# Количество строк в группе строк Parquet
+PARQUET_ROW_GROUP_SIZE = 65536
+
+DELIMITER_ALIASES = {"tab": "\t", "\\t": "\t", "comma": ",", "semicolon": ";", "pipe": "|"}
+
+class ExportError(ValueError):
+    """Некорректные параметры экспорта"""
+
+def normalize_delimiter(delimiter: str) -> str:
+    delimiter = DELIMITER_ALIASES.get(delimiter, delimiter) if delimiter else ","
+    if len(delimiter) != 1:
+        raise ExportError("Delimiter must be a single character")
+    return delimiter
+
+def normalize_encoding(encoding: str) -> str:
+    encoding = encoding or "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise ExportError(f"Unknown encoding: {encoding}")
+    return encoding
+
+class _ChunkSink:
+    """Файлоподобный объект только для записи: накапливает байты до выдачи генератором"""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return data
+
+def iter_csv_export(headers: List[str], rows: Iterator[List[str]], delimiter: str = ",",
+                    encoding: str = "utf-8") -> Iterator[bytes]:
+    """CSV с заданным разделителем и кодировкой; непредставимые символы заменяются"""
+    encoder = codecs.getincrementalencoder(encoding)(errors="replace")
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer, delimiter=delimiter)
+    csv_writer.writerow(headers)
+
+    for row in rows:
+        csv_writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield encoder.encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield encoder.encode(buffer.getvalue(), final=True)
+
+# Символы, недопустимые в XML 1.0
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Символы, которые Excel не допускает в имени листа
+_SHEET_NAME_ILLEGAL = re.compile(r"[\[\]:*?/\\]")
+
+# Числа без ведущих нулей ("01" остается строкой, как в исходном файле)
+_XLSX_NUMBER = re.compile(r"^-?(0|[1-9]\d{0,14})(\.\d+)?$")
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_row(row_number: int, row: List[str], letters: List[str]) -> str:
+    cells = []
+    for index, value in enumerate(row):
+        while index >= len(letters):
+            letters.append(_column_letter(len(letters)))
+        ref = f"{letters[index]}{row_number}"
+        value = "" if value is None else str(value)
+        if _XLSX_NUMBER.match(value):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        elif value:
+            text = escape(_XML_ILLEGAL.sub("", value))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+def iter_xlsx_export(headers: List[str], rows: Iterator[List[str]], sheet_name: str = "Sheet1") -> Iterator[bytes]:
+    """XLSX с inline строками: zip пишется в поток без перемотки (data descriptors)"""
+    sink = _ChunkSink()
+    letters: List[str] = []
+    # Имя листа: без запрещенных Excel символов, не длиннее 31 символа и без апострофа по краям
+    sheet_name = _SHEET_NAME_ILLEGAL.sub("_", _XML_ILLEGAL.sub("", sheet_name))[:31].strip("'")
+    sheet_name = escape(sheet_name or "Sheet1", {'"': "&quot;"})
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _XLSX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _XLSX_ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _XLSX_WORKBOOK.format(name=sheet_name))
+        archive.writestr("xl/_rels/workbook.xml.rels", _XLSX_WORKBOOK_RELS)
+
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            sheet.write(_xlsx_row(1, headers, letters).encode("utf-8"))
+            for row_number, row in enumerate(rows, start=2):
+                sheet.write(_xlsx_row(row_number, row, letters).encode("utf-8"))
+                if sink.size >= CHUNK_SIZE:
+                    yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+
+    yield sink.take()
+
+def check_parquet_available():
+    """Parquet требует pyarrow, который является необязательной зависимостью"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ExportError("Parquet export requires the pyarrow package")
+
+def iter_parquet_export(headers: List[str], rows: Iterator[List[str]]) -> Iterator[bytes]:
+    """Parquet: строки накапливаются группами по PARQUET_ROW_GROUP_SIZE, все столбцы строковые"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Parquet требует уникальных имен столбцов
+    names = []
+    for index, header in enumerate(headers):
+        name = header or f"column_{index + 1}"
+        while name in names:
+            name = f"{name}_{index + 1}"
+        names.append(name)
+
+    schema = pa.schema([(name, pa.string()) for name in names])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    columns = [[] for _ in names]
+    width = len(names)
+
+    def flush_group():
+        writer.write_table(pa.table([pa.array(column, type=pa.string()) for column in columns], schema=schema))
+        for column in columns:
+            column.clear()
+
+    try:
+        for row in rows:
+            for index in range(width):
+                columns[index].append(row[index] if index < len(row) else None)
+            if len(columns[0]) >= PARQUET_ROW_GROUP_SIZE:
+                flush_group()
+                yield sink.take()
+        if columns[0]:
+            flush_group()
+    finally:
+        writer.close()
+
+    yield sink.take()
+
+def iter_export(export_format: str, headers: List[str], rows: Iterator[List[str]],
+                delimiter: str = ",", encoding: str = "utf-8", sheet_name: str = "Sheet1") -> Iterator[bytes]:
+    if export_format == "csv":
+        return iter_csv_export(headers, rows, delimiter, encoding)
+    if export_format == "xlsx":
+        return iter_xlsx_export(headers, rows, sheet_name)
+    if export_format == "parquet":
+        return iter_parquet_export(headers, rows)
+    raise ExportError(f"Unsupported export format: {export_format}")
@@ -0,0 +1,139 @@
+"""Выделенный пул потоков для файлового ввода-вывода и разбора CSV
+
+Асинхронные обработчики (загрузка, сохранение и обновление файлов) не
+обращаются к диску из цикла событий: каждая операция - open, запись строк,
+переименование блоба, чтение производных данных - выполняется в пуле
+FILE_IO_WORKERS потоков. Большие записи разбиваются на части
+(FILE_IO_CHUNK_BYTES байт или FILE_IO_WRITE_BATCH строк за вызов), поэтому
+одно большое сохранение не занимает поток пула надолго и операции других
+запросов выполняются между его частями.
+
+Пул считает глубину очереди, занятые потоки и время ожидания, а монитор
+цикла событий - задержку цикла; и то и другое отдается в /api/metrics.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from server.config.settings import settings
+from server.storage.blobs import BlobWriter, StoredBlob
+
+class FileIOExecutor:
+    """Пул потоков с учетом очереди и занятости"""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="file-io")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.max_queue_depth = 0
+        self.max_wait = 0.0
+        self._total_wait = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет func(*args, **kwargs) в пуле и возвращает результат"""
+        submitted = time.monotonic()
+
+        def call():
+            wait = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._total_wait += wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        def on_done(future):
+            # Отмененная до запуска операция так и не покинула очередь
+            if future.cancelled():
+                with self._lock:
+                    self.queued -= 1
+
+        with self._lock:
+            self.queued += 1
+            if self.queued > self.max_queue_depth:
+                self.max_queue_depth = self.queued
+        future = self._executor.submit(call)
+        future.add_done_callback(on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                "workers": self.workers,
+                "active": self.active,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queue_depth,
+                # Доля занятых потоков; больше 1 - операции ждут в очереди
+                "saturation": round((self.active + self.queued) / self.workers, 3),
+                "completed": self.completed,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 3) if started else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+class LoopLagMonitor:
+    """Задержка цикла событий: насколько позже срока просыпается периодическая задача"""
+
+    def __init__(self, interval: float, window: int = 120):
+        self.interval = interval
+        self._samples: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def stats(self) -> dict:
+        samples = list(self._samples)
+        return {
+            "last_ms": round(samples[-1] * 1000, 3) if samples else None,
+            "max_ms": round(max(samples) * 1000, 3) if samples else None,
+            "samples": len(samples),
+        }
+
+file_io = FileIOExecutor(settings.FILE_IO_WORKERS)
+loop_lag = LoopLagMonitor(settings.LOOP_LAG_INTERVAL)
+
+def _copy_chunk(writer: BlobWriter, source, limit: int) -> int:
+    """Копирует в блоб не больше limit байт; 0 - поток закончился"""
+    copied = 0
+    while copied < limit:
+        chunk = source.read(min(limit - copied, 1024 * 1024))
+        if not chunk:
+            break
+        writer.write(chunk)
+        copied += len(chunk)
+    return copied
+
+async def store_stream(source) -> StoredBlob:
+    """Сохраняет бинарный поток как блоб частями по FILE_IO_CHUNK_BYTES"""
+    writer = await file_io.run(BlobWriter)
+    try:
+        while await file_io.run(_copy_chunk, writer, source, settings.FILE_IO_CHUNK_BYTES):
+            pass
+        return await file_io.run(writer.commit)
+    finally:
+        await file_io.run(writer.close)
@@ -0,0 +1,202 @@
+"""Hash join двух CSV файлов по значению столбца
+
+Меньший файл - сторона построения: его строки, сокращенные до нужных
+столбцов, складываются в словарь по ключу соединения, затем больший файл
+читается один раз и каждая его строка ищется в словаре.
+
+Если хеш-таблица не помещается в JOIN_MEMORY_LIMIT, соединение переходит
+на grace hash join: обе стороны раскладываются по хешу ключа во временные
+файлы-разделы, и пары разделов соединяются в памяти по очереди. Раздел,
+который все равно не помещается (перекос данных), разбивается еще раз
+с другим хешем, до JOIN_MAX_DEPTH уровней.
+
+Пустые ключи ни с чем не совпадают (как NULL в SQL).
+"""
+import csv
+import math
+import os
+import sys
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from server.config.settings import settings
+from server.services.csv_rows import iter_csv_rows
+
+JOIN_TYPES = {"inner", "left", "right", "full"}
+
+# Больше разделов за один уровень не создаем (ограничение открытых файлов)
+MAX_PARTITIONS = 256
+
+JoinedRow = Tuple[Optional[List[str]], Optional[List[str]]]
+
+class JoinError(ValueError):
+    """Некорректное описание соединения"""
+
+class JoinSide:
+    """Одна сторона соединения: файл, столбец ключа и нужные столбцы"""
+
+    def __init__(self, path: str, key_index: int, columns: List[int], size: int = 0,
+                 row_count: Optional[int] = None):
+        self.path = path
+        self.key_index = key_index
+        self.columns = columns
+        self.size = size
+        self.row_count = row_count
+
+    def rows(self) -> Iterator[Tuple[str, List[str]]]:
+        """Пары (ключ, значения нужных столбцов)"""
+        key_index = self.key_index
+        columns = self.columns
+        for row in iter_csv_rows(self.path):
+            key = row[key_index].strip() if key_index < len(row) else ""
+            yield key, [row[index] if index < len(row) else "" for index in columns]
+
+def _row_size(key: str, values: List[str]) -> int:
+    """Примерный объем строки в хеш-таблице (строки Python, список и элемент списка ключа)"""
+    return sys.getsizeof(key) + sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values) + 8
+
+class HashJoin:
+    """Итератор пар (значения левой строки, значения правой строки)
+
+    Для строк без пары в внешних соединениях вместо значений другой стороны - None.
+    """
+
+    def __init__(self, left: JoinSide, right: JoinSide, how: str = "inner", memory_limit: Optional[int] = None):
+        if how not in JOIN_TYPES:
+            raise JoinError(f"Unsupported join type: {how}")
+        self.left = left
+        self.right = right
+        self.how = how
+        self.memory_limit = settings.JOIN_MEMORY_LIMIT if memory_limit is None else memory_limit
+        # Строим хеш-таблицу по меньшему файлу
+        self.build_side = "right" if right.size <= left.size else "left"
+        self.spilled_partitions = 0
+
+    def __iter__(self) -> Iterator[JoinedRow]:
+        if self.build_side == "right":
+            build, probe = self.right, self.left
+            keep_build, keep_probe = self.how in ("right", "full"), self.how in ("left", "full")
+        else:
+            build, probe = self.left, self.right
+            keep_build, keep_probe = self.how in ("left", "full"), self.how in ("right", "full")
+
+        pairs = self._join(build.rows(), probe.rows(), keep_build, keep_probe, build.row_count, 0)
+        if self.build_side == "right":
+            for build_values, probe_values in pairs:
+                yield probe_values, build_values
+        else:
+            yield from pairs
+
+    def stats(self) -> dict:
+        return {"build_side": self.build_side, "spilled_partitions": self.spilled_partitions}
+
+    # --- Соединение в памяти ----------------------------------------------
+
+    def _build(self, rows: Iterator[Tuple[str, List[str]]], limit: Optional[int]):
+        """Хеш-таблица по строкам; при превышении limit возвращает еще и объем уже прочитанного"""
+        table: Dict[str, List[List[str]]] = {}
+        unmatched_empty: List[List[str]] = []
+        used = 0
+        for key, values in rows:
+            if key:
+                bucket = table.get(key)
+                if bucket is None:
+                    table[key] = [values]
+                else:
+                    bucket.append(values)
+            else:
+                unmatched_empty.append(values)
+            used += _row_size(key, values)
+            if limit is not None and used > limit:
+                return table, unmatched_empty, used
+        return table, unmatched_empty, None
+
+    def _probe(self, table: Dict[str, List[List[str]]], unmatched_empty: List[List[str]],
+               probe_rows: Iterable[Tuple[str, List[str]]], keep_build: bool, keep_probe: bool) -> Iterator[JoinedRow]:
+        matched = set() if keep_build else None
+        for key, values in probe_rows:
+            bucket = table.get(key) if key else None
+            if bucket is None:
+                if keep_probe:
+                    yield None, values
+                continue
+            if matched is not None:
+                matched.add(key)
+            for build_values in bucket:
+                yield build_values, values
+
+        if keep_build:
+            for key, bucket in table.items():
+                if key not in matched:
+                    for build_values in bucket:
+                        yield build_values, None
+            for build_values in unmatched_empty:
+                yield build_values, None
+
+    # --- Разделы на диске -------------------------------------------------
+
+    def _join(self, build_rows: Iterator[Tuple[str, List[str]]], probe_rows: Iterable[Tuple[str, List[str]]],
+              keep_build: bool, keep_probe: bool, expected_rows: Optional[int], depth: int) -> Iterator[JoinedRow]:
+        limit = self.memory_limit if depth < settings.JOIN_MAX_DEPTH else None
+        table, unmatched_empty, used = self._build(build_rows, limit)
+        if used is None:
+            if not table and not keep_probe:
+                # Пар не будет: сторону проверки можно не читать
+                for build_values in unmatched_empty if keep_build else []:
+                    yield build_values, None
+                return
+            yield from self._probe(table, unmatched_empty, probe_rows, keep_build, keep_probe)
+            return
+
+        # Число разделов по оценке полного объема стороны построения
+        consumed = sum(len(bucket) for bucket in table.values()) + len(unmatched_empty)
+        estimated = used * max(1.0, (expected_rows or 0) / max(consumed, 1)) * 2
+        partitions = min(MAX_PARTITIONS, max(2, math.ceil(estimated / max(self.memory_limit, 1))))
+        self.spilled_partitions += partitions
+        print(f"Hash join spills to {partitions} partitions (depth {depth})")
+
+        spill_dir = settings.JOIN_SPILL_DIR or None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="join_", dir=spill_dir) as directory:
+            already_read = ((key, values) for key, bucket in table.items() for values in bucket)
+            empty_keys = (("", values) for values in unmatched_empty)
+            build_counts = _partition(_chain(already_read, empty_keys, build_rows), directory, "build", partitions, depth)
+            del table, unmatched_empty
+            _partition(probe_rows, directory, "probe", partitions, depth)
+
+            for number in range(partitions):
+                yield from self._join(
+                    _read_partition(directory, "build", number),
+                    _read_partition(directory, "probe", number),
+                    keep_build, keep_probe, build_counts[number], depth + 1
+                )
+
+def _chain(*iterables):
+    for iterable in iterables:
+        yield from iterable
+
+def _partition_path(directory: str, side: str, number: int) -> str:
+    return os.path.join(directory, f"{side}_{number}.csv")
+
+def _partition(rows: Iterable[Tuple[str, List[str]]], directory: str, side: str, partitions: int, depth: int) -> List[int]:
+    """Раскладывает строки по разделам (хеш ключа с солью уровня); возвращает число строк в разделах"""
+    files = [open(_partition_path(directory, side, number), "w", encoding="utf-8", newline="") for number in range(partitions)]
+    counts = [0] * partitions
+    try:
+        writers = [csv.writer(file) for file in files]
+        for key, values in rows:
+            number = hash((depth, key)) % partitions
+            writers[number].writerow([key] + values)
+            counts[number] += 1
+    finally:
+        for file in files:
+            file.close()
+    return counts
+
+def _read_partition(directory: str, side: str, number: int) -> Iterator[Tuple[str, List[str]]]:
+    path = _partition_path(directory, side, number)
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        for row in csv.reader(file):
+            yield row[0], row[1:]
+    # Прочитанный раздел больше не нужен
+    os.remove(path)
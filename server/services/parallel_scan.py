@@ -0,0 +1,388 @@
+"""Параллельный разбор CSV файлов на нескольких ядрах
+
+Файл делится на диапазоны байт, которые разбираются csv.reader в пуле процессов,
+а частичные результаты (число записей, смещения записей, статистика столбцов)
+объединяются. Чтобы найти границы записей при переводах строк внутри кавычек,
+сначала параллельно считается число кавычек в каждом диапазоне: по четности
+суммы кавычек до начала диапазона известно, находится ли его начало внутри
+кавычек, и диапазон начинается с первой границы записи после своего смещения.
+Блочно-сжатые файлы уже разрезаны по границам записей, поэтому диапазоны -
+это группы блоков, и подсчет кавычек не нужен.
+
+Файлы меньше SCAN_PARALLEL_MIN_SIZE разбираются в текущем процессе тем же кодом.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+from server.config.settings import settings
+from server.storage.blocks import BlockIndex, BlockReader, is_block_file
+
+# Размер фрагмента при чтении диапазона
+READ_SIZE = 4 * 1024 * 1024
+
+# Смещение сохраняется для каждой RECORD_OFFSETS_STEP-й записи
+RECORD_OFFSETS_STEP = 10000
+
+SCAN_TASKS = {"count", "stats"}
+
+_NUMBER = re.compile(r"^-?\d+(?:[.,]\d+)?$")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.SCAN_WORKERS or os.cpu_count() or 1
+            # spawn: дочерние процессы не наследуют потоки и соединения с БД воркера
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def _map(function, arguments: List[tuple], parallel: bool) -> list:
+    if not parallel or len(arguments) < 2:
+        return [function(*args) for args in arguments]
+    executor = _get_executor()
+    return list(executor.map(function, *zip(*arguments)))
+
+# --- Частичные результаты -------------------------------------------------
+
+class _CountResult:
+    """Число записей и номера физических строк, с которых начинается каждая RECORD_OFFSETS_STEP-я запись"""
+
+    def __init__(self):
+        self.records = 0
+        self.line_numbers: List[Tuple[int, int]] = []  # (номер записи в диапазоне, номер строки)
+
+    def add(self, row: List[str], line_number: int):
+        if self.records % RECORD_OFFSETS_STEP == 0:
+            self.line_numbers.append((self.records, line_number))
+        self.records += 1
+
+    def result(self) -> dict:
+        return {"records": self.records, "line_numbers": self.line_numbers}
+
+class _StatsResult:
+    """Количество непустых и числовых значений, сумма, минимум и максимум по столбцам"""
+
+    def __init__(self):
+        self.records = 0
+        self.columns: List[List] = []
+
+    def add(self, row: List[str], line_number: int):
+        self.records += 1
+        while len(self.columns) < len(row):
+            self.columns.append([0, 0, 0.0, None, None])
+        for index, value in enumerate(row):
+            if not value:
+                continue
+            column = self.columns[index]
+            column[0] += 1
+            value = value.replace(" ", "").replace("\xa0", "")
+            if _NUMBER.match(value):
+                number = float(value.replace(",", "."))
+                column[1] += 1
+                column[2] += number
+                column[3] = number if column[3] is None else min(column[3], number)
+                column[4] = number if column[4] is None else max(column[4], number)
+
+    def result(self) -> dict:
+        return {"records": self.records, "columns": self.columns}
+
+_RESULTS = {"count": _CountResult, "stats": _StatsResult}
+
+def _line_start(data: bytes, line: int) -> int:
+    """Смещение начала физической строки line во фрагменте (строки разделены \n)"""
+    position, current = 0, 0
+    # Быстро пропускаем целые участки, считая в них переводы строки
+    while current < line:
+        count = data.count(b"\n", position, position + 65536)
+        if current + count >= line or position + 65536 >= len(data):
+            break
+        current += count
+        position += 65536
+    while current < line:
+        position = data.index(b"\n", position) + 1
+        current += 1
+    return position
+
+class _RangeLines:
+    """Строки диапазона для csv.reader без загрузки диапазона в память
+
+    Байты читаются по READ_SIZE и режутся по последнему переводу строки,
+    каждый фрагмент разбивается на строки так же, как файл с newline=""
+    (\r, \n и \r\n). Смещение начала строки с заданным номером вычисляется
+    по фрагменту, в котором она находится. Если в диапазоне есть одиночные \r,
+    смещения не вычисляются (exact = False).
+    """
+
+    def __init__(self, source, base_offset: int, length: int):
+        self._source = source
+        self._remaining = length
+        self._buffer = bytearray()
+        self._data = b""
+        self._offset = base_offset  # смещение текущего фрагмента
+        self._line = 0  # номер первой строки текущего фрагмента
+        self._lines = 0  # число строк, начинающихся в текущем фрагменте
+        self._pending: Optional[int] = None
+        self.offsets: Dict[int, int] = {}
+        self.exact = True
+
+    def __iter__(self):
+        # Строки берутся из фрагментов через chain (без генератора на каждую строку)
+        return chain.from_iterable(self._chunks())
+
+    def _chunks(self):
+        while self._next_chunk():
+            yield io.StringIO(self._data.decode("utf-8", errors="replace"), newline="")
+
+    def mark(self, line: int):
+        """Запоминает смещение начала строки line (текущего или следующих фрагментов)"""
+        self._pending = line
+        self._resolve()
+
+    def _next_chunk(self) -> bool:
+        buffer = self._buffer
+        while True:
+            if self._remaining > 0:
+                data = self._source.read(min(READ_SIZE, self._remaining))
+                self._remaining = self._remaining - len(data) if data else 0
+                buffer += data
+            if self._remaining == 0:
+                cut = len(buffer)
+            else:
+                # \r в самом конце может оказаться началом \r\n
+                cut = max(buffer.rfind(b"\n"), buffer.rfind(b"\r", 0, len(buffer) - 1)) + 1
+            if cut > 0 or self._remaining == 0:
+                break
+
+        self._offset += len(self._data)
+        self._line += self._lines
+        self._data = bytes(buffer[:cut])
+        del buffer[:cut]
+        if not self._data:
+            return False
+        carriage_returns = self._data.count(b"\r")
+        crlf = self._data.count(b"\r\n")
+        if carriage_returns != crlf:
+            self.exact = False
+        self._lines = self._data.count(b"\n") + carriage_returns - crlf
+        if not self._data.endswith((b"\n", b"\r")):
+            # Последняя строка без перевода строки
+            self._lines += 1
+        self._resolve()
+        return True
+
+    def _resolve(self):
+        line = self._pending
+        if line is None or not self.exact or line >= self._line + self._lines:
+            return
+        self.offsets[line] = self._offset + _line_start(self._data, line - self._line)
+        self._pending = None
+
+def _parse(source, base_offset: int, length: int, task: str,
+           skip_first: bool) -> Tuple[dict, Optional[List[str]]]:
+    """Разбирает целые записи потоком; возвращает частичный результат и первую запись, если она пропущена"""
+    accumulator = _RESULTS[task]()
+    first_row = None
+    lines = _RangeLines(source, base_offset, length)
+    reader = csv.reader(lines)
+
+    # Для записи, на которую приходится шаг RECORD_OFFSETS_STEP, запоминается смещение начала ее строки
+    checkpoints = task == "count"
+    line_number = 0
+    if checkpoints and not skip_first:
+        lines.mark(line_number)
+    for row in reader:
+        if skip_first and first_row is None:
+            first_row = row
+        else:
+            accumulator.add(row, line_number)
+        # Следующая запись начинается со строки после последней прочитанной
+        line_number = reader.line_num
+        if checkpoints and accumulator.records % RECORD_OFFSETS_STEP == 0:
+            lines.mark(line_number)
+
+    result = accumulator.result()
+    if task == "count":
+        line_numbers = result.pop("line_numbers")
+        result["offsets"] = None if not lines.exact else [
+            (record, lines.offsets[line]) for record, line in line_numbers
+        ]
+    return result, first_row
+
+# --- Задачи для процессов пула --------------------------------------------
+
+def _count_quotes(path: str, start: int, end: int) -> int:
+    count = 0
+    with open(path, "rb") as source:
+        source.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = source.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            count += data.count(b'"')
+            remaining -= len(data)
+    return count
+
+def _next_boundary(source, position: int, in_quotes: bool) -> int:
+    """Первая граница записи (позиция после перевода строки вне кавычек) не раньше position"""
+    if position == 0:
+        return 0
+    source.seek(position - 1)
+    previous = source.read(1)
+    if previous == b"\n" and not in_quotes:
+        return position
+    while True:
+        data = source.read(READ_SIZE)
+        if not data:
+            return source.tell()
+        start = 0
+        while True:
+            newline = data.find(b"\n", start)
+            if newline < 0:
+                if data.count(b'"', start) % 2:
+                    in_quotes = not in_quotes
+                break
+            if data.count(b'"', start, newline) % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                return position + newline + 1
+            start = newline + 1
+        position += len(data)
+
+def _scan_plain_range(path: str, start: int, end: int, start_in_quotes: bool, end_in_quotes: bool,
+                      task: str) -> Tuple[dict, Optional[List[str]]]:
+    with open(path, "rb") as source:
+        first = _next_boundary(source, start, start_in_quotes)
+        last = _next_boundary(source, end, end_in_quotes) if end < os.fstat(source.fileno()).st_size else end
+        if first >= last:
+            # В диапазоне нет начала записи (например, он внутри длинного значения в кавычках)
+            return _parse(source, first, 0, task, skip_first=False)
+        source.seek(first)
+        return _parse(source, first, last - first, task, skip_first=first == 0)
+
+def _scan_block_range(path: str, first_block: int, last_block: int, task: str) -> Tuple[dict, Optional[List[str]]]:
+    with BlockReader(path) as reader:
+        raw_offset = reader.index.blocks[first_block][0]
+        raw_end = reader.index.blocks[last_block - 1][0] + reader.index.blocks[last_block - 1][3]
+        reader.seek(raw_offset)
+        return _parse(reader, raw_offset, raw_end - raw_offset, task, skip_first=raw_offset == 0)
+
+# --- Разбиение на диапазоны и объединение ----------------------------------
+
+def _scan(path: str, task: str) -> Tuple[List[dict], Optional[List[str]]]:
+    """Частичные результаты по диапазонам (в порядке следования) и строка заголовков"""
+    if task not in SCAN_TASKS:
+        raise ValueError(f"Unknown scan task: {task}")
+    range_size = max(1, settings.SCAN_RANGE_SIZE)
+
+    if is_block_file(path):
+        with open(path, "rb") as source:
+            index = BlockIndex.load(source)
+        parallel = index.raw_size >= settings.SCAN_PARALLEL_MIN_SIZE
+        groups = []
+        group_start, group_size = 0, 0
+        for number, block in enumerate(index.blocks):
+            group_size += block[3]
+            if group_size >= range_size:
+                groups.append((path, group_start, number + 1, task))
+                group_start, group_size = number + 1, 0
+        if group_start < len(index.blocks):
+            groups.append((path, group_start, len(index.blocks), task))
+        results = _map(_scan_block_range, groups, parallel)
+    else:
+        size = os.path.getsize(path)
+        parallel = size >= settings.SCAN_PARALLEL_MIN_SIZE
+        if not parallel:
+            range_size = max(size, 1)
+        bounds = list(range(0, size, range_size)) + [size]
+        spans = list(zip(bounds[:-1], bounds[1:]))
+
+        # Четность кавычек до начала каждого диапазона
+        quotes = _map(_count_quotes, [(path, start, end) for start, end in spans], parallel)
+        in_quotes = [False]
+        for count in quotes:
+            in_quotes.append(in_quotes[-1] ^ bool(count % 2))
+
+        arguments = [
+            (path, start, end, in_quotes[number], in_quotes[number + 1], task)
+            for number, (start, end) in enumerate(spans)
+        ]
+        results = _map(_scan_plain_range, arguments, parallel)
+
+    headers = next((first_row for _, first_row in results if first_row is not None), None)
+    return [partial for partial, _ in results], headers
+
+def count_records(path: str) -> Tuple[dict, Optional[dict]]:
+    """Заголовки и число строк данных; для обычных файлов также смещения записей
+
+    Смещения ([номер записи, смещение в байтах] примерно для каждой
+    RECORD_OFFSETS_STEP-й записи) позволяют начинать чтение окна строк
+    без разбора файла с начала.
+    """
+    partials, headers = _scan(path, "count")
+    row_count = 0
+    offsets = []
+    for partial in partials:
+        if partial["offsets"] is None:
+            offsets = None
+        elif offsets is not None:
+            for record, offset in partial["offsets"]:
+                # Номер записи в файле: запись 0 - заголовок
+                offsets.append([row_count + record + 1, offset])
+        row_count += partial["records"]
+
+    meta = {"column_headers": headers or [], "row_count": row_count}
+    record_offsets = None
+    if not is_block_file(path) and offsets:
+        record_offsets = {"offsets": offsets}
+    return meta, record_offsets
+
+def submit_count(path: str) -> Future:
+    """count_records файла меньше SCAN_PARALLEL_MIN_SIZE в пуле процессов
+
+    Для разбора многих небольших файлов одновременно (массовый импорт):
+    каждый файл целиком разбирается одним процессом пула.
+    """
+    return _get_executor().submit(count_records, path)
+
+def column_stats(path: str) -> dict:
+    """Статистика по столбцам всего файла"""
+    partials, headers = _scan(path, "stats")
+    headers = headers or []
+    merged: List[List] = []
+    row_count = 0
+    for partial in partials:
+        row_count += partial["records"]
+        for index, column in enumerate(partial["columns"]):
+            while len(merged) <= index:
+                merged.append([0, 0, 0.0, None, None])
+            target = merged[index]
+            target[0] += column[0]
+            target[1] += column[1]
+            target[2] += column[2]
+            for position, pick in ((3, min), (4, max)):
+                if column[position] is not None:
+                    target[position] = column[position] if target[position] is None else pick(target[position], column[position])
+
+    columns: List[Dict] = []
+    for index in range(max(len(headers), len(merged))):
+        filled, numeric, total, minimum, maximum = merged[index] if index < len(merged) else [0, 0, 0.0, None, None]
+        columns.append({
+            "name": headers[index] if index < len(headers) else f"column_{index + 1}",
+            "non_empty": filled,
+            "numeric": numeric,
+            "sum": total if numeric else None,
+            "mean": total / numeric if numeric else None,
+            "min": minimum,
+            "max": maximum,
+        })
+    return {"row_count": row_count, "columns": columns}
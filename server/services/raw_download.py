@@ -0,0 +1,195 @@
+"""Отдача исходных байтов файла с поддержкой Range запросов
+
+Обычные файлы передаются без буферизации в Python: через расширение ASGI
+http.response.zerocopysend (sendfile), если сервер его поддерживает, либо
+через X-Accel-Redirect, если перед API стоит nginx (RAW_ACCEL_REDIRECT_PREFIX).
+Иначе файл читается напрямую os.pread большими фрагментами.
+Блочно-сжатые файлы распаковываются поблочно, только в пределах запрошенных диапазонов.
+"""
+import os
+import secrets
+from typing import List, Optional, Tuple
+import anyio
+from starlette.responses import Response
+from server.storage.blocks import BlockReader, is_block_file
+from server.storage.generations import ReadLease
+
+# Размер фрагмента при чтении без sendfile
+CHUNK_SIZE = 1024 * 1024
+
+# При большем числе диапазонов (после объединения) отдается весь файл
+MAX_RANGES = 16
+
+class RangeNotSatisfiable(Exception):
+    """Ни один из запрошенных диапазонов не пересекается с файлом"""
+
+def parse_range_header(value: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """Разбирает заголовок Range (bytes=0-99,200-,-500) в список включающих диапазонов
+
+    Возвращает None, если заголовка нет или он некорректен (отдается весь файл).
+    """
+    if not value or not value.strip().lower().startswith("bytes="):
+        return None
+
+    ranges = []
+    for part in value.strip()[6:].split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_text, separator, end_text = part.partition("-")
+        start_text, end_text = start_text.strip(), end_text.strip()
+        if not separator:
+            return None
+        if not start_text:
+            # Суффиксный диапазон: последние N байт
+            if not end_text.isdigit():
+                return None
+            length = int(end_text)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+        if not start_text.isdigit() or (end_text and not end_text.isdigit()):
+            return None
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+        if end_text and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Объединяем пересекающиеся и соседние диапазоны
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+class RangeFileResponse(Response):
+    """Ответ с содержимым файла целиком (200), одним диапазоном или multipart/byteranges (206)"""
+
+    def __init__(self, path: str, size: int, ranges: Optional[List[Tuple[int, int]]],
+                 media_type: str, headers: dict, send_body: bool = True, lease: Optional[ReadLease] = None):
+        self.path = path
+        # Аренда поколения файла: освобождается после отправки последнего фрагмента
+        self.lease = lease
+        self.size = size
+        self.ranges = ranges
+        self.send_body = send_body
+        self.content_type = media_type
+        self.boundary = secrets.token_hex(16)
+        self._parts = []
+
+        headers = dict(headers)
+        headers["Accept-Ranges"] = "bytes"
+
+        if ranges is None:
+            status_code = 200
+            headers["Content-Length"] = str(size)
+            headers["Content-Type"] = media_type
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            headers["Content-Type"] = media_type
+        else:
+            status_code = 206
+            length = 0
+            for start, end in ranges:
+                part_header = (
+                    f"\r\n--{self.boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self._parts.append((part_header, start, end))
+                length += len(part_header) + end - start + 1
+            self._closing = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+            length += len(self._closing)
+            headers["Content-Length"] = str(length)
+            headers["Content-Type"] = f"multipart/byteranges; boundary={self.boundary}"
+
+        super().__init__(status_code=status_code, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self._send(scope, send)
+        finally:
+            if self.lease is not None:
+                self.lease.close()
+
+    async def _send(self, scope, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        block_format = is_block_file(self.path)
+
+        if block_format:
+            source = BlockReader(self.path)
+        else:
+            # Небуферизованный файл: данные не проходят через буфер Python
+            source = open(self.path, "rb", buffering=0)
+
+        try:
+            if self.ranges is None:
+                segments = [(b"", 0, self.size - 1)]
+            elif len(self.ranges) == 1:
+                segments = [(b"", self.ranges[0][0], self.ranges[0][1])]
+            else:
+                segments = self._parts
+
+            for part_header, start, end in segments:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                if block_format:
+                    await self._send_decompressed(send, source, start, end)
+                elif zero_copy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": source,
+                        "offset": start,
+                        "count": end - start + 1,
+                        "more_body": True,
+                    })
+                else:
+                    await self._send_pread(send, source.fileno(), start, end)
+
+            closing = self._closing if self.ranges is not None and len(self.ranges) > 1 else b""
+            await send({"type": "http.response.body", "body": closing, "more_body": False})
+        finally:
+            source.close()
+
+    async def _send_pread(self, send, fd: int, start: int, end: int):
+        position = start
+        while position <= end:
+            length = min(CHUNK_SIZE, end - position + 1)
+            data = await anyio.to_thread.run_sync(os.pread, fd, length, position)
+            if not data:
+                break
+            position += len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": True})
+
+    async def _send_decompressed(self, send, reader: BlockReader, start: int, end: int):
+        position = start
+        while position <= end:
+            length = min(CHUNK_SIZE, end - position + 1)
+            reader.seek(position)
+            data = await anyio.to_thread.run_sync(reader.read, length)
+            if not data:
+                break
+            position += len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": True})
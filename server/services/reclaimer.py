@@ -0,0 +1,163 @@
+"""Фоновое освобождение места на диске после удаления файлов
+
+Удаление строк CsvFile не ждет диска: обработчик фиксирует транзакцию и
+передает хеши блобов (и пути файлов вне хранилища блобов) сюда. Задача
+в цикле событий воркера просыпается сразу после schedule и раз в
+RECLAIM_INTERVAL_SECONDS и выполняет в пуле file_io проход run_once:
+удаляет блобы без ссылок, фрагменты версий без ссылок и повторяет
+удаление блобов, отложенное из-за читателей (blobs.reclaim_deferred).
+Недавно записанные блобы (BLOB_GC_GRACE_SECONDS) остаются в очереди до
+следующего прохода. Не чаще раза в RECLAIM_INTERVAL_SECONDS проход также
+удаляет просроченные сессии возобновляемой загрузки (UPLOAD_SESSION_TTL).
+
+Очередь хранится в памяти воркера: то, что не успели удалить до остановки,
+удалит сборка мусора при следующем запуске (app.py).
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Iterable, Optional
+from server.config.settings import settings
+from server.database import SessionLocal
+from server.models import models
+from server.storage import blobs
+from server.storage.generations import remove_unless_leased
+from server.services.file_io import file_io
+from server.services.resumable_upload import collect_expired_sessions
+from server.services.version_history import collect_garbage as collect_version_garbage
+
+def remove_legacy_file(db, file_path: Optional[str]) -> bool:
+    """Удаляет файл, сохраненный вне хранилища блобов, если на него больше нет ссылок"""
+    if not file_path or blobs.is_blob_path(file_path) or not os.path.exists(file_path):
+        return False
+    if db.query(models.CsvFile).filter(models.CsvFile.path == file_path).count() > 0:
+        return False
+    try:
+        # Файл, который еще читают, остается на диске: ссылок на него уже нет, и новые читатели его не откроют
+        if remove_unless_leased(file_path, lambda: os.remove(file_path)):
+            return True
+        print(f"Warning: File {file_path} is still being read, leaving it in place")
+    except Exception as e:
+        print(f"Warning: Could not remove file {file_path}: {str(e)}")
+    return False
+
+def _is_recent(content_hash: str) -> bool:
+    try:
+        return time.time() - os.path.getmtime(blobs.blob_path(content_hash)) < settings.BLOB_GC_GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+class Reclaimer:
+    """Очередь удаления блобов, файлов и фрагментов версий, на которые больше нет ссылок"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._hashes: set = set()
+        self._paths: set = set()
+        self._chunks = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._runs = 0
+        self._removed = 0
+        self._sessions_collected = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._loop = None
+
+    def schedule(self, content_hashes: Iterable[Optional[str]] = (), legacy_paths: Iterable[Optional[str]] = (),
+                 chunks: bool = False):
+        """Ставит в очередь блобы и файлы удаленных строк (вызывается после commit)
+
+        chunks - удалялась история версий, нужна сборка мусора фрагментов.
+        """
+        with self._lock:
+            self._hashes.update(content_hash for content_hash in content_hashes if content_hash)
+            self._paths.update(path for path in legacy_paths if path)
+            self._chunks = self._chunks or chunks
+        loop = self._loop
+        if loop is None:
+            # Фоновая задача не запущена (скрипты, миграции): освобождаем сразу
+            self.run_once()
+            return
+        loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await file_io.run(self.run_once)
+            except Exception as e:
+                print(f"Error reclaiming storage: {str(e)}")
+
+    def run_once(self) -> int:
+        """Один проход по очереди; возвращает число удаленных блобов и файлов"""
+        with self._run_lock:
+            with self._lock:
+                hashes, self._hashes = self._hashes, set()
+                paths, self._paths = self._paths, set()
+                chunks, self._chunks = self._chunks, False
+
+            removed = 0
+            retry = set()
+            db = SessionLocal()
+            try:
+                for content_hash in hashes:
+                    if blobs.release(db, content_hash):
+                        removed += 1
+                    elif _is_recent(content_hash):
+                        retry.add(content_hash)
+                for path in paths:
+                    if remove_legacy_file(db, path):
+                        removed += 1
+                if chunks:
+                    collect_version_garbage(db)
+                removed += blobs.reclaim_deferred(db)
+                if time.monotonic() - self._sessions_collected >= self.interval:
+                    self._sessions_collected = time.monotonic()
+                    expired = collect_expired_sessions(db)
+                    if expired:
+                        print(f"Removed expired upload sessions: {expired}")
+            except BaseException:
+                # Проход прерван: очередь повторится в следующий раз
+                with self._lock:
+                    self._hashes.update(hashes)
+                    self._paths.update(paths)
+                    self._chunks = self._chunks or chunks
+                raise
+            finally:
+                db.close()
+
+            if retry:
+                with self._lock:
+                    self._hashes.update(retry)
+            self._runs += 1
+            self._removed += removed
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_blobs": len(self._hashes),
+                "pending_paths": len(self._paths),
+                "runs": self._runs,
+                "removed": self._removed,
+            }
+
+reclaimer = Reclaimer(settings.RECLAIM_INTERVAL_SECONDS)
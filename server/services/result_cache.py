@@ -0,0 +1,245 @@
+"""Кеш результатов чтения и агрегаций по CSV файлам
+
+Ключ - файлы с их версиями (хеш содержимого) и нормализованное описание
+запроса, поэтому после изменения файла старые результаты просто перестают
+совпадать; update_csv_file и delete_csv_file дополнительно сразу удаляют
+записи файла из памяти воркера.
+
+Результат хранится готовым JSON (bytes) и отдается без повторной
+сериализации. В памяти - LRU с ограничением суммарного размера
+(RESULT_CACHE_MAX_BYTES); вытесненные записи сохраняются на диск в
+RESULT_CACHE_DIR (второй уровень, общий для воркеров, RESULT_CACHE_DISK_MAX_BYTES).
+Одновременные одинаковые запросы объединяются (single-flight): считает
+первый, остальные ждут его результат.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from server.config.settings import settings
+
+# Полная проверка размера дискового уровня - раз в столько записей на диск
+DISK_TRIM_EVERY = 64
+
+FileVersion = Tuple[int, Optional[str]]
+
+class _Flight:
+    """Выполняющееся вычисление, которого ждут одинаковые запросы"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+class ResultCache:
+    """LRU кеш готовых JSON ответов с дисковым уровнем и объединением запросов"""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int, disk_dir: Optional[str], disk_max_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_dir = disk_dir if disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._tags: Dict[str, Set[int]] = {}
+        self._by_file: Dict[int, Set[str]] = {}
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._spilled = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(files: Sequence[FileVersion], spec: dict) -> str:
+        normalized = json.dumps({"files": [list(file) for file in files], "spec": spec},
+                                sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, files: Sequence[FileVersion], spec: dict, compute: Callable[[], Any]) -> bytes:
+        """JSON результата из кеша или вычисленный compute() (один раз на все одинаковые запросы)"""
+        key = self.make_key(files, spec)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.data
+
+        try:
+            data = self._disk_get(key)
+            if data is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                data = json.dumps(compute(), ensure_ascii=False, default=str).encode("utf-8")
+            self._store(key, data, {file_id for file_id, _ in files})
+            flight.data = data
+            return data
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def invalidate_file(self, file_id: int) -> int:
+        """Удаляет из памяти и с диска записи, в которых участвует файл"""
+        with self._lock:
+            keys = self._by_file.pop(file_id, set())
+            for key in keys:
+                data = self._entries.pop(key, None)
+                if data is not None:
+                    self._bytes -= len(data)
+                self._untag(key)
+        for key in keys:
+            self._disk_remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "inflight": len(self._inflight),
+            }
+
+    # --- Память -------------------------------------------------------------
+
+    def _store(self, key: str, data: bytes, file_ids: Set[int]):
+        if len(data) > self.max_entry_bytes:
+            return
+        evicted: List[Tuple[str, bytes]] = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            self._tags[key] = file_ids
+            for file_id in file_ids:
+                self._by_file.setdefault(file_id, set()).add(key)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                self.evictions += 1
+                # Записи на диске остаются привязанными к файлам для invalidate_file
+                evicted.append((old_key, old_data))
+        for old_key, old_data in evicted:
+            self._disk_put(old_key, old_data)
+
+    def _untag(self, key: str):
+        for file_id in self._tags.pop(key, ()):
+            keys = self._by_file.get(file_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_file[file_id]
+
+    # --- Диск ---------------------------------------------------------------
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as entry:
+                data = entry.read()
+            # Время изменения - порядок вытеснения с диска
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _disk_put(self, key: str, data: bytes):
+        if self.disk_dir is None:
+            with self._lock:
+                self._untag(key)
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as entry:
+                entry.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error spilling cached result to disk: {str(e)}")
+            return
+        with self._lock:
+            self._spilled += 1
+            trim = self._spilled % DISK_TRIM_EVERY == 0
+        if trim:
+            self._disk_trim()
+
+    def _disk_remove(self, key: str):
+        if self.disk_dir is None:
+            return
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _disk_trim(self):
+        """Удаляет самые давние записи, пока дисковый уровень больше лимита"""
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.disk_dir, "??", "*.json")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+result_cache = ResultCache(
+    settings.RESULT_CACHE_MAX_BYTES,
+    settings.RESULT_CACHE_MAX_ENTRY_BYTES,
+    settings.RESULT_CACHE_DIR or os.path.join(settings.UPLOAD_DIR, "cache"),
+    settings.RESULT_CACHE_DISK_MAX_BYTES,
+)
+
+def file_version(file) -> FileVersion:
+    """Версия файла для ключа кеша: хеш содержимого (для старых файлов - время изменения)"""
+    if file.content_hash:
+        return file.id, file.content_hash
+    try:
+        return file.id, f"{file.path}:{os.path.getmtime(file.path)}"
+    except (OSError, TypeError):
+        return file.id, None
@@ -0,0 +1,391 @@
+"""Возобновляемая загрузка больших CSV файлов фрагментами (по мотивам протокола tus)
+
+Клиент создает сессию с итоговым размером файла, затем отправляет фрагменты
+с указанием смещения - в любом порядке и параллельно. Фрагменты пишутся
+сразу на свое место в файл сессии (os.pwrite), после записи фрагмента
+создается файл-отметка с его диапазоном, поэтому прогресс переживает
+перезапуск сервера и виден всем воркерам.
+
+Уже полученные байты не перезаписываются: перед записью фрагмент
+резервирует свой диапазон (файл-отметка .pending под flock), и фрагмент,
+пересекающийся с полученным или записываемым диапазоном, отклоняется.
+Иначе хеш, посчитанный по началу файла, перестал бы соответствовать его
+итоговому содержимому, а блоб с чужим содержимым получили бы все
+пользователи с тем же хешем.
+
+Хеш SHA-256 и разбор CSV (заголовки, число строк) считаются инкрементально
+по непрерывному началу файла по мере поступления фрагментов, так что
+завершение загрузки не требует повторного чтения всего файла. Это состояние
+живет в памяти воркера; если завершение попало в другой воркер, он досчитывает
+хеш с начала файла.
+"""
+import csv
+import hashlib
+import io
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import anyio
+from server.config.settings import settings
+from server.storage.blocks import scan_records
+from server.services.source_formats import SourceFormat, detect_format
+
+try:
+    import fcntl
+except ImportError:
+    # Без flock (Windows) резерв брошенного фрагмента снимается только вместе с сессией
+    fcntl = None
+
+# Размер буфера при записи фрагмента и при чтении для хеширования
+BUFFER_SIZE = 1024 * 1024
+
+# Суффикс отметки диапазона, который сейчас записывается
+PENDING_SUFFIX = ".pending"
+
+class UploadError(ValueError):
+    """Некорректный фрагмент или незавершенная загрузка"""
+
+class UploadConflict(UploadError):
+    """Фрагмент пересекается с уже полученным или записываемым диапазоном"""
+
+def sessions_dir() -> str:
+    # Каталог на том же разделе, что и блобы: готовый файл переименовывается без копирования
+    return os.path.join(settings.UPLOAD_DIR, "sessions")
+
+def _session_dir(session_id: str) -> str:
+    return os.path.join(sessions_dir(), session_id)
+
+def data_path(session_id: str) -> str:
+    return os.path.join(_session_dir(session_id), "data.part")
+
+def _ranges_dir(session_id: str) -> str:
+    return os.path.join(_session_dir(session_id), "ranges")
+
+def _lock_path(session_id: str) -> str:
+    return os.path.join(_session_dir(session_id), "ranges.lock")
+
+def create_session_files(session_id: str, total_size: int):
+    """Создает файл сессии итогового размера (разреженный, место выделяется по мере записи)"""
+    os.makedirs(_ranges_dir(session_id), exist_ok=True)
+    with open(data_path(session_id), "wb") as data_file:
+        data_file.truncate(total_size)
+
+def session_exists(session_id: str) -> bool:
+    return os.path.exists(data_path(session_id))
+
+def _parse_marker(name: str) -> Optional[Tuple[int, int]]:
+    start, _, end = name.partition("-")
+    if start.isdigit() and end.isdigit():
+        return int(start), int(end)
+    return None
+
+def _marker_ranges(session_id: str) -> List[Tuple[int, int]]:
+    """Диапазоны полученных фрагментов [начало, конец) без объединения"""
+    try:
+        names = os.listdir(_ranges_dir(session_id))
+    except FileNotFoundError:
+        return []
+    return sorted(bounds for bounds in map(_parse_marker, names) if bounds is not None)
+
+def received_ranges(session_id: str) -> List[Tuple[int, int]]:
+    """Полученные диапазоны [начало, конец) после объединения соседних"""
+    ranges = _marker_ranges(session_id)
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def contiguous_offset(ranges: List[Tuple[int, int]]) -> int:
+    """Длина непрерывно полученного начала файла"""
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+    return 0
+
+def received_bytes(ranges: List[Tuple[int, int]]) -> int:
+    return sum(end - start for start, end in ranges)
+
+_reserve_lock = threading.Lock()
+
+def _is_abandoned(path: str) -> bool:
+    """Резерв брошен: записывавший фрагмент процесс завершился, не удалив отметку"""
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
+
+def reserve_range(session_id: str, start: int, end: int) -> Tuple[str, int]:
+    """Резервирует диапазон [start, end) для записи фрагмента
+
+    Возвращает путь и дескриптор отметки .pending (под flock, пока фрагмент
+    записывается). UploadConflict - диапазон пересекается с полученным или
+    записываемым фрагментом.
+    """
+    scan = _scans.get(session_id)
+    if scan is not None and start < scan.position:
+        raise UploadConflict("Chunk overlaps bytes that have already been received")
+
+    lock_fd = os.open(_lock_path(session_id), os.O_RDWR | os.O_CREAT)
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        with _reserve_lock:
+            ranges_dir = _ranges_dir(session_id)
+            for name in os.listdir(ranges_dir):
+                pending = name.endswith(PENDING_SUFFIX)
+                bounds = _parse_marker(name[:-len(PENDING_SUFFIX)] if pending else name)
+                if bounds is None or bounds[0] >= end or start >= bounds[1]:
+                    continue
+                path = os.path.join(ranges_dir, name)
+                if pending and _is_abandoned(path):
+                    os.remove(path)
+                    continue
+                raise UploadConflict(
+                    f"Chunk overlaps {'a chunk being written' if pending else 'received'} range {bounds[0]}-{bounds[1]}"
+                )
+
+            path = os.path.join(ranges_dir, f"{start:020d}-{end:020d}{PENDING_SUFFIX}")
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            return path, fd
+    finally:
+        os.close(lock_fd)
+
+async def write_chunk(session_id: str, offset: int, total_size: int, stream, length: Optional[int] = None) -> int:
+    """Пишет тело запроса в файл сессии начиная с offset; возвращает длину фрагмента
+
+    length - Content-Length фрагмента; без него резервируется наибольший
+    допустимый фрагмент (UPLOAD_CHUNK_MAX_SIZE, но не дальше конца файла).
+    Отметка о фрагменте создается только после полной записи и fsync, поэтому
+    оборванный фрагмент не учитывается и просто отправляется заново.
+    """
+    if offset < 0 or offset > total_size:
+        raise UploadError("Upload-Offset is out of range")
+    if length is None:
+        end = min(total_size, offset + settings.UPLOAD_CHUNK_MAX_SIZE)
+    elif offset + length > total_size:
+        raise UploadError("Chunk exceeds the declared upload size")
+    elif length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError("Chunk is too large")
+    else:
+        end = offset + length
+    if end == offset:
+        return 0
+
+    pending_path, pending_fd = await anyio.to_thread.run_sync(reserve_range, session_id, offset, end)
+    try:
+        return await _write_reserved(session_id, offset, end, stream)
+    finally:
+        os.remove(pending_path)
+        os.close(pending_fd)
+
+async def _write_reserved(session_id: str, offset: int, end: int, stream) -> int:
+    fd = os.open(data_path(session_id), os.O_WRONLY)
+    position = offset
+    buffer = bytearray()
+    try:
+        async for data in stream:
+            if position + len(buffer) + len(data) - offset > settings.UPLOAD_CHUNK_MAX_SIZE:
+                raise UploadError("Chunk is too large")
+            if position + len(buffer) + len(data) > end:
+                raise UploadError("Chunk exceeds the declared upload size")
+            buffer += data
+            if len(buffer) >= BUFFER_SIZE:
+                position += await anyio.to_thread.run_sync(_pwrite_all, fd, bytes(buffer), position)
+                buffer.clear()
+        if buffer:
+            position += await anyio.to_thread.run_sync(_pwrite_all, fd, bytes(buffer), position)
+        await anyio.to_thread.run_sync(os.fsync, fd)
+    finally:
+        os.close(fd)
+
+    if position > offset:
+        # Пустой файл-отметка: диапазон записан в его имени
+        marker = os.path.join(_ranges_dir(session_id), f"{offset:020d}-{position:020d}")
+        open(marker, "wb").close()
+    return position - offset
+
+def _pwrite_all(fd: int, data: bytes, position: int) -> int:
+    view = memoryview(data)
+    written = 0
+    while written < len(data):
+        written += os.pwrite(fd, view[written:], position + written)
+    return written
+
+class _IncrementalScan:
+    """Хеш и разбор CSV по непрерывному началу файла"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hash = hashlib.sha256()
+        self.position = 0
+        self.records = 0
+        self.in_quotes = False
+        self.last_byte = b""
+        self.header_bytes = bytearray()
+        self.column_headers: Optional[List[str]] = None
+
+    def advance(self, path: str, end: int):
+        if self.position >= end:
+            return
+        with open(path, "rb") as source:
+            source.seek(self.position)
+            while self.position < end:
+                data = source.read(min(BUFFER_SIZE, end - self.position))
+                if not data:
+                    break
+                self._consume(data)
+
+    def _consume(self, data: bytes):
+        self.hash.update(data)
+        records, boundary, self.in_quotes = scan_records(data, self.in_quotes)
+        if self.column_headers is None:
+            if boundary >= 0:
+                self.header_bytes += data[:boundary]
+                self._parse_header()
+            else:
+                self.header_bytes += data
+        self.records += records
+        self.position += len(data)
+        self.last_byte = data[-1:]
+
+    def _parse_header(self):
+        text = bytes(self.header_bytes).decode("utf-8", errors="replace")
+        self.column_headers = next(csv.reader(io.StringIO(text, newline="")), [])
+        self.header_bytes = bytearray()
+
+    def result(self) -> Tuple[str, dict]:
+        records = self.records
+        # Последняя запись может быть без перевода строки
+        if self.position and self.last_byte != b"\n":
+            records += 1
+            if self.column_headers is None:
+                self._parse_header()
+        return self.hash.hexdigest(), {
+            "column_headers": self.column_headers or [],
+            "row_count": max(0, records - 1),
+        }
+
+_scans: Dict[str, _IncrementalScan] = {}
+_scans_lock = threading.Lock()
+
+def _get_scan(session_id: str) -> _IncrementalScan:
+    with _scans_lock:
+        scan = _scans.get(session_id)
+        if scan is None:
+            scan = _scans[session_id] = _IncrementalScan()
+        return scan
+
+def advance_scan(session_id: str):
+    """Досчитывает хеш по непрерывно полученному началу файла, если этим уже не занят другой запрос"""
+    scan = _get_scan(session_id)
+    if not scan.lock.acquire(blocking=False):
+        return
+    try:
+        scan.advance(data_path(session_id), contiguous_offset(received_ranges(session_id)))
+    finally:
+        scan.lock.release()
+
+def _ranges_disjoint(session_id: str) -> bool:
+    """Фрагменты не пересекаются: посчитанное начало файла не перезаписывалось"""
+    ranges = _marker_ranges(session_id)
+    return all(previous[1] <= current[0] for previous, current in zip(ranges, ranges[1:]))
+
+def finish_scan(session_id: str, total_size: int) -> Tuple[str, dict]:
+    """Хеш содержимого и метаданные CSV полностью полученного файла
+
+    Если нельзя доказать, что посчитанное начало не менялось (фрагменты
+    пересекаются), хеш считается заново по итоговым байтам файла.
+    """
+    scan = _get_scan(session_id)
+    with scan.lock:
+        if scan.position and not _ranges_disjoint(session_id):
+            scan.reset()
+        scan.advance(data_path(session_id), total_size)
+        return scan.result()
+
+def detect_session_format(session_id: str, filename: str) -> SourceFormat:
+    """Формат полученного файла (по расширению и началу содержимого)"""
+    with open(data_path(session_id), "rb") as source:
+        return detect_format(source, filename)
+
+def _claimed_path(session_id: str) -> str:
+    return os.path.join(_session_dir(session_id), "data.claimed")
+
+def claim_data(session_id: str) -> str:
+    """Забирает файл сессии для перекодирования; FileNotFoundError - его уже забрал другой запрос"""
+    os.rename(data_path(session_id), _claimed_path(session_id))
+    return _claimed_path(session_id)
+
+def unclaim_data(session_id: str):
+    """Возвращает забранный файл, если перекодировать его не удалось"""
+    try:
+        os.rename(_claimed_path(session_id), data_path(session_id))
+    except FileNotFoundError:
+        pass
+
+def discard_session_files(session_id: str):
+    with _scans_lock:
+        _scans.pop(session_id, None)
+    shutil.rmtree(_session_dir(session_id), ignore_errors=True)
+
+def last_activity(session_id: str) -> Optional[float]:
+    """Время последнего полученного фрагмента (или создания сессии)"""
+    try:
+        return max(os.path.getmtime(data_path(session_id)), os.path.getmtime(_ranges_dir(session_id)))
+    except FileNotFoundError:
+        return None
+
+def is_expired(session_id: str, now: Optional[float] = None) -> bool:
+    """Сессия без активности дольше UPLOAD_SESSION_TTL (или без файлов)"""
+    activity = last_activity(session_id)
+    return activity is None or (now or time.time()) - activity > settings.UPLOAD_SESSION_TTL
+
+def collect_expired_sessions(db) -> int:
+    """Удаляет сессии без активности дольше UPLOAD_SESSION_TTL и брошенные каталоги сессий"""
+    from server.models import models
+
+    removed = 0
+    now = time.time()
+    known = set()
+    for upload_session in db.query(models.UploadSession).all():
+        known.add(upload_session.id)
+        if is_expired(upload_session.id, now):
+            db.delete(upload_session)
+            db.commit()
+            discard_session_files(upload_session.id)
+            removed += 1
+
+    # Каталоги без строки в БД (например, сбой между созданием файлов и commit)
+    try:
+        names = os.listdir(sessions_dir())
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if name in known:
+            continue
+        try:
+            activity = last_activity(name) or os.path.getmtime(_session_dir(name))
+        except FileNotFoundError:
+            continue
+        if now - activity > settings.UPLOAD_SESSION_TTL:
+            discard_session_files(name)
+
+    return removed
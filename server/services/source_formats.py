@@ -0,0 +1,290 @@
+"""Загружаемые файлы в других форматах: XLSX, CSV в других кодировках и с другими разделителями
+
+Хранится всегда канонический вид - CSV в UTF-8 с запятой. Формат файла
+определяется по расширению и первым INGEST_SNIFF_BYTES байтам: кодировка -
+по BOM и проверке UTF-8 (иначе INGEST_FALLBACK_ENCODING), разделитель и
+кавычки - csv.Sniffer. Файл в каноническом виде сохраняется как есть (байт
+в байт), остальные перекодируются за один потоковый проход через
+spreadsheet_ingest.ingest_rows, поэтому расход памяти не зависит от размера.
+
+XLSX читается без загрузки книги целиком: лист разбирается iterparse
+построчно, разобранные строки сразу удаляются из дерева. В памяти остается
+только таблица общих строк (sharedStrings.xml), без которой ячейки не
+расшифровать. Даты (числа со стилем даты) записываются как dd.mm.yyyy.
+"""
+import codecs
+import csv
+import io
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError, iterparse
+from server.config.settings import settings
+from server.storage.blobs import StoredBlob
+from server.services.file_io import store_stream
+from server.services.spreadsheet_ingest import IngestError, ingest_rows
+
+SUPPORTED_EXTENSIONS = (".csv", ".tsv", ".txt", ".xlsx")
+
+# Разделители, которые ищет csv.Sniffer
+SNIFF_DELIMITERS = ",;\t|"
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_RELATIONSHIPS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PACKAGE_RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Встроенные форматы чисел Excel, означающие дату или время
+_BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+# Части пользовательского формата, которые не влияют на тип: "текст", [цвет], \символ
+_FORMAT_LITERALS = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+
+class SourceFormat:
+    """Формат загружаемого файла"""
+
+    def __init__(self, kind: str, encoding: str = "utf-8", delimiter: str = ",", quotechar: str = '"'):
+        self.kind = kind  # csv или xlsx
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+
+    @property
+    def is_canonical(self) -> bool:
+        """Файл можно сохранить без перекодирования"""
+        return self.kind == "csv" and self.encoding == "utf-8" and self.delimiter == "," and self.quotechar == '"'
+
+def is_supported(filename: str) -> bool:
+    return (filename or "").lower().endswith(SUPPORTED_EXTENSIONS)
+
+def canonical_name(filename: str) -> str:
+    """Имя сохраненного файла: расширение заменяется на .csv"""
+    root, extension = os.path.splitext(filename)
+    return filename if extension.lower() == ".csv" else root + ".csv"
+
+def _detect_encoding(sample: bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # Образец может обрываться посреди символа
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return settings.INGEST_FALLBACK_ENCODING
+
+def _detect_dialect(text: str) -> Tuple[str, str]:
+    """Разделитель и символ кавычек по образцу текста"""
+    # Последняя строка образца может быть неполной
+    lines = text.splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters=SNIFF_DELIMITERS)
+    except csv.Error:
+        return ",", '"'
+    return dialect.delimiter, dialect.quotechar or '"'
+
+def detect_format(source, filename: str) -> SourceFormat:
+    """Определяет формат по расширению и образцу; поток возвращается в начало"""
+    if filename.lower().endswith(".xlsx"):
+        return SourceFormat("xlsx")
+
+    sample = source.read(settings.INGEST_SNIFF_BYTES)
+    source.seek(0)
+    encoding = _detect_encoding(sample)
+    if filename.lower().endswith(".tsv"):
+        return SourceFormat("csv", encoding, "\t")
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        raise IngestError(f"File is not valid {encoding} text")
+    delimiter, quotechar = _detect_dialect(text)
+    return SourceFormat("csv", encoding, delimiter, quotechar)
+
+def _iter_csv(source, source_format: SourceFormat) -> Iterator[List[str]]:
+    text = io.TextIOWrapper(source, encoding=source_format.encoding, newline="")
+    try:
+        yield from csv.reader(text, delimiter=source_format.delimiter, quotechar=source_format.quotechar)
+    finally:
+        # Исходный поток закрывает вызывающий код
+        text.detach()
+
+class XlsxReader:
+    """Потоковое чтение первого листа книги XLSX"""
+
+    def __init__(self, source):
+        try:
+            self._archive = zipfile.ZipFile(source)
+            self._date1904, sheet_path = self._first_sheet()
+            self._date_styles = self._load_date_styles()
+            self._shared = self._load_shared_strings()
+        except (zipfile.BadZipFile, KeyError, ParseError) as e:
+            raise IngestError(f"Invalid XLSX file: {str(e)}")
+        self._sheet_path = sheet_path
+
+    def _first_sheet(self) -> Tuple[bool, str]:
+        """Признак системы дат 1904 и путь к первому листу"""
+        date1904, relation_id = False, None
+        with self._archive.open("xl/workbook.xml") as workbook:
+            for _, element in iterparse(workbook):
+                if element.tag == _MAIN + "workbookPr":
+                    date1904 = element.get("date1904") in ("1", "true")
+                elif element.tag == _MAIN + "sheet" and relation_id is None:
+                    relation_id = element.get(_RELATIONSHIPS + "id")
+        with self._archive.open("xl/_rels/workbook.xml.rels") as relations:
+            for _, element in iterparse(relations):
+                if element.tag == _PACKAGE_RELATIONSHIPS + "Relationship" and element.get("Id") == relation_id:
+                    target = element.get("Target")
+                    if target.startswith("/"):
+                        return date1904, target.lstrip("/")
+                    return date1904, posixpath.normpath(posixpath.join("xl", target))
+        raise IngestError("Invalid XLSX file: workbook has no sheets")
+
+    def _load_date_styles(self) -> set:
+        """Номера стилей ячеек (атрибут s), форматирующих число как дату"""
+        try:
+            styles = self._archive.open("xl/styles.xml")
+        except KeyError:
+            return set()
+        custom = {}
+        date_styles = set()
+        with styles:
+            for _, element in iterparse(styles):
+                if element.tag == _MAIN + "numFmt":
+                    code = _FORMAT_LITERALS.sub("", element.get("formatCode", "")).lower()
+                    custom[int(element.get("numFmtId"))] = bool(re.search(r"[dmyhs]", code))
+                elif element.tag == _MAIN + "cellXfs":
+                    for index, xf in enumerate(element.iter(_MAIN + "xf")):
+                        format_id = int(xf.get("numFmtId", "0"))
+                        if format_id in _BUILTIN_DATE_FORMATS or custom.get(format_id):
+                            date_styles.add(str(index))
+        return date_styles
+
+    def _load_shared_strings(self) -> List[str]:
+        try:
+            shared = self._archive.open("xl/sharedStrings.xml")
+        except KeyError:
+            return []
+        strings = []
+        with shared:
+            for _, element in iterparse(shared):
+                if element.tag == _MAIN + "si":
+                    strings.append(_inline_text(element))
+                    element.clear()
+        return strings
+
+    def _date(self, value: str) -> str:
+        serial = float(value)
+        epoch = datetime(1904, 1, 1) if self._date1904 else datetime(1899, 12, 30)
+        moment = epoch + timedelta(days=serial)
+        if serial != int(serial):
+            return moment.strftime("%d.%m.%Y %H:%M:%S")
+        return moment.strftime("%d.%m.%Y")
+
+    def _cell(self, cell) -> str:
+        cell_type = cell.get("t", "n")
+        if cell_type == "inlineStr":
+            inline = cell.find(_MAIN + "is")
+            return _inline_text(inline) if inline is not None else ""
+        value = cell.findtext(_MAIN + "v")
+        if value is None:
+            return ""
+        if cell_type == "s":
+            return self._shared[int(value)]
+        if cell_type == "b":
+            return "TRUE" if value == "1" else "FALSE"
+        if cell_type == "n" and cell.get("s") in self._date_styles:
+            try:
+                return self._date(value)
+            except (ValueError, OverflowError):
+                return value
+        return value
+
+    def rows(self) -> Iterator[List[str]]:
+        """Строки листа; пропущенные ячейки - пустые строки, ширина - не меньше первой строки"""
+        row_tag, cell_tag, sheet_data_tag = _MAIN + "row", _MAIN + "c", _MAIN + "sheetData"
+        columns = {}
+        width = None
+        sheet_data = None
+        try:
+            with self._archive.open(self._sheet_path) as sheet:
+                for event, element in iterparse(sheet, events=("start", "end")):
+                    if event == "start":
+                        if element.tag == sheet_data_tag:
+                            sheet_data = element
+                        continue
+                    if element.tag != row_tag:
+                        continue
+                    row: List[str] = []
+                    for cell in element:
+                        if cell.tag != cell_tag:
+                            continue
+                        reference = cell.get("r")
+                        if reference:
+                            letters = reference.rstrip("0123456789")
+                            index = columns.get(letters)
+                            if index is None:
+                                index = columns[letters] = _column_index(letters)
+                            if index > len(row):
+                                row.extend([""] * (index - len(row)))
+                        row.append(self._cell(cell))
+                    # Разобранные строки удаляются из дерева: память не растет с размером листа
+                    if sheet_data is not None:
+                        sheet_data.clear()
+                    if width is None:
+                        width = len(row)
+                    elif len(row) < width:
+                        row.extend([""] * (width - len(row)))
+                    yield row
+        except ParseError as e:
+            raise IngestError(f"Invalid XLSX file: {str(e)}")
+
+def _inline_text(element) -> str:
+    """Текст строки XLSX (si или is): простой или из фрагментов форматирования, без фонетики"""
+    parts = []
+    for child in element:
+        if child.tag == _MAIN + "t":
+            parts.append(child.text or "")
+        elif child.tag == _MAIN + "r":
+            parts.append(child.findtext(_MAIN + "t") or "")
+    return "".join(parts)
+
+def _column_index(letters: str) -> int:
+    """Номер столбца (с 0) по буквам адреса ячейки ("AB" для "AB12")"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+def _seekable_copy(source):
+    """XLSX читается с произвольным доступом: запись ZIP архива копируется во временный файл"""
+    if not isinstance(source, zipfile.ZipExtFile):
+        return source
+    copy = tempfile.TemporaryFile(dir=settings.UPLOAD_DIR)
+    shutil.copyfileobj(source, copy, 1024 * 1024)
+    copy.seek(0)
+    return copy
+
+async def store_source(source, source_format: SourceFormat) -> Tuple[StoredBlob, Optional[dict]]:
+    """Сохраняет файл в каноническом виде
+
+    Возвращает блоб и, если файл перекодировался, его заголовки и число строк
+    (для канонического файла они считаются обычным образом, meta - None).
+    """
+    if source_format.is_canonical:
+        return await store_stream(source), None
+
+    if source_format.kind == "xlsx":
+        def open_rows():
+            return XlsxReader(_seekable_copy(source)).rows()
+    else:
+        def open_rows():
+            return _iter_csv(source, source_format)
+
+    result = await ingest_rows(open_rows)
+    return result.blob, {"column_headers": result.headers, "row_count": result.row_count}
@@ -0,0 +1,373 @@
+"""Быстрое сохранение данных электронной таблицы без проверки каждой ячейки Pydantic
+
+Тело запроса разбирается вручную и строки сразу пишутся в CSV блоб за один
+проход: пустые строки отбрасываются, количество строк считается по ходу записи,
+размер берется из записанного блоба. Поддерживаемые форматы (Content-Type):
+
+    application/json      {"headers": [...], "data": [[...], ...], "name": "..."}
+                          или по столбцам: {"headers": [...], "columns": [[...], ...]}
+    application/x-ndjson  первая строка - {"headers": [...], "name": "..."},
+                          далее по одной строке таблицы (JSON массив) на строку
+    text/csv              готовый CSV, первая запись - заголовки (имя - параметр name)
+
+NDJSON и CSV читаются из потока по мере поступления и не держат в памяти всё тело.
+Разбор и запись идут в пуле file_io частями (FILE_IO_CHUNK_BYTES байт тела
+или FILE_IO_WRITE_BATCH строк JSON), цикл событий только принимает данные.
+"""
+import csv
+import io
+import json
+import re
+from contextlib import asynccontextmanager
+from itertools import islice, zip_longest
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from server.config.settings import settings
+from server.storage.blobs import BlobWriter, StoredBlob
+from server.storage.blocks import scan_records
+from server.services.file_io import file_io
+
+CONTENT_JSON = "application/json"
+CONTENT_NDJSON = "application/x-ndjson"
+CONTENT_CSV = "text/csv"
+
+class IngestError(ValueError):
+    """Некорректное тело запроса"""
+
+class IngestResult:
+    """Результат сохранения строк таблицы"""
+
+    def __init__(self, blob: StoredBlob, headers: List[str], row_count: int, name: Optional[str]):
+        self.blob = blob
+        self.headers = headers
+        self.row_count = row_count
+        self.name = name
+
+def _is_empty_row(row) -> bool:
+    for cell in row:
+        if cell is not None and cell != '':
+            return False
+    return True
+
+def _check_name(name) -> Optional[str]:
+    return name if isinstance(name, str) and name else None
+
+def _check_headers(headers) -> List[str]:
+    if not isinstance(headers, list):
+        raise IngestError("'headers' must be a list")
+    return [str(header) for header in headers]
+
+class _RowSink:
+    """CSV writer поверх блоба: фильтрует пустые строки и считает записанные
+
+    Все методы, кроме конструктора, вызываются в пуле file_io - по очереди, не параллельно.
+    """
+
+    def __init__(self):
+        self._writer = BlobWriter()
+        self._text = io.TextIOWrapper(self._writer, encoding="utf-8", newline="")
+        self._csv = csv.writer(self._text)
+        self.row_count = 0
+
+    def close(self):
+        self._writer.close()
+
+    def write_headers(self, headers: List[str]):
+        self._csv.writerow(headers)
+
+    def write_row(self, row):
+        if not isinstance(row, list):
+            raise IngestError("Each row must be a list")
+        if _is_empty_row(row):
+            return
+        self._csv.writerow(row)
+        self.row_count += 1
+
+    def write_batch(self, rows: Iterator, limit: int) -> bool:
+        """Пишет не больше limit строк из итератора; False - строки закончились"""
+        written = 0
+        for row in islice(rows, limit):
+            self.write_row(row)
+            written += 1
+        return written == limit
+
+    def commit(self) -> StoredBlob:
+        self._text.flush()
+        self._text.detach()
+        return self._writer.commit()
+
+@asynccontextmanager
+async def _open_sink():
+    sink = await file_io.run(_RowSink)
+    try:
+        yield sink
+    finally:
+        await file_io.run(sink.close)
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+def _skip_whitespace(text: str, position: int) -> int:
+    return _WHITESPACE.match(text, position).end()
+
+def _decode_array(text: str, position: int) -> Tuple[list, int]:
+    """Массив, разбираемый поэлементно: json.loads всего тела держал бы GIL до конца разбора"""
+    items = []
+    position = _skip_whitespace(text, position + 1)
+    if text.startswith("]", position):
+        return items, position + 1
+    while True:
+        item, position = _decoder.raw_decode(text, position)
+        items.append(item)
+        position = _skip_whitespace(text, position)
+        if text.startswith(",", position):
+            position = _skip_whitespace(text, position + 1)
+        elif text.startswith("]", position):
+            return items, position + 1
+        else:
+            raise ValueError(f"Expecting ',' delimiter: char {position}")
+
+class _JsonBody:
+    """JSON тело, разбираемое по частям в пуле file_io
+
+    Если заголовки идут раньше массива data (так отправляет клиент), строки
+    декодируются по одной во время записи и не накапливаются в памяти: миллионы
+    списков вызывали бы долгие сборки мусора, которые держат GIL и
+    останавливают цикл событий. Иначе тело разбирается целиком.
+    """
+
+    def __init__(self, body: bytes):
+        try:
+            self.text = body.decode(json.detect_encoding(body), "surrogatepass")
+        except ValueError as e:
+            raise IngestError(f"Invalid JSON: {str(e)}")
+        self.payload: Any = {}
+        self.position = _skip_whitespace(self.text, 0)
+        # first - после "{", member - после ",", value - после значения, end - объект закончился
+        self._state = "first"
+        if not self.text.startswith("{", self.position):
+            self.payload, position = self._wrap(_decoder.raw_decode, self.text, self.position)
+            self._wrap(self._end, position)
+        else:
+            self.position += 1
+
+    @staticmethod
+    def _wrap(func, *args):
+        try:
+            return func(*args)
+        except IngestError:
+            raise
+        except ValueError as e:
+            raise IngestError(f"Invalid JSON: {str(e)}")
+
+    def parse(self) -> bool:
+        """Разбирает объект до строк data (True) или до конца (False)"""
+        return self._wrap(self._members)
+
+    def rows(self) -> Iterator:
+        """Строки data по одной; после конца массива разбирается остаток объекта"""
+        text = self.text
+        position = self._wrap(_skip_whitespace, text, self.position)
+        if text.startswith("]", position):
+            self.position = position + 1
+        else:
+            while True:
+                row, self.position = self._wrap(_decoder.raw_decode, text, position)
+                yield row
+                position = _skip_whitespace(text, self.position)
+                if text.startswith(",", position):
+                    position = _skip_whitespace(text, position + 1)
+                elif text.startswith("]", position):
+                    self.position = position + 1
+                    break
+                else:
+                    raise IngestError(f"Invalid JSON: Expecting ',' delimiter: char {position}")
+        if self.parse():
+            raise IngestError("Duplicate 'data' key")
+
+    def _end(self, position: int):
+        if _skip_whitespace(self.text, position) != len(self.text):
+            raise ValueError(f"Extra data: char {position}")
+        self._state = "end"
+        self.position = position
+
+    def _members(self) -> bool:
+        text = self.text
+        while self._state != "end":
+            position = _skip_whitespace(text, self.position)
+            if self._state == "value":
+                if text.startswith(",", position):
+                    self._state = "member"
+                    self.position = position + 1
+                elif text.startswith("}", position):
+                    self._end(position + 1)
+                else:
+                    raise ValueError(f"Expecting ',' delimiter: char {position}")
+                continue
+            if self._state == "first" and text.startswith("}", position):
+                self._end(position + 1)
+                continue
+
+            key, position = _decoder.raw_decode(text, position)
+            if not isinstance(key, str):
+                raise ValueError(f"Expecting property name: char {position}")
+            position = _skip_whitespace(text, position)
+            if not text.startswith(":", position):
+                raise ValueError(f"Expecting ':' delimiter: char {position}")
+            position = _skip_whitespace(text, position + 1)
+            self._state = "value"
+
+            if (key == "data" and "headers" in self.payload and "columns" not in self.payload
+                    and text.startswith("[", position)):
+                self.position = position + 1
+                return True
+            if key in ("data", "columns") and text.startswith("[", position):
+                self.payload[key], self.position = _decode_array(text, position)
+            else:
+                self.payload[key], self.position = _decoder.raw_decode(text, position)
+        return False
+
+async def ingest_json(body: bytes) -> IngestResult:
+    """JSON объект с построчными (data) или столбцовыми (columns) данными"""
+    parsed = await file_io.run(_JsonBody, body)
+    streaming = await file_io.run(parsed.parse)
+    payload = parsed.payload
+    if not isinstance(payload, dict):
+        raise IngestError("Request body must be a JSON object")
+
+    headers = _check_headers(payload.get("headers"))
+    if streaming:
+        rows = parsed.rows()
+    elif "columns" in payload:
+        columns = payload["columns"]
+        if not isinstance(columns, list) or not all(isinstance(column, list) for column in columns):
+            raise IngestError("'columns' must be a list of lists")
+        rows = (list(row) for row in zip_longest(*columns))
+    else:
+        rows = payload.get("data")
+        if not isinstance(rows, list):
+            raise IngestError("'data' must be a list of rows")
+        rows = iter(rows)
+
+    async with _open_sink() as sink:
+        await file_io.run(sink.write_headers, headers)
+        # Строки пишутся частями, чтобы большое сохранение не занимало поток пула целиком
+        while await file_io.run(sink.write_batch, rows, settings.FILE_IO_WRITE_BATCH):
+            pass
+        blob = await file_io.run(sink.commit)
+    # Имя может идти после строк, поэтому читается в конце
+    return IngestResult(blob, headers, sink.row_count, _check_name(payload.get("name")))
+
+async def ingest_ndjson(stream) -> IngestResult:
+    """NDJSON: строка с заголовками, затем строки таблицы"""
+    headers = None
+    name = None
+    buffer = bytearray()
+
+    async with _open_sink() as sink:
+        def handle_lines(data: bytes):
+            nonlocal headers, name
+            for line in data.split(b"\n"):
+                if not line.strip():
+                    continue
+                try:
+                    value = json.loads(line)
+                except ValueError as e:
+                    raise IngestError(f"Invalid JSON line: {str(e)}")
+                if headers is None:
+                    if not isinstance(value, dict):
+                        raise IngestError("First line must be an object with 'headers'")
+                    headers = _check_headers(value.get("headers"))
+                    name = _check_name(value.get("name"))
+                    sink.write_headers(headers)
+                else:
+                    sink.write_row(value)
+
+        async for data in stream:
+            buffer += data
+            if len(buffer) < settings.FILE_IO_CHUNK_BYTES:
+                continue
+            # Полные строки накопленной части разбираются и пишутся в пуле
+            end = buffer.rfind(b"\n") + 1
+            if end > 0:
+                await file_io.run(handle_lines, bytes(buffer[:end]))
+                del buffer[:end]
+        await file_io.run(handle_lines, bytes(buffer))
+
+        if headers is None:
+            raise IngestError("Request body is empty")
+        blob = await file_io.run(sink.commit)
+    return IngestResult(blob, headers, sink.row_count, name)
+
+async def ingest_csv(stream, name: Optional[str] = None) -> IngestResult:
+    """CSV (UTF-8): разбирается по полным записям, граница которых ищется вне кавычек"""
+    headers = None
+    buffer = bytearray()
+
+    async with _open_sink() as sink:
+        def handle_records(data: bytes):
+            nonlocal headers
+            # Перевод строки - целый символ UTF-8, поэтому граница записи всегда на границе символа
+            for row in csv.reader(io.StringIO(data.decode("utf-8-sig" if headers is None else "utf-8"), newline="")):
+                if headers is None:
+                    headers = row
+                    sink.write_headers(headers)
+                else:
+                    sink.write_row(row)
+
+        def handle_buffer() -> int:
+            """Разбирает завершенные записи буфера и возвращает их длину"""
+            data = bytes(buffer)
+            _, boundary, _ = scan_records(data)
+            if boundary > 0:
+                handle_records(data[:boundary])
+            return boundary
+
+        try:
+            async for data in stream:
+                buffer += data
+                if len(buffer) < settings.FILE_IO_CHUNK_BYTES:
+                    continue
+                # Пока пул разбирает буфер, новые данные в него не добавляются
+                boundary = await file_io.run(handle_buffer)
+                if boundary > 0:
+                    del buffer[:boundary]
+            if buffer:
+                await file_io.run(handle_records, bytes(buffer))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise IngestError(f"Invalid CSV: {str(e)}")
+
+        if headers is None:
+            raise IngestError("Request body is empty")
+        blob = await file_io.run(sink.commit)
+    return IngestResult(blob, headers, sink.row_count, name)
+
+async def ingest_rows(open_rows: Callable[[], Iterator[List]], name: Optional[str] = None) -> IngestResult:
+    """Строки из итератора (перекодируемый CSV, лист XLSX); первая строка - заголовки
+
+    open_rows и чтение строк выполняются в пуле file_io, по FILE_IO_WRITE_BATCH строк за вызов.
+    """
+    async with _open_sink() as sink:
+        try:
+            rows = await file_io.run(open_rows)
+            headers = await file_io.run(next, rows, None)
+            if headers is None:
+                raise IngestError("File is empty")
+            headers = [str(header) for header in headers]
+            await file_io.run(sink.write_headers, headers)
+            while await file_io.run(sink.write_batch, rows, settings.FILE_IO_WRITE_BATCH):
+                pass
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise IngestError(f"Invalid CSV: {str(e)}")
+        blob = await file_io.run(sink.commit)
+    return IngestResult(blob, headers, sink.row_count, name)
+
+async def ingest_request(request) -> IngestResult:
+    """Выбирает формат по Content-Type запроса"""
+    content_type = request.headers.get("content-type", CONTENT_JSON).split(";")[0].strip().lower()
+    if content_type == CONTENT_NDJSON:
+        return await ingest_ndjson(request.stream())
+    if content_type == CONTENT_CSV:
+        return await ingest_csv(request.stream(), _check_name(request.query_params.get("name")))
+    if content_type in (CONTENT_JSON, ""):
+        return await ingest_json(await request.body())
+    raise IngestError(f"Unsupported content type: {content_type}")
@@ -0,0 +1,262 @@
+"""SQL запросы к CSV файлам пользователя во встроенной SQLite
+
+Каждый файл загружается в отдельную базу SQLite в памяти (таблица data) при
+первом обращении. Загруженные таблицы хранятся в LRU кеше воркера с ключом
+по версии файла (хеш содержимого), поэтому после изменения файла старая
+версия просто вытесняется. Базы в памяти открыты в режиме shared cache и
+подключаются к соединению запроса через ATTACH, под именами таблиц из запроса
+создаются временные представления.
+
+Запрос выполняется только на чтение (authorizer разрешает лишь SELECT
+и чтение таблиц), время ограничено через progress handler, а память -
+размером кеша страниц соединения, временными данными на диске и
+ограничением числа строк результата.
+"""
+import itertools
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from server.config.settings import settings
+from server.services.csv_rows import iter_csv_rows
+
+# Числа без ведущих нулей загружаются как числа ("01" остается строкой)
+_INTEGER = re.compile(r"^-?(0|[1-9]\d{0,17})$")
+_FLOAT = re.compile(r"^-?(0|[1-9]\d*)\.\d+$")
+
+# Ссылка на файл в тексте запроса: file_<id>
+FILE_TABLE = re.compile(r"\bfile_(\d+)\b", re.IGNORECASE)
+
+_TABLE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,63}$")
+
+# Строк в одной пачке при загрузке файла
+LOAD_BATCH_SIZE = 5000
+
+# Действия, разрешенные пользовательскому запросу
+_ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+class QueryError(ValueError):
+    """Некорректный запрос или превышены ограничения"""
+
+def _convert(value: str):
+    if _INTEGER.match(value):
+        return int(value)
+    if _FLOAT.match(value):
+        return float(value)
+    return value
+
+def _column_names(headers: List[str]) -> List[str]:
+    names = []
+    for index, header in enumerate(headers):
+        name = header.strip() or f"column_{index + 1}"
+        while name.lower() in (existing.lower() for existing in names):
+            name = f"{name}_{index + 1}"
+        names.append(name)
+    return names
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+class _LoadedTable:
+    """База SQLite в памяти с содержимым одного файла"""
+
+    def __init__(self, key: str, path: str, headers: List[str]):
+        self.uri = f"file:csvq_{uuid.uuid4().hex}?mode=memory&cache=shared"
+        # Соединение-владелец: база существует, пока оно открыто
+        self._keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        self.key = key
+        self.columns = _column_names(headers)
+        self.size = 0
+        # Число запросов, использующих таблицу; вытесненная таблица закрывается после последнего
+        self.users = 0
+        self.evicted = False
+        try:
+            self._load(path)
+        except BaseException:
+            self._keeper.close()
+            raise
+
+    def _load(self, path: str):
+        width = len(self.columns)
+        columns_sql = ", ".join(_quote(name) for name in self.columns) or '"column_1"'
+        placeholders = ", ".join("?" for _ in range(max(width, 1)))
+        self._keeper.execute(f"CREATE TABLE data ({columns_sql})")
+
+        rows = iter_csv_rows(path)
+        while True:
+            batch = []
+            for row in itertools.islice(rows, LOAD_BATCH_SIZE):
+                row = row[:width] + [""] * (width - len(row))
+                batch.append([_convert(value) for value in row] or [None])
+            if not batch:
+                break
+            self._keeper.executemany(f"INSERT INTO data VALUES ({placeholders})", batch)
+        self._keeper.commit()
+
+        page_count = self._keeper.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._keeper.execute("PRAGMA page_size").fetchone()[0]
+        self.size = page_count * page_size
+
+    def close(self):
+        self._keeper.close()
+
+class TableCache:
+    """LRU кеш загруженных таблиц с ограничением суммарного размера"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._tables: "OrderedDict[str, _LoadedTable]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Загрузка одного и того же файла выполняется один раз (остальные ждут ее)
+        self._loading: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, key: str, path: str, headers: List[str]) -> _LoadedTable:
+        """Возвращает таблицу (загружая ее при необходимости); после запроса вызвать release"""
+        with self._lock:
+            table = self._take(key)
+            if table is not None:
+                return table
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                table = self._take(key)
+                if table is not None:
+                    return table
+            try:
+                table = _LoadedTable(key, path, headers)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                self.misses += 1
+                table.users += 1
+                self._tables[key] = table
+                self._loading.pop(key, None)
+                self._evict()
+            return table
+
+    def release(self, table: _LoadedTable):
+        with self._lock:
+            table.users -= 1
+            if table.evicted and table.users == 0:
+                table.close()
+
+    def _take(self, key: str) -> Optional[_LoadedTable]:
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+            table.users += 1
+        return table
+
+    def _evict(self):
+        total = sum(table.size for table in self._tables.values())
+        # Последняя загруженная таблица остается, даже если она больше всего кеша
+        while total > self.max_bytes and len(self._tables) > 1:
+            _, table = self._tables.popitem(last=False)
+            total -= table.size
+            table.evicted = True
+            if table.users == 0:
+                table.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables": len(self._tables),
+                "bytes": sum(table.size for table in self._tables.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+table_cache = TableCache(settings.QUERY_CACHE_MAX_BYTES)
+
+_local = threading.local()
+
+def _query_connection() -> sqlite3.Connection:
+    """Соединение для запросов, свое у каждого потока (кеш подготовленных запросов живет в нем)"""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(
+            ":memory:", uri=True, check_same_thread=False,
+            cached_statements=settings.QUERY_STATEMENT_CACHE
+        )
+        connection.execute(f"PRAGMA cache_size = -{max(1, settings.QUERY_MEMORY_LIMIT // 1024)}")
+        # Сортировки и группировки не помещающиеся в кеш страниц уходят во временные файлы
+        connection.execute("PRAGMA temp_store = FILE")
+        _local.connection = connection
+    return connection
+
+def referenced_file_ids(sql: str) -> List[int]:
+    return sorted({int(match) for match in FILE_TABLE.findall(sql)})
+
+def validate_table_name(name: str):
+    if not _TABLE_NAME.match(name):
+        raise QueryError(f"Invalid table name: {name}")
+
+def run_query(sql: str, tables: Dict[str, _LoadedTable], max_rows: Optional[int] = None) -> dict:
+    """Выполняет запрос; tables - имя таблицы в запросе -> загруженная таблица"""
+    max_rows = min(max_rows or settings.QUERY_MAX_ROWS, settings.QUERY_MAX_ROWS)
+    connection = _query_connection()
+    attached = []
+    views = []
+    try:
+        # Одинаковое содержимое под разными именами подключается один раз
+        schemas = {}
+        for name, table in tables.items():
+            schema = schemas.get(table.uri)
+            if schema is None:
+                schema = schemas[table.uri] = f"src_{len(schemas)}"
+                connection.execute(f"ATTACH DATABASE ? AS {schema}", (table.uri,))
+                attached.append(schema)
+            connection.execute(f"CREATE TEMP VIEW {_quote(name)} AS SELECT * FROM {schema}.data")
+            views.append(name)
+
+        deadline = time.monotonic() + settings.QUERY_TIMEOUT
+
+        def check_deadline():
+            # Ненулевой результат прерывает выполнение запроса
+            return 1 if time.monotonic() > deadline else 0
+
+        def authorize(action, *args):
+            return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+        started = time.monotonic()
+        connection.set_progress_handler(check_deadline, 10000)
+        connection.set_authorizer(authorize)
+        try:
+            cursor = connection.execute(sql)
+            rows = cursor.fetchmany(max_rows + 1)
+            columns = [description[0] for description in cursor.description or []]
+            cursor.close()
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                raise QueryError(f"Query exceeded the time limit of {settings.QUERY_TIMEOUT} seconds")
+            raise QueryError(str(e))
+        except (sqlite3.DatabaseError, sqlite3.Warning, sqlite3.ProgrammingError) as e:
+            raise QueryError(str(e))
+        finally:
+            connection.set_authorizer(None)
+            connection.set_progress_handler(None, 0)
+
+        truncated = len(rows) > max_rows
+        rows = rows[:max_rows]
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows],
+            "row_count": len(rows),
+            "truncated": truncated,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+    finally:
+        for name in views:
+            connection.execute(f"DROP VIEW IF EXISTS temp.{_quote(name)}")
+        for schema in attached:
+            connection.execute(f"DETACH DATABASE {schema}")
@@ -0,0 +1,265 @@
+"""Временные ряды по CSV файлам: группировка по периодам и прореживание LTTB
+
+Столбец дат разбирается один раз (форматы dd.mm.yyyy и ISO 8601, с временем
+или без) в массив секунд от эпохи, числовой столбец - в массив float.
+Массивы сохраняются рядом с блобом как производные данные, поэтому повторные
+запросы (другой период, агрегат, число точек) файл уже не читают.
+
+Длинный ряд прореживается до заданного числа точек алгоритмом
+Largest-Triangle-Three-Buckets: из каждой корзины берется точка, образующая
+наибольший треугольник с соседними, так что пики и провалы сохраняются.
+Даты без часового пояса считаются UTC.
+"""
+import math
+import re
+from array import array
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from server.storage import blobs
+from server.services.csv_rows import iter_csv_rows
+
+BUCKETS = {"none", "day", "week", "month"}
+AGGREGATES = {"count", "sum", "avg", "min", "max"}
+
+# Отсутствующая или нераспознанная дата в массиве секунд
+MISSING_DATE = -(2 ** 63)
+
+SECONDS_PER_DAY = 86400
+
+# Порядковый номер 01.01.1970 (date.toordinal)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_DOTTED = re.compile(r"^(\d{1,2})\.(\d{1,2})\.(\d{4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$")
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+
+class TimeSeriesError(ValueError):
+    """Некорректные параметры временного ряда"""
+
+def parse_date(value: str) -> Optional[int]:
+    """Секунды от эпохи для dd.mm.yyyy[ HH:MM[:SS]] или ISO 8601; None, если не дата"""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        match = _DOTTED.match(value)
+        if match:
+            day, month, year, hour, minute, second = match.groups()
+            days = date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL
+            return days * SECONDS_PER_DAY + int(hour or 0) * 3600 + int(minute or 0) * 60 + int(second or 0)
+        match = _ISO_DATE.match(value)
+        if match:
+            year, month, day = match.groups()
+            return (date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL) * SECONDS_PER_DAY
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def _parse_number(value: str) -> float:
+    try:
+        return float(value.replace(",", ".").replace(" ", "").replace("\xa0", ""))
+    except ValueError:
+        return math.nan
+
+def _artifact_name(column_index: int, kind: str) -> str:
+    return f"col{column_index}.{kind}.bin"
+
+def _load_array(content_hash: Optional[str], column_index: int, kind: str, typecode: str) -> Optional[array]:
+    if not content_hash:
+        return None
+    data = blobs.load_binary_artifact(content_hash, _artifact_name(column_index, kind))
+    if data is None or len(data) % array(typecode).itemsize:
+        return None
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+def column_arrays(path: str, content_hash: Optional[str], date_index: int,
+                  value_index: Optional[int]) -> Tuple[array, Optional[array]]:
+    """Массив дат (секунды, MISSING_DATE для пустых) и массив значений (nan для нечисловых)
+
+    Недостающие массивы считаются за один проход по файлу и кешируются
+    как производные данные блоба (для файлов без хеша - не кешируются).
+    """
+    dates = _load_array(content_hash, date_index, "dates", "q")
+    values = _load_array(content_hash, value_index, "numbers", "d") if value_index is not None else None
+    need_dates = dates is None
+    need_values = value_index is not None and values is None
+    if not need_dates and not need_values:
+        return dates, values
+
+    new_dates = array("q")
+    new_values = array("d")
+    # Даты в файлах сильно повторяются: разбираем каждую строку один раз
+    parsed: Dict[str, int] = {}
+    for row in iter_csv_rows(path):
+        if need_dates:
+            text = row[date_index] if date_index < len(row) else ""
+            seconds = parsed.get(text)
+            if seconds is None:
+                seconds = parse_date(text)
+                seconds = parsed[text] = MISSING_DATE if seconds is None else seconds
+                if len(parsed) > 1000000:
+                    parsed.clear()
+            new_dates.append(seconds)
+        if need_values:
+            new_values.append(_parse_number(row[value_index]) if value_index < len(row) else math.nan)
+
+    if need_dates:
+        dates = new_dates
+        if content_hash:
+            blobs.save_binary_artifact(content_hash, dates.tobytes(), _artifact_name(date_index, "dates"))
+    if need_values:
+        values = new_values
+        if content_hash:
+            blobs.save_binary_artifact(content_hash, values.tobytes(), _artifact_name(value_index, "numbers"))
+    return dates, values
+
+# --- Группировка по периодам ----------------------------------------------
+
+def _bucket_start(seconds: int, bucket: str, months: Dict[int, int]) -> int:
+    days = seconds // SECONDS_PER_DAY
+    if bucket == "day":
+        return days * SECONDS_PER_DAY
+    if bucket == "week":
+        # 01.01.1970 - четверг; неделя начинается с понедельника
+        return (days - (days + 3) % 7) * SECONDS_PER_DAY
+    start = months.get(days)
+    if start is None:
+        day = date.fromordinal(days + _EPOCH_ORDINAL)
+        start = months[days] = (date(day.year, day.month, 1).toordinal() - _EPOCH_ORDINAL) * SECONDS_PER_DAY
+    return start
+
+def bucket_series(dates: array, values: Optional[array], bucket: str, aggregate: str) -> Tuple[List[int], List[float]]:
+    """Точки ряда (время, значение), упорядоченные по времени
+
+    bucket="none" - исходные точки без группировки (нужен столбец значений).
+    """
+    if bucket not in BUCKETS:
+        raise TimeSeriesError(f"Unsupported bucket: {bucket}")
+    if aggregate not in AGGREGATES:
+        raise TimeSeriesError(f"Unsupported aggregate: {aggregate}")
+    if values is None and (bucket == "none" or aggregate != "count"):
+        raise TimeSeriesError("value_column is required for this aggregate")
+
+    if bucket == "none":
+        points = sorted(
+            (seconds, value) for seconds, value in zip(dates, values)
+            if seconds != MISSING_DATE and value == value
+        )
+        return [seconds for seconds, _ in points], [value for _, value in points]
+
+    months: Dict[int, int] = {}
+    # start -> [количество, сумма, минимум, максимум]
+    groups: Dict[int, List[float]] = {}
+    if aggregate == "count":
+        for seconds in dates:
+            if seconds == MISSING_DATE:
+                continue
+            start = _bucket_start(seconds, bucket, months)
+            groups[start] = groups.get(start, 0) + 1
+        starts = sorted(groups)
+        return starts, [float(groups[start]) for start in starts]
+
+    for seconds, value in zip(dates, values):
+        # value != value - nan (нечисловое значение)
+        if seconds == MISSING_DATE or value != value:
+            continue
+        start = _bucket_start(seconds, bucket, months)
+        group = groups.get(start)
+        if group is None:
+            groups[start] = [1, value, value, value]
+        else:
+            group[0] += 1
+            group[1] += value
+            if value < group[2]:
+                group[2] = value
+            if value > group[3]:
+                group[3] = value
+
+    starts = sorted(groups)
+    if aggregate == "sum":
+        return starts, [groups[start][1] for start in starts]
+    if aggregate == "avg":
+        return starts, [groups[start][1] / groups[start][0] for start in starts]
+    position = 2 if aggregate == "min" else 3
+    return starts, [groups[start][position] for start in starts]
+
+# --- Прореживание ----------------------------------------------------------
+
+def lttb(xs: List[int], ys: List[float], threshold: int) -> Tuple[List[int], List[float]]:
+    """Largest-Triangle-Three-Buckets: не больше threshold точек, первая и последняя сохраняются"""
+    length = len(xs)
+    if threshold >= length or threshold < 3:
+        return xs, ys
+
+    sampled_x = [xs[0]]
+    sampled_y = [ys[0]]
+    every = (length - 2) / (threshold - 2)
+    selected = 0
+    for bucket in range(threshold - 2):
+        # Среднее следующей корзины - третья вершина треугольника
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, length)
+        if next_start >= next_end:
+            next_start, next_end = length - 1, length
+        count = next_end - next_start
+        average_x = sum(xs[next_start:next_end]) / count
+        average_y = sum(ys[next_start:next_end]) / count
+
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        point_x, point_y = xs[selected], ys[selected]
+        best_area = -1.0
+        best = start
+        for index in range(start, end):
+            area = abs(
+                (point_x - average_x) * (ys[index] - point_y)
+                - (point_x - xs[index]) * (average_y - point_y)
+            )
+            if area > best_area:
+                best_area = area
+                best = index
+        sampled_x.append(xs[best])
+        sampled_y.append(ys[best])
+        selected = best
+
+    sampled_x.append(xs[-1])
+    sampled_y.append(ys[-1])
+    return sampled_x, sampled_y
+
+def _label(seconds: int, bucket: str) -> str:
+    moment = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    if bucket == "month":
+        return moment.strftime("%m.%Y")
+    if bucket == "none" and seconds % SECONDS_PER_DAY:
+        return moment.strftime("%d.%m.%Y %H:%M:%S")
+    return moment.strftime("%d.%m.%Y")
+
+def build_timeseries(path: str, content_hash: Optional[str], headers: List[str], date_column: str,
+                     value_column: Optional[str], bucket: str, aggregate: str, points: int) -> dict:
+    """Ряд для графика: [{name, value, time}] не длиннее points"""
+    if date_column not in headers:
+        raise TimeSeriesError(f"Column '{date_column}' not found")
+    if value_column is not None and value_column not in headers:
+        raise TimeSeriesError(f"Column '{value_column}' not found")
+
+    dates, values = column_arrays(
+        path, content_hash, headers.index(date_column),
+        headers.index(value_column) if value_column is not None else None
+    )
+    xs, ys = bucket_series(dates, values, bucket, aggregate)
+    total = len(xs)
+    xs, ys = lttb(xs, ys, points)
+    return {
+        "bucket": bucket,
+        "aggregate": aggregate,
+        "total_points": total,
+        "downsampled": len(xs) < total,
+        "data": [
+            {"name": _label(seconds, bucket), "value": value, "time": seconds}
+            for seconds, value in zip(xs, ys)
+        ],
+    }
@@ -0,0 +1,288 @@
+"""История версий CSV файлов
+
+При обновлении файла прежнее содержимое сохраняется как версия: поток
+режется на фрагменты с границами по содержимому (server/storage/chunks.py),
+в хранилище попадают только фрагменты, которых там еще нет, а строка
+CsvFileVersion хранит список фрагментов. Текущая версия - это сам файл
+(блоб); для сравнения с ней ее список фрагментов вычисляется без записи
+и кешируется рядом с блобом (chunks.json).
+
+Окно строк прежней версии читается с фрагмента, содержащего первую строку
+окна. Сравнение версий сначала сопоставляет списки фрагментов: общие
+фрагменты не читаются, построчно сравниваются только изменившиеся участки.
+
+Хранится не больше VERSION_HISTORY_MAX_VERSIONS версий на файл и не старше
+VERSION_HISTORY_MAX_AGE_DAYS дней; фрагменты, на которые не ссылается ни
+одна версия, удаляет collect_garbage.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import List, Optional
+from server.config.settings import settings
+from server.models import models
+from server.storage import blobs, chunks
+from server.storage.chunks import ChunkIndex, ChunkReader, ChunkStoreWriter, chunk_manifest
+from server.storage.files import open_binary
+from server.storage.generations import GenerationGone, ReadLease
+from server.services.csv_rows import iter_csv_rows
+from server.services.file_io import file_io
+
+class VersionNotFound(Exception):
+    """Версии нет (не сохранялась или удалена по сроку хранения)"""
+
+class VersionSource:
+    """Содержимое одной версии: текущая читается из файла, прежние - из фрагментов"""
+
+    def __init__(self, version: int, headers: List[str], row_count: int, size: int,
+                 manifest: Optional[List[list]] = None, path: Optional[str] = None,
+                 content_hash: Optional[str] = None, created_at: Optional[datetime] = None):
+        self.version = version
+        self.headers = headers
+        self.row_count = row_count
+        self.size = size
+        self._manifest = manifest
+        self.path = path  # только у текущей версии
+        self.content_hash = content_hash
+        self.created_at = created_at
+
+    @classmethod
+    def current(cls, file: models.CsvFile) -> "VersionSource":
+        return cls(file.version, file.column_headers, file.row_count, file.size, path=file.path,
+                   content_hash=file.content_hash, created_at=file.processed_at or file.created_at)
+
+    @classmethod
+    def archived(cls, row: models.CsvFileVersion) -> "VersionSource":
+        return cls(row.version, row.column_headers, row.row_count, row.size, manifest=row.chunks,
+                   content_hash=row.content_hash, created_at=row.created_at)
+
+    @property
+    def is_current(self) -> bool:
+        return self.path is not None
+
+    def manifest(self) -> List[list]:
+        if self._manifest is None:
+            # Текущая версия: список фрагментов вычисляется один раз на содержимое
+            if self.content_hash:
+                self._manifest = blobs.load_artifact(self.content_hash, "chunks.json")
+            if self._manifest is None:
+                self._manifest = chunk_manifest(self.path)
+                if self.content_hash:
+                    blobs.save_artifact(self.content_hash, self._manifest, "chunks.json")
+        return self._manifest
+
+    def open_reader(self) -> ChunkReader:
+        return ChunkReader(self.manifest(), self.path)
+
+def get_version(db, file: models.CsvFile, version: int) -> VersionSource:
+    if version == file.version:
+        return VersionSource.current(file)
+    row = db.query(models.CsvFileVersion).filter(
+        models.CsvFileVersion.file_id == file.id,
+        models.CsvFileVersion.version == version
+    ).first()
+    if row is None:
+        raise VersionNotFound(version)
+    return VersionSource.archived(row)
+
+def list_versions(db, file: models.CsvFile) -> dict:
+    """Версии файла от новых к старым и объем, который они занимают в хранилище фрагментов"""
+    rows = db.query(models.CsvFileVersion).filter(
+        models.CsvFileVersion.file_id == file.id
+    ).order_by(models.CsvFileVersion.version.desc()).all()
+
+    versions = [{
+        "version": file.version,
+        "size": file.size,
+        "row_count": file.row_count,
+        "column_headers": file.column_headers,
+        "created_at": file.processed_at or file.created_at,
+        "current": True,
+    }]
+    unique_chunks = {}
+    logical_size = 0
+    for row in rows:
+        versions.append({
+            "version": row.version,
+            "size": row.size,
+            "row_count": row.row_count,
+            "column_headers": row.column_headers,
+            "created_at": row.created_at,
+            "current": False,
+            "chunks": len(row.chunks),
+        })
+        logical_size += row.size
+        for chunk_hash, size, _ in row.chunks:
+            unique_chunks[chunk_hash] = size
+    return {
+        "file_id": file.id,
+        "versions": versions,
+        # Прежние версии целиком и фактически сохраненные (общие фрагменты считаются один раз)
+        "history_size": logical_size,
+        "stored_size": sum(unique_chunks.values()),
+    }
+
+def read_rows(source: VersionSource, offset: int = 0, limit: Optional[int] = None) -> List[List[str]]:
+    """Окно строк данных версии"""
+    if source.is_current:
+        rows = iter_csv_rows(source.path, offset=offset)
+        return list(islice(rows, limit) if limit is not None else rows)
+
+    reader = source.open_reader()
+    # Запись 0 - заголовок
+    skip = reader.seek_record(offset + 1)
+    with io.TextIOWrapper(io.BufferedReader(reader, buffer_size=256 * 1024), encoding="utf-8", newline="") as text:
+        rows = islice(csv.reader(text), skip, None)
+        return list(islice(rows, limit) if limit is not None else rows)
+
+def _chunk_rows(reader: ChunkReader, first: int, last: int) -> List[List[str]]:
+    """Записи фрагментов first..last-1 без заголовка"""
+    data = b"".join(reader.chunk(number) for number in range(first, last))
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+    if first == 0 and rows:
+        rows = rows[1:]
+    return rows
+
+def _data_row(index: ChunkIndex, chunk: int) -> int:
+    """Номер первой строки данных во фрагменте chunk (chunk == len - конец файла)"""
+    record = index.first_records[chunk] if chunk < len(index.first_records) else index.records
+    return max(0, record - 1)
+
+def diff_versions(old: VersionSource, new: VersionSource) -> dict:
+    """Изменившиеся строки между двумя версиями
+
+    Общие фрагменты пропускаются без чтения; если изменившиеся фрагменты больше
+    VERSION_DIFF_MAX_BYTES, возвращается только сводка (truncated).
+    """
+    old_manifest, new_manifest = old.manifest(), new.manifest()
+    matcher = SequenceMatcher(None, [chunk[0] for chunk in old_manifest], [chunk[0] for chunk in new_manifest], autojunk=False)
+    opcodes = [opcode for opcode in matcher.get_opcodes() if opcode[0] != "equal"]
+    changed_size = sum(
+        sum(chunk[1] for chunk in old_manifest[i1:i2]) + sum(chunk[1] for chunk in new_manifest[j1:j2])
+        for _, i1, i2, j1, j2 in opcodes
+    )
+
+    result = {
+        "from_version": old.version,
+        "to_version": new.version,
+        "from_headers": old.headers,
+        "to_headers": new.headers,
+        "row_count": {"from": old.row_count, "to": new.row_count},
+        "chunks": {
+            "from": len(old_manifest),
+            "to": len(new_manifest),
+            "shared": sum(block.size for block in matcher.get_matching_blocks()),
+        },
+        "added": None,
+        "removed": None,
+        "hunks": [],
+        "truncated": False,
+    }
+    if changed_size > settings.VERSION_DIFF_MAX_BYTES:
+        result["truncated"] = True
+        return result
+
+    old_index, new_index = ChunkIndex(old_manifest), ChunkIndex(new_manifest)
+    added = removed = emitted = 0
+    with old.open_reader() as old_reader, new.open_reader() as new_reader:
+        for _, i1, i2, j1, j2 in opcodes:
+            old_rows = _chunk_rows(old_reader, i1, i2)
+            new_rows = _chunk_rows(new_reader, j1, j2)
+            old_base, new_base = _data_row(old_index, i1), _data_row(new_index, j1)
+            rows_matcher = SequenceMatcher(None, [tuple(row) for row in old_rows], [tuple(row) for row in new_rows], autojunk=False)
+            for tag, a1, a2, b1, b2 in rows_matcher.get_opcodes():
+                if tag == "equal":
+                    continue
+                removed += a2 - a1
+                added += b2 - b1
+                if emitted >= settings.VERSION_DIFF_MAX_ROWS:
+                    result["truncated"] = True
+                    continue
+                result["hunks"].append({
+                    "from_row": old_base + a1,
+                    "to_row": new_base + b1,
+                    "removed": old_rows[a1:a2],
+                    "added": new_rows[b1:b2],
+                })
+                emitted += (a2 - a1) + (b2 - b1)
+    result["added"] = added
+    result["removed"] = removed
+    return result
+
+async def archive_generation(db, file_id: int, version: int, path: str, content_hash: Optional[str],
+                             headers: List[str], row_count: int, size: int,
+                             created_at: Optional[datetime] = None) -> Optional[models.CsvFileVersion]:
+    """Сохраняет замененное содержимое файла как версию (вызывается до освобождения блоба)"""
+    if settings.VERSION_HISTORY_MAX_VERSIONS <= 0:
+        return None
+    try:
+        # Аренда не дает удалить прежнее поколение, пока оно режется на фрагменты
+        lease = await file_io.run(ReadLease, path)
+    except GenerationGone:
+        print(f"Version {version} of CSV file {file_id} is already gone, not archived")
+        return None
+    try:
+        source = await file_io.run(open_binary, path)
+        try:
+            writer = ChunkStoreWriter()
+            while await file_io.run(writer.copy_chunk, source, settings.FILE_IO_CHUNK_BYTES):
+                pass
+            manifest = await file_io.run(writer.finish)
+        finally:
+            await file_io.run(source.close)
+    finally:
+        await file_io.run(lease.close)
+
+    row = models.CsvFileVersion(
+        file_id=file_id,
+        version=version,
+        content_hash=content_hash,
+        size=size,
+        column_headers=headers,
+        row_count=row_count,
+        chunks=manifest,
+    )
+    if created_at is not None:
+        # Время, когда было записано это содержимое, а не время его замены
+        row.created_at = created_at
+    db.add(row)
+    # Новая версия должна учитываться в ограничении числа версий
+    db.flush()
+    pruned = prune_versions(db, file_id)
+    db.commit()
+    if pruned:
+        # Сборка мусора просматривает все манифесты: выполняется в фоне, а не в запросе
+        from server.services.reclaimer import reclaimer
+        reclaimer.schedule(chunks=True)
+    return row
+
+def prune_versions(db, file_id: int) -> int:
+    """Удаляет версии сверх ограничений хранения (без commit); возвращает число удаленных"""
+    rows = db.query(models.CsvFileVersion).filter(
+        models.CsvFileVersion.file_id == file_id
+    ).order_by(models.CsvFileVersion.version.desc()).all()
+    expired = rows[settings.VERSION_HISTORY_MAX_VERSIONS:]
+    if settings.VERSION_HISTORY_MAX_AGE_DAYS > 0:
+        threshold = datetime.utcnow() - timedelta(days=settings.VERSION_HISTORY_MAX_AGE_DAYS)
+        expired += [
+            row for row in rows[:settings.VERSION_HISTORY_MAX_VERSIONS]
+            if row.created_at is not None and row.created_at < threshold
+        ]
+    for row in expired:
+        db.delete(row)
+    return len(expired)
+
+def delete_history(db, file_ids: List[int]) -> int:
+    """Удаляет все версии файлов (без commit); возвращает число удаленных версий"""
+    return db.query(models.CsvFileVersion).filter(
+        models.CsvFileVersion.file_id.in_(file_ids)
+    ).delete(synchronize_session=False)
+
+def collect_garbage(db) -> int:
+    """Удаляет фрагменты, на которые не ссылается ни одна версия; возвращает число удаленных"""
+    referenced = set()
+    for (manifest,) in db.query(models.CsvFileVersion.chunks).yield_per(100):
+        referenced.update(chunk[0] for chunk in manifest)
+    return chunks.collect_garbage(referenced)
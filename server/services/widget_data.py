@@ -0,0 +1,204 @@
+"""Данные графиков виджетов дашборда, вычисляемые на сервере
+
+Работает с определениями виджетов из Dashboard.layout. Кроме существующих
+полей (type, dataSource - имя файла, dataColumn) виджет может задавать:
+
+    groupColumn   столбец категорий для bar/line: dataColumn агрегируется по группам
+    aggregate     count, sum, avg, min или max (по умолчанию sum, для pie - count)
+    dateColumn    для line/bar: временной ряд по столбцу дат, dataColumn агрегируется
+                  по периодам bucket (day, week, month) и прореживается до points точек
+    join          второй файл: {"dataSource": "...", "on": "Ответственный",
+                  "rightOn": "ФИО", "how": "inner|left|right|full"}
+
+Без groupColumn данные совпадают с тем, что строит ChartWidget в браузере:
+pie - количество значений dataColumn, bar/line - первые строки файла.
+Столбцы ищутся сначала в основном файле, затем в присоединенном.
+Соединение выполняется hash join за один проход по большему файлу.
+"""
+import itertools
+import os
+from typing import Dict, List, Optional, Tuple
+from server.config.settings import settings
+from server.services.csv_rows import iter_csv_rows
+from server.services.hash_join import JOIN_TYPES, HashJoin, JoinError, JoinSide
+from server.services.timeseries import TimeSeriesError, build_timeseries
+
+WIDGET_AGGREGATES = {"count", "sum", "avg", "min", "max"}
+
+# Строк в bar/line без группировки (как в ChartWidget)
+UNGROUPED_ROWS = 10
+
+class WidgetDataError(ValueError):
+    """Виджет нельзя построить: не хватает полей или нет столбца"""
+
+def widget_sources(widget: dict) -> List[str]:
+    """Имена файлов, нужных виджету"""
+    sources = []
+    if widget.get("dataSource"):
+        sources.append(widget["dataSource"])
+    join = widget.get("join")
+    if isinstance(join, dict) and join.get("dataSource"):
+        sources.append(join["dataSource"])
+    return sources
+
+def _to_number(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value.replace(",", ".").replace(" ", "").replace("\xa0", ""))
+    except ValueError:
+        return None
+
+class _Group:
+    __slots__ = ("count", "numbers", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.numbers = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, number: Optional[float]):
+        self.count += 1
+        if number is None:
+            return
+        self.numbers += 1
+        self.total += number
+        self.minimum = number if self.minimum is None else min(self.minimum, number)
+        self.maximum = number if self.maximum is None else max(self.maximum, number)
+
+    def value(self, aggregate: str) -> float:
+        if aggregate == "count":
+            return self.count
+        if aggregate == "sum":
+            return self.total
+        if aggregate == "avg":
+            return self.total / self.numbers if self.numbers else 0
+        result = self.minimum if aggregate == "min" else self.maximum
+        return result if result is not None else 0
+
+class _Columns:
+    """Расположение столбцов в проекции (основной файл, затем присоединенный)"""
+
+    def __init__(self, left_headers: List[str], right_headers: Optional[List[str]]):
+        self.left_headers = left_headers
+        self.right_headers = right_headers or []
+        self.left: List[int] = []
+        self.right: List[int] = []
+
+    def resolve(self, name: str) -> Tuple[str, int]:
+        """Сторона и позиция столбца в проекции этой стороны"""
+        for side, headers, projection in (("left", self.left_headers, self.left), ("right", self.right_headers, self.right)):
+            if name in headers:
+                index = headers.index(name)
+                if index not in projection:
+                    projection.append(index)
+                return side, projection.index(index)
+        raise WidgetDataError(f"Column '{name}' not found")
+
+def _pick(row: Tuple[Optional[List[str]], Optional[List[str]]], column: Tuple[str, int]) -> Optional[str]:
+    values = row[0] if column[0] == "left" else row[1]
+    return None if values is None else values[column[1]]
+
+def compute_widget_data(widget: dict, files: Dict[str, object]) -> dict:
+    """Данные графика [{name, value}] для виджета; files - CsvFile по имени"""
+    widget_type = widget.get("type")
+    data_column = widget.get("dataColumn")
+    if not widget.get("dataSource") or not data_column:
+        raise WidgetDataError("Widget has no dataSource or dataColumn")
+
+    group_column = widget.get("groupColumn")
+    aggregate = widget.get("aggregate") or ("count" if widget_type == "pie" else "sum")
+    if aggregate not in WIDGET_AGGREGATES:
+        raise WidgetDataError(f"Unsupported aggregate: {aggregate}")
+
+    left_file = files[widget["dataSource"]]
+    join = widget.get("join")
+    if widget.get("dateColumn") and widget_type in ("bar", "line"):
+        if join is not None:
+            raise WidgetDataError("Time series widgets do not support join")
+        points = widget.get("points") or settings.TIMESERIES_DEFAULT_POINTS
+        try:
+            series = build_timeseries(
+                left_file.path, left_file.content_hash, left_file.column_headers or [], widget["dateColumn"],
+                None if aggregate == "count" else data_column, widget.get("bucket") or "day", aggregate,
+                min(int(points), settings.TIMESERIES_MAX_POINTS)
+            )
+        except (TimeSeriesError, TypeError, ValueError) as e:
+            raise WidgetDataError(str(e))
+        return {"widget": widget.get("i"), "type": widget_type, "data": series["data"],
+                "row_count": series["total_points"], "downsampled": series["downsampled"]}
+
+    right_file = None
+    if join is not None:
+        if not isinstance(join, dict) or not join.get("dataSource") or not join.get("on"):
+            raise WidgetDataError("Join requires 'dataSource' and 'on'")
+        right_file = files[join["dataSource"]]
+
+    columns = _Columns(left_file.column_headers or [], right_file.column_headers if right_file else None)
+    value = columns.resolve(data_column)
+    group = columns.resolve(group_column) if group_column else None
+
+    hash_join = None
+    if right_file is None:
+        projection = columns.left
+        rows = ((([row[index] if index < len(row) else "" for index in projection]), None)
+                for row in iter_csv_rows(left_file.path))
+    else:
+        how = join.get("how") or "inner"
+        if how not in JOIN_TYPES:
+            raise WidgetDataError(f"Unsupported join type: {how}")
+        left_key, right_key = join["on"], join.get("rightOn") or join["on"]
+        if left_key not in columns.left_headers:
+            raise WidgetDataError(f"Column '{left_key}' not found in {left_file.name}")
+        if right_key not in columns.right_headers:
+            raise WidgetDataError(f"Column '{right_key}' not found in {right_file.name}")
+        try:
+            hash_join = HashJoin(
+                JoinSide(left_file.path, columns.left_headers.index(left_key), columns.left,
+                         left_file.size or os.path.getsize(left_file.path), left_file.row_count),
+                JoinSide(right_file.path, columns.right_headers.index(right_key), columns.right,
+                         right_file.size or os.path.getsize(right_file.path), right_file.row_count),
+                how,
+            )
+        except JoinError as e:
+            raise WidgetDataError(str(e))
+        rows = iter(hash_join)
+
+    if widget_type in ("bar", "line") and group is None:
+        # Как в ChartWidget: первые строки, значение - число из dataColumn
+        try:
+            data = [
+                {"name": f"Item {number + 1}", "value": _to_number(_pick(row, value)) or 0}
+                for number, row in enumerate(itertools.islice(rows, UNGROUPED_ROWS))
+            ]
+        finally:
+            # Дочитывать файлы (и удалять разделы соединения) не нужно
+            rows.close()
+        row_count = len(data)
+    else:
+        # pie без groupColumn считает значения самого dataColumn
+        key_column = group or value
+        groups: Dict[str, _Group] = {}
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            name = _pick(row, key_column)
+            if not name:
+                # Пустые категории не показываются (как в ChartWidget)
+                continue
+            entry = groups.get(name)
+            if entry is None:
+                entry = groups[name] = _Group()
+            entry.add(_to_number(_pick(row, value)) if aggregate != "count" else None)
+
+        data = [{"name": name, "value": entry.value(aggregate)} for name, entry in groups.items()]
+        if widget_type != "line":
+            data.sort(key=lambda item: item["value"], reverse=True)
+        data = data[:settings.WIDGET_MAX_GROUPS]
+
+    result = {"widget": widget.get("i"), "type": widget_type, "data": data, "row_count": row_count}
+    if hash_join is not None:
+        result["join"] = hash_join.stats()
+    return result
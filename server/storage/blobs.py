@@ -0,0 +1,291 @@
+"""Контентно-адресуемое хранилище загруженных файлов
+
+Содержимое файла хранится один раз под именем, равным его SHA-256
+(uploads/blobs/ab/<hash>.csv). Хеш считается во время записи потока, поэтому
+повторная загрузка тех же байтов не создает новой копии. Ссылки на блоб - это
+строки CsvFile с тем же content_hash: блоб удаляется, когда на него больше
+никто не ссылается. Рядом с блобом хранятся производные данные (заголовки,
+количество строк, индексы, кеши), которые переиспользуются для дубликатов.
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Optional, Set
+from server.config.settings import settings
+from server.storage.blocks import BlockWriter, resolve_codec
+from server.storage.generations import remove_unless_leased
+
+BLOB_EXTENSION = ".csv"
+
+# Размер блока при копировании потоков
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Блобы без ссылок, которые еще читают (удаляются повторно в reclaim_deferred)
+_deferred: Set[str] = set()
+_deferred_lock = threading.Lock()
+
+def blobs_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "blobs")
+
+def _tmp_dir() -> str:
+    return os.path.join(blobs_dir(), "tmp")
+
+def blob_path(content_hash: str) -> str:
+    return os.path.join(blobs_dir(), content_hash[:2], content_hash + BLOB_EXTENSION)
+
+def artifact_path(content_hash: str, name: str) -> str:
+    """Путь к производным данным блоба (name - например "meta.json")"""
+    return os.path.join(blobs_dir(), content_hash[:2], f"{content_hash}.{name}")
+
+def is_blob_path(path: Optional[str]) -> bool:
+    if not path:
+        return False
+    return os.path.abspath(path).startswith(os.path.abspath(blobs_dir()) + os.sep)
+
+class StoredBlob:
+    """Результат записи блоба"""
+
+    def __init__(self, content_hash: str, path: str, size: int, is_new: bool):
+        self.content_hash = content_hash
+        self.path = path
+        self.size = size
+        # False - такое содержимое уже было сохранено (дубликат)
+        self.is_new = is_new
+
+def _place_blob(tmp_path: str, content_hash: str, size: int) -> StoredBlob:
+    """Переносит готовый файл в постоянный путь блоба; дубликат удаляется"""
+    path = blob_path(content_hash)
+    if os.path.exists(path):
+        try:
+            # Обновляем время, чтобы сборщик мусора не удалил блоб до сохранения ссылки
+            os.utime(path)
+            os.remove(tmp_path)
+            return StoredBlob(content_hash, path, size, is_new=False)
+        except FileNotFoundError:
+            # Блоб был удален параллельно: сохраняем нашу копию
+            pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    return StoredBlob(content_hash, path, size, is_new=True)
+
+class BlobWriter(io.RawIOBase):
+    """Поток для записи блоба: данные пишутся во временный файл и хешируются на лету
+
+    После commit() файл атомарно переименовывается в свой постоянный путь;
+    если такой блоб уже существует, временная копия удаляется. Хеш и размер
+    всегда относятся к исходным байтам, даже если на диске блоб хранится
+    в блочно-сжатом формате (STORAGE_FORMAT=blocks).
+    """
+
+    def __init__(self):
+        super().__init__()
+        os.makedirs(_tmp_dir(), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=_tmp_dir(), suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._sink = self._file
+        if settings.STORAGE_FORMAT == "blocks":
+            self._sink = BlockWriter(self._file, resolve_codec(settings.STORAGE_CODEC), settings.STORAGE_BLOCK_SIZE)
+        self._hash = hashlib.sha256()
+        self._committed = False
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self._sink.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def copy_from(self, source) -> int:
+        """Копирует бинарный поток в блоб"""
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.write(chunk)
+        return self.size
+
+    def commit(self) -> StoredBlob:
+        if isinstance(self._sink, BlockWriter):
+            self._sink.finish()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._committed = True
+
+        return _place_blob(self._tmp_path, self._hash.hexdigest(), self.size)
+
+    def close(self):
+        if not self._committed and not self._file.closed:
+            # Запись прервана: удаляем временный файл
+            self._file.close()
+            try:
+                os.remove(self._tmp_path)
+            except FileNotFoundError:
+                pass
+        super().close()
+
+def store_stream(source) -> StoredBlob:
+    """Сохраняет бинарный поток как блоб"""
+    with BlobWriter() as writer:
+        writer.copy_from(source)
+        return writer.commit()
+
+def adopt_file(source_path: str, content_hash: str, size: int) -> StoredBlob:
+    """Сохраняет как блоб уже записанный на диск файл с известным хешем
+
+    Обычный формат - файл просто переименовывается (каталог должен быть на том же
+    разделе, что и uploads/blobs), блочный - сжимается во временный файл.
+    Исходный файл после вызова больше не существует.
+    """
+    if settings.STORAGE_FORMAT != "blocks":
+        return _place_blob(source_path, content_hash, size)
+
+    os.makedirs(_tmp_dir(), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=_tmp_dir(), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as target, open(source_path, "rb") as source:
+            writer = BlockWriter(target, resolve_codec(settings.STORAGE_CODEC), settings.STORAGE_BLOCK_SIZE)
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.finish()
+            target.flush()
+            os.fsync(target.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.remove(source_path)
+    return _place_blob(tmp_path, content_hash, size)
+
+def load_artifact(content_hash: str, name: str = "meta.json") -> Optional[Any]:
+    """Читает производные данные блоба (JSON), если они уже посчитаны"""
+    try:
+        with open(artifact_path(content_hash, name), "r", encoding="utf-8") as artifact:
+            return json.load(artifact)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_artifact(content_hash: str, data: Any, name: str = "meta.json"):
+    """Атомарно сохраняет производные данные блоба (JSON)"""
+    path = artifact_path(content_hash, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as artifact:
+        json.dump(data, artifact, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load_binary_artifact(content_hash: str, name: str) -> Optional[bytes]:
+    """Читает двоичные производные данные блоба (например, массив столбца)"""
+    try:
+        with open(artifact_path(content_hash, name), "rb") as artifact:
+            return artifact.read()
+    except FileNotFoundError:
+        return None
+
+def save_binary_artifact(content_hash: str, data: bytes, name: str):
+    """Атомарно сохраняет двоичные производные данные блоба"""
+    path = artifact_path(content_hash, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as artifact:
+        artifact.write(data)
+    os.replace(tmp_path, path)
+
+def count_references(db, content_hash: str) -> int:
+    from server.models import models
+    return db.query(models.CsvFile).filter(models.CsvFile.content_hash == content_hash).count()
+
+def _remove_blob(content_hash: str):
+    """Удаляет блоб и все его производные данные"""
+    pattern = os.path.join(blobs_dir(), content_hash[:2], content_hash + ".*")
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def release(db, content_hash: Optional[str], respect_grace: bool = True) -> bool:
+    """Удаляет блоб, если на него не осталось ссылок (вызывается после commit удаления/обновления)
+
+    Недавно записанный блоб не удаляется: параллельная загрузка тех же байтов
+    могла найти его, но еще не сохранить свою строку CsvFile. Такие блобы
+    позже удалит collect_garbage.
+    """
+    if not content_hash:
+        return False
+    if count_references(db, content_hash) > 0:
+        return False
+
+    path = blob_path(content_hash)
+    if respect_grace and os.path.exists(path):
+        if time.time() - os.path.getmtime(path) < settings.BLOB_GC_GRACE_SECONDS:
+            return False
+
+    removed = _reclaim(content_hash)
+    reclaim_deferred(db)
+    return removed
+
+def _reclaim(content_hash: str) -> bool:
+    """Удаляет блоб, если его не читают; иначе откладывает удаление"""
+    removed = remove_unless_leased(blob_path(content_hash), lambda: _remove_blob(content_hash))
+    with _deferred_lock:
+        if removed:
+            _deferred.discard(content_hash)
+        else:
+            _deferred.add(content_hash)
+    return removed
+
+def reclaim_deferred(db) -> int:
+    """Повторяет удаление блобов, отложенное из-за читателей; возвращает число удаленных"""
+    with _deferred_lock:
+        pending = list(_deferred)
+    removed = 0
+    for content_hash in pending:
+        if count_references(db, content_hash) > 0:
+            # Те же байты загрузили снова
+            with _deferred_lock:
+                _deferred.discard(content_hash)
+            continue
+        if _reclaim(content_hash):
+            removed += 1
+    return removed
+
+def deferred_count() -> int:
+    with _deferred_lock:
+        return len(_deferred)
+
+def collect_garbage(db) -> int:
+    """Удаляет блобы без ссылок и брошенные временные файлы; возвращает число удаленных блобов"""
+    removed = 0
+    now = time.time()
+    grace = settings.BLOB_GC_GRACE_SECONDS
+
+    for tmp_path in glob.glob(os.path.join(_tmp_dir(), "*")):
+        try:
+            if now - os.path.getmtime(tmp_path) > grace:
+                os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    for path in glob.glob(os.path.join(blobs_dir(), "??", "*" + BLOB_EXTENSION)):
+        content_hash = os.path.basename(path)[:-len(BLOB_EXTENSION)]
+        try:
+            if now - os.path.getmtime(path) <= grace:
+                continue
+        except FileNotFoundError:
+            continue
+        if count_references(db, content_hash) == 0 and _reclaim(content_hash):
+            removed += 1
+
+    return removed
@@ -0,0 +1,240 @@
+"""Блочно-сжатый формат хранения CSV с индексом блоков
+
+Файл состоит из независимо сжатых блоков (кадры gzip или zstd) и индекса
+в конце файла. Блоки режутся только по границам записей CSV (перевод строки
+вне кавычек), поэтому для чтения окна строк достаточно распаковать только
+нужные блоки, а произвольный доступ по смещению остается дешевым.
+
+Структура файла:
+    MAGIC | блок 1 | блок 2 | ... | индекс (JSON) | смещение индекса (8 байт) | длина индекса (8 байт) | MAGIC
+"""
+import bisect
+import gzip
+import io
+import json
+import struct
+from typing import List, Optional, Tuple
+
+MAGIC = b"NVBLK\x01\r\n"
+FOOTER = struct.Struct("<QQ")
+FOOTER_SIZE = FOOTER.size + len(MAGIC)
+
+CODECS = {"gzip", "zstd"}
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd codec requires the zstandard package")
+    return zstandard
+
+def resolve_codec(codec: str) -> str:
+    """Проверяет кодек; если zstandard не установлен, используется gzip"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown storage codec: {codec}")
+    if codec == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print("Warning: zstandard is not installed, using gzip for block storage")
+            return "gzip"
+    return codec
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def scan_records(data: bytes, in_quotes: bool = False) -> Tuple[int, int, bool]:
+    """Находит границы записей CSV: перевод строки вне кавычек
+
+    Экранированная кавычка ("") не меняет четность, поэтому состояние
+    "внутри кавычек" определяется четностью числа кавычек.
+    Возвращает (число завершенных записей, позиция после последней границы
+    или -1, состояние кавычек в конце данных).
+    """
+    count = 0
+    last_boundary = -1
+    position = 0
+    while True:
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            break
+        if data.count(b'"', position, newline) % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            count += 1
+            last_boundary = newline + 1
+        position = newline + 1
+    if data.count(b'"', position) % 2:
+        in_quotes = not in_quotes
+    return count, last_boundary, in_quotes
+
+def is_block_file(path: str) -> bool:
+    try:
+        with open(path, "rb") as source:
+            return source.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class BlockWriter(io.RawIOBase):
+    """Поток записи: буферизует данные и сжимает их блоками по границам записей"""
+
+    def __init__(self, sink, codec: str = "gzip", block_size: int = 1024 * 1024):
+        super().__init__()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown storage codec: {codec}")
+        self._sink = sink
+        self.codec = codec
+        self.block_size = block_size
+        self._buffer = bytearray()
+        self._in_quotes = False
+        self._raw_offset = 0
+        self._compressed_offset = len(MAGIC)
+        self._records = 0
+        # [смещение в исходных данных, смещение в файле, длина сжатого блока, длина блока, номер первой записи]
+        self._blocks: List[List[int]] = []
+        self._sink.write(MAGIC)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            if not self._cut_block():
+                break
+        return len(data)
+
+    def _cut_block(self) -> bool:
+        """Отрезает блок по последней границе записи; False, если границы пока нет"""
+        # Ищем границу только в пределах блока (плюс хвост, если запись длиннее блока)
+        _, boundary, _ = scan_records(bytes(self._buffer[:self.block_size]), self._in_quotes)
+        if boundary < 0:
+            _, boundary, _ = scan_records(bytes(self._buffer), self._in_quotes)
+            if boundary < 0:
+                return False
+        self._emit(bytes(self._buffer[:boundary]))
+        del self._buffer[:boundary]
+        return True
+
+    def _emit(self, raw: bytes):
+        records, _, self._in_quotes = scan_records(raw, self._in_quotes)
+        compressed = compress(raw, self.codec)
+        self._sink.write(compressed)
+        self._blocks.append([self._raw_offset, self._compressed_offset, len(compressed), len(raw), self._records])
+        self._raw_offset += len(raw)
+        self._compressed_offset += len(compressed)
+        self._records += records
+
+    def finish(self):
+        """Записывает оставшиеся данные, индекс и завершающую сигнатуру"""
+        if self._buffer:
+            tail = bytes(self._buffer)
+            self._buffer.clear()
+            self._emit(tail)
+            # Последняя запись может быть без перевода строки
+            if not tail.endswith(b"\n"):
+                self._records += 1
+        index = json.dumps({
+            "codec": self.codec,
+            "raw_size": self._raw_offset,
+            "records": self._records,
+            "blocks": self._blocks,
+        }).encode("utf-8")
+        self._sink.write(index)
+        self._sink.write(FOOTER.pack(self._compressed_offset, len(index)))
+        self._sink.write(MAGIC)
+
+class BlockIndex:
+    """Индекс блоков файла"""
+
+    def __init__(self, data: dict):
+        self.codec = data["codec"]
+        self.raw_size = data["raw_size"]
+        self.records = data["records"]
+        self.blocks = data["blocks"]
+        self._raw_offsets = [block[0] for block in self.blocks]
+        self._first_records = [block[4] for block in self.blocks]
+
+    @classmethod
+    def load(cls, source) -> "BlockIndex":
+        source.seek(-FOOTER_SIZE, io.SEEK_END)
+        footer = source.read(FOOTER_SIZE)
+        if footer[FOOTER.size:] != MAGIC:
+            raise ValueError("Block file is truncated or corrupted")
+        index_offset, index_length = FOOTER.unpack(footer[:FOOTER.size])
+        source.seek(index_offset)
+        return cls(json.loads(source.read(index_length)))
+
+    def block_for_offset(self, raw_offset: int) -> int:
+        return max(0, bisect.bisect_right(self._raw_offsets, raw_offset) - 1)
+
+    def block_for_record(self, record: int) -> int:
+        """Номер блока, в котором начинается запись с номером record (0 - заголовок)"""
+        return max(0, bisect.bisect_right(self._first_records, record) - 1)
+
+class BlockReader(io.RawIOBase):
+    """Поток чтения исходных байтов с произвольным доступом; распаковываются только нужные блоки"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._file = open(path, "rb")
+        self.index = BlockIndex.load(self._file)
+        self._position = 0
+        self._cached_block: Optional[int] = None
+        self._cached_data = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.index.raw_size
+        self._position = max(0, offset)
+        return self._position
+
+    def _block(self, number: int) -> bytes:
+        if self._cached_block != number:
+            _, compressed_offset, compressed_length, _, _ = self.index.blocks[number]
+            self._file.seek(compressed_offset)
+            self._cached_data = decompress(self._file.read(compressed_length), self.index.codec)
+            self._cached_block = number
+        return self._cached_data
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.index.raw_size or not self.index.blocks:
+            return 0
+        number = self.index.block_for_offset(self._position)
+        data = self._block(number)
+        start = self._position - self.index.blocks[number][0]
+        chunk = data[start:start + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek_record(self, record: int) -> int:
+        """Переходит к началу блока с записью record; возвращает число записей, которые нужно пропустить"""
+        if not self.index.blocks:
+            return 0
+        number = self.index.block_for_record(record)
+        raw_offset, _, _, _, first_record = self.index.blocks[number]
+        self.seek(raw_offset)
+        return record - first_record
+
+    def close(self):
+        self._file.close()
+        super().close()
@@ -0,0 +1,308 @@
+"""Хранилище версий файлов: фрагменты с границами по содержимому (content-defined chunking)
+
+Сохраненная версия файла - это манифест, список фрагментов
+[[sha256, длина, число записей], ...]. Каждый фрагмент хранится сжатым
+один раз (uploads/chunks/ab/<hash>.chunk), поэтому версии, отличающиеся
+несколькими строками, делят все неизменившиеся фрагменты.
+
+Граница фрагмента выбирается по содержимому, а не по смещению: кандидаты -
+границы записей CSV (перевод строки вне кавычек), и запись заканчивает
+фрагмент, если хеш окна из CHUNK_WINDOW байт перед границей меньше порога,
+пропорционального длине записи. В среднем фрагмент получается около
+VERSION_CHUNK_AVG_SIZE байт (не меньше MIN и не больше MAX, кроме записей
+длиннее MAX). Вставка или удаление строк меняет только фрагменты рядом
+с изменением: следующие границы находятся по тем же окнам, что и раньше.
+
+Фрагменты режутся по границам записей, поэтому для чтения окна строк
+достаточно распаковать только фрагменты, содержащие эти строки.
+"""
+import bisect
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import time
+import zlib
+from typing import Iterable, List, Optional, Set, Tuple
+from server.config.settings import settings
+from server.storage.blocks import compress, decompress, resolve_codec, scan_records
+from server.storage.files import open_binary
+
+CHUNK_EXTENSION = ".chunk"
+
+# Размер окна, по хешу которого выбирается граница фрагмента
+CHUNK_WINDOW = 64
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Фрагмент, который удаляет сборщик мусора
+_TOMBSTONE_EXTENSION = ".gc"
+
+def chunks_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "chunks")
+
+def chunk_path(chunk_hash: str) -> str:
+    return os.path.join(chunks_dir(), chunk_hash[:2], chunk_hash + CHUNK_EXTENSION)
+
+class Chunker:
+    """Делит поток байтов CSV на фрагменты по границам записей, выбранным по содержимому"""
+
+    def __init__(self, min_size: int, avg_size: int, max_size: int):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        # Вероятность границы после записи длиной n байт - n / (avg - min)
+        self._scale = (1 << 32) / max(1, avg_size - self.min_size)
+        self._buffer = bytearray()
+        self._in_quotes = False
+        self._position = 0  # до этой позиции буфер уже разобран
+        self._record_start = 0
+        self._records = 0
+
+    def feed(self, data) -> List[Tuple[bytes, int]]:
+        """Добавляет данные; возвращает готовые фрагменты (байты, число записей)"""
+        self._buffer += data
+        chunks = []
+        while True:
+            chunk = self._cut()
+            if chunk is None:
+                return chunks
+            chunks.append(chunk)
+
+    def finish(self) -> List[Tuple[bytes, int]]:
+        """Остаток данных - последний фрагмент"""
+        if not self._buffer:
+            return []
+        tail = bytes(self._buffer)
+        records, _, _ = scan_records(tail[self._position:], self._in_quotes)
+        records += self._records
+        # Последняя запись может быть без перевода строки
+        if not tail.endswith(b"\n"):
+            records += 1
+        self._buffer.clear()
+        return [(tail, records)]
+
+    def _cut(self) -> Optional[Tuple[bytes, int]]:
+        buffer = self._buffer
+        position = self._position
+        # До минимального размера границы не проверяются: записи без кавычек считаются разом
+        if not self._in_quotes and position < self.min_size:
+            last_newline = buffer.rfind(b"\n", position, min(len(buffer), self.min_size))
+            if last_newline >= 0 and buffer.find(b'"', position, last_newline) < 0:
+                self._records += buffer.count(b"\n", position, last_newline + 1)
+                position = self._record_start = last_newline + 1
+
+        while True:
+            newline = buffer.find(b"\n", position)
+            if newline < 0:
+                self._position = position
+                return None
+            if buffer.count(b'"', position, newline) % 2:
+                self._in_quotes = not self._in_quotes
+            position = newline + 1
+            if self._in_quotes:
+                continue
+            self._records += 1
+            length = position - self._record_start
+            self._record_start = position
+            if position < self.min_size:
+                continue
+            if (position >= self.max_size
+                    or zlib.crc32(buffer[max(0, position - CHUNK_WINDOW):position]) < length * self._scale):
+                chunk = (bytes(buffer[:position]), self._records)
+                del buffer[:position]
+                self._position = self._record_start = self._records = 0
+                return chunk
+
+def new_chunker() -> Chunker:
+    return Chunker(settings.VERSION_CHUNK_MIN_SIZE, settings.VERSION_CHUNK_AVG_SIZE, settings.VERSION_CHUNK_MAX_SIZE)
+
+def put_chunk(data: bytes) -> str:
+    """Сохраняет фрагмент, если его еще нет; возвращает его хеш"""
+    chunk_hash = hashlib.sha256(data).hexdigest()
+    path = chunk_path(chunk_hash)
+    try:
+        # Обновляем время, чтобы сборщик мусора не удалил фрагмент до сохранения манифеста
+        os.utime(path)
+        return chunk_hash
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as target:
+            target.write(compress(data, resolve_codec(settings.STORAGE_CODEC)))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return chunk_hash
+
+def get_chunk(chunk_hash: str) -> bytes:
+    with open(chunk_path(chunk_hash), "rb") as source:
+        data = source.read()
+    return decompress(data, "zstd" if data.startswith(_ZSTD_MAGIC) else "gzip")
+
+class ChunkStoreWriter:
+    """Сохраняет поток как фрагменты и собирает манифест версии"""
+
+    def __init__(self):
+        self._chunker = new_chunker()
+        self.manifest: List[list] = []
+
+    def _store(self, chunks: Iterable[Tuple[bytes, int]]):
+        for data, records in chunks:
+            self.manifest.append([put_chunk(data), len(data), records])
+
+    def write(self, data):
+        self._store(self._chunker.feed(data))
+
+    def copy_chunk(self, source, limit: int) -> int:
+        """Переносит не больше limit байт из потока; 0 - поток закончился"""
+        data = source.read(limit)
+        if data:
+            self.write(data)
+        return len(data)
+
+    def finish(self) -> List[list]:
+        self._store(self._chunker.finish())
+        return self.manifest
+
+def chunk_manifest(path: str) -> List[list]:
+    """Манифест сохраненного файла без записи фрагментов (для сравнения с текущей версией)"""
+    chunker = new_chunker()
+    manifest = []
+    with open_binary(path) as source:
+        while True:
+            data = source.read(settings.FILE_IO_CHUNK_BYTES)
+            chunks = chunker.feed(data) if data else chunker.finish()
+            for chunk, records in chunks:
+                manifest.append([hashlib.sha256(chunk).hexdigest(), len(chunk), records])
+            if not data:
+                return manifest
+
+class ChunkIndex:
+    """Смещения и номера первых записей фрагментов манифеста"""
+
+    def __init__(self, manifest: List[list]):
+        self.manifest = manifest
+        self.offsets = []
+        self.first_records = []
+        offset, records = 0, 0
+        for _, size, count in manifest:
+            self.offsets.append(offset)
+            self.first_records.append(records)
+            offset += size
+            records += count
+        self.raw_size = offset
+        self.records = records
+
+    def chunk_for_offset(self, offset: int) -> int:
+        return max(0, bisect.bisect_right(self.offsets, offset) - 1)
+
+    def chunk_for_record(self, record: int) -> int:
+        """Номер фрагмента, в котором начинается запись record (0 - заголовок)"""
+        return max(0, bisect.bisect_right(self.first_records, record) - 1)
+
+class ChunkReader(io.RawIOBase):
+    """Поток чтения версии с произвольным доступом; распаковываются только нужные фрагменты
+
+    path - файл текущей версии: фрагменты читаются из него по смещениям,
+    а не из хранилища фрагментов.
+    """
+
+    def __init__(self, manifest: List[list], path: Optional[str] = None):
+        super().__init__()
+        self.index = ChunkIndex(manifest)
+        self._source = open_binary(path) if path else None
+        self._position = 0
+        self._cached_chunk: Optional[int] = None
+        self._cached_data = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.index.raw_size
+        self._position = max(0, offset)
+        return self._position
+
+    def chunk(self, number: int) -> bytes:
+        if self._cached_chunk != number:
+            if self._source is not None:
+                self._source.seek(self.index.offsets[number])
+                self._cached_data = self._source.read(self.index.manifest[number][1])
+            else:
+                self._cached_data = get_chunk(self.index.manifest[number][0])
+            self._cached_chunk = number
+        return self._cached_data
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.index.raw_size or not self.index.manifest:
+            return 0
+        number = self.index.chunk_for_offset(self._position)
+        data = self.chunk(number)
+        start = self._position - self.index.offsets[number]
+        piece = data[start:start + len(buffer)]
+        buffer[:len(piece)] = piece
+        self._position += len(piece)
+        return len(piece)
+
+    def seek_record(self, record: int) -> int:
+        """Переходит к началу фрагмента с записью record; возвращает число записей, которые нужно пропустить"""
+        if not self.index.manifest:
+            return 0
+        number = self.index.chunk_for_record(record)
+        self.seek(self.index.offsets[number])
+        return record - self.index.first_records[number]
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+        super().close()
+
+def _remove_if_stale(path: str, grace: float) -> bool:
+    """Удаляет фрагмент, если его не обновляли дольше grace секунд
+
+    Фрагмент сначала переименовывается: put_chunk, который успел обновить время
+    до переименования, видит свежий mtime и фрагмент возвращается на место, а
+    put_chunk после переименования не найдет файл и запишет фрагмент заново.
+    """
+    tombstone = path + _TOMBSTONE_EXTENSION
+    os.rename(path, tombstone)
+    if time.time() - os.path.getmtime(tombstone) <= grace:
+        os.rename(tombstone, path)
+        return False
+    os.remove(tombstone)
+    return True
+
+def collect_garbage(referenced: Set[str]) -> int:
+    """Удаляет фрагменты, которых нет ни в одном манифесте; возвращает число удаленных"""
+    removed = 0
+    now = time.time()
+    grace = settings.BLOB_GC_GRACE_SECONDS
+    for path in glob.glob(os.path.join(chunks_dir(), "??", "*")):
+        name = os.path.basename(path)
+        try:
+            if now - os.path.getmtime(path) <= grace:
+                continue
+            if name.endswith((".part", _TOMBSTONE_EXTENSION)):
+                # Брошенная запись фрагмента или прерванное удаление
+                os.remove(path)
+            elif name[:-len(CHUNK_EXTENSION)] not in referenced and _remove_if_stale(path, grace):
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,53 @@
+"""Открытие сохраненных файлов независимо от формата хранения (обычный или блочно-сжатый)"""
+import bisect
+import io
+import os
+from typing import Tuple
+from server.storage import blobs
+from server.storage.blocks import BlockReader, is_block_file
+
+def open_binary(path: str):
+    """Поток исходных байтов файла с поддержкой seek"""
+    if is_block_file(path):
+        return io.BufferedReader(BlockReader(path), buffer_size=256 * 1024)
+    return open(path, "rb")
+
+def open_text(path: str):
+    """Текстовый поток (UTF-8) для csv.reader"""
+    if is_block_file(path):
+        return io.TextIOWrapper(open_binary(path), encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def open_text_at_record(path: str, record: int) -> Tuple[io.TextIOBase, int]:
+    """Текстовый поток, начинающийся как можно ближе к записи record (0 - заголовок)
+
+    Возвращает поток и количество записей, которые нужно пропустить до record.
+    Для блочного формата распаковываются только блоки начиная с нужного,
+    обычный файл читается с ближайшей записи из сохраненных смещений
+    (offsets.json рядом с блобом), а без них - с начала.
+    """
+    if is_block_file(path):
+        reader = BlockReader(path)
+        skip = reader.seek_record(record)
+        return io.TextIOWrapper(io.BufferedReader(reader, buffer_size=256 * 1024), encoding="utf-8", newline=""), skip
+
+    record_offsets = None
+    if record and blobs.is_blob_path(path):
+        content_hash = os.path.basename(path)[:-len(blobs.BLOB_EXTENSION)]
+        record_offsets = blobs.load_artifact(content_hash, "offsets.json")
+    if record_offsets:
+        offsets = record_offsets["offsets"]
+        position = bisect.bisect_right(offsets, [record, float("inf")]) - 1
+        if position >= 0:
+            start_record, byte_offset = offsets[position]
+            source = open(path, "rb")
+            source.seek(byte_offset)
+            return io.TextIOWrapper(source, encoding="utf-8", newline=""), record - start_record
+    return open(path, "r", encoding="utf-8", newline=""), record
+
+def stored_size(path: str) -> int:
+    """Размер содержимого файла в исходном (несжатом) виде"""
+    if is_block_file(path):
+        with BlockReader(path) as reader:
+            return reader.index.raw_size
+    return os.path.getsize(path)
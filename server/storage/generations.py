@@ -0,0 +1,142 @@
+"""Поколения содержимого файлов: аренды чтения и отложенное удаление
+
+Запись никогда не меняет существующий файл: новое содержимое - это новый
+блоб (новое поколение), который публикуется атомарным os.replace, а строка
+CsvFile переключается на него одним UPDATE с проверкой и увеличением
+version. Поэтому читатель не может увидеть частично записанный файл.
+
+Читатель берет аренду - открытый дескриптор поколения с разделяемой
+блокировкой flock (LOCK_SH | LOCK_NB, без ожидания) - и держит ее до конца
+чтения. Освободившееся поколение удаляется только под исключительной
+блокировкой (LOCK_EX | LOCK_NB): пока его кто-то читает, удаление
+откладывается (см. blobs.reclaim_deferred). Читатель, опоздавший к уже
+удаленному поколению, получает GenerationGone и перечитывает строку CsvFile.
+Аренды видны всем воркерам, так как flock действует между процессами.
+"""
+import os
+import threading
+from contextlib import ExitStack
+from typing import Callable, Iterable, Iterator, Sequence
+from sqlalchemy.exc import InvalidRequestError
+
+try:
+    import fcntl
+except ImportError:
+    # Без flock (Windows) аренда только проверяет, что поколение еще существует
+    fcntl = None
+
+# Сколько раз читатель перечитывает строку CsvFile, если его поколение удалили
+READ_ATTEMPTS = 3
+
+_lock = threading.Lock()
+_active = 0
+
+class GenerationGone(Exception):
+    """Поколение файла уже удалено: нужно перечитать строку CsvFile"""
+
+class ReadLease:
+    """Аренда поколения: пока она открыта, файл не будет удален"""
+
+    def __init__(self, path: str):
+        global _active
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise GenerationGone(path)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            # Файл мог быть удален между open и flock
+            if os.fstat(fd).st_nlink == 0:
+                raise GenerationGone(path)
+        except (BlockingIOError, GenerationGone):
+            os.close(fd)
+            raise GenerationGone(path)
+        self._fd = fd
+        with _lock:
+            _active += 1
+
+    def close(self):
+        global _active
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            with _lock:
+                _active -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Аренда потокового ответа, который так и не начали читать
+        if getattr(self, "_fd", None) is not None:
+            self.close()
+
+def active_leases() -> int:
+    """Число открытых аренд в текущем воркере"""
+    return _active
+
+def remove_unless_leased(path: str, remove: Callable[[], None]) -> bool:
+    """Вызывает remove(), если поколение path никто не читает; False - есть читатели"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        remove()
+        return True
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        # Файл удаляется под блокировкой: новые читатели не получат аренду
+        remove()
+        return True
+    finally:
+        os.close(fd)
+
+def _refresh(db, files: Sequence):
+    try:
+        for file in files:
+            db.refresh(file)
+    except InvalidRequestError:
+        # Строку удалили вместе с последним поколением
+        raise GenerationGone("file was deleted")
+
+def read_current(db, files: Sequence, func: Callable):
+    """func() под арендами текущих поколений файлов
+
+    Если поколение удалили раньше, чем удалось взять аренду, строки CsvFile
+    перечитываются и чтение повторяется с новым поколением.
+    """
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            with ExitStack() as stack:
+                for file in files:
+                    if file.path:
+                        stack.enter_context(ReadLease(file.path))
+                return func()
+        except GenerationGone:
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            _refresh(db, files)
+
+def leased_rows(lease: ReadLease, rows: Iterable) -> Iterator:
+    """Строки потокового ответа; аренда освобождается после последней строки"""
+    try:
+        yield from rows
+    finally:
+        lease.close()
+
+def acquire_current(db, file) -> ReadLease:
+    """Аренда текущего поколения файла для потокового ответа"""
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            return ReadLease(file.path)
+        except GenerationGone:
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            _refresh(db, [file])
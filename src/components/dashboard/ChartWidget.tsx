@@ -29,9 +29,12 @@ interface ChartWidgetProps {
   onDelete: () => void;
   dataSource?: string; // Источник данных (имя файла)
   dataColumn?: string; // Столбец данных для отображения
+  dateColumn?: string; // Столбец дат: ряд строится на сервере по всему файлу
+  bucket?: string; // Период группировки (day, week, month)
+  aggregate?: string; // Агрегат значений за период
 }
 
-const ChartWidget: React.FC<ChartWidgetProps> = ({ type, title, onDelete, dataSource, dataColumn }) => {
+const ChartWidget: React.FC<ChartWidgetProps> = ({ type, title, onDelete, dataSource, dataColumn, dateColumn, bucket, aggregate }) => {
   const [showMenu, setShowMenu] = useState(false);
   const [chartData, setChartData] = useState<ChartDataItem[]>([]);
   const [isLoading, setIsLoading] = useState(false);
@@ -50,6 +53,28 @@ const ChartWidget: React.FC<ChartWidgetProps> = ({ type, title, onDelete, dataSo
       setError(null);
 
       try {
+        // Временной ряд группируется и прореживается на сервере
+        if (dateColumn && type !== 'pie') {
+          const seriesResponse = await fetch(`${API_URL}/dashboards/widget-data`, {
+            method: 'POST',
+            headers: {
+              'Authorization': `Bearer ${token}`,
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+              widget: { type, dataSource, dataColumn, dateColumn, bucket, aggregate }
+            })
+          });
+
+          if (!seriesResponse.ok) {
+            throw new Error('Не удалось построить временной ряд');
+          }
+
+          const series = await seriesResponse.json();
+          setChartData(series.data);
+          return;
+        }
+
         // Получаем все файлы, чтобы найти ID нужного файла
         const filesResponse = await fetch(`${API_URL}/csv-files`, {
           headers: {
@@ -135,7 +160,7 @@ const ChartWidget: React.FC<ChartWidgetProps> = ({ type, title, onDelete, dataSo
     };
     
     fetchChartData();
-  }, [dataSource, dataColumn, token, type]);
+  }, [dataSource, dataColumn, dateColumn, bucket, aggregate, token, type]);
 
   // Render chart based on type
   const renderChart = () => {
@@ -33,6 +33,9 @@ interface Widget {
   data?: any; // Добавляем данные для виджета
   dataSource?: string; // Источник данных
   dataColumn?: string; // Столбец данных
+  dateColumn?: string; // Столбец дат для временного ряда (line/bar)
+  bucket?: 'day' | 'week' | 'month'; // Период группировки временного ряда
+  aggregate?: string; // Агрегат значений за период
 }
 
 // Интерфейс для CSV-файла
@@ -703,6 +706,9 @@ const DashboardPage: React.FC = () => {
             onDelete={() => deleteWidget(widget.i)}
             dataSource={widget.dataSource}
             dataColumn={widget.dataColumn}
+            dateColumn={widget.dateColumn}
+            bucket={widget.bucket}
+            aggregate={widget.aggregate}
           />
         );
       case 'metric':